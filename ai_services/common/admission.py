@@ -0,0 +1,123 @@
+# common/admission.py
+#
+# Shared by the NER and X-ray services.
+
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+
+
+class Overloaded(Exception):
+    """Raised when the admission queue is full. Mapped to HTTP 429."""
+    def __init__(self, retry_after: int):
+        super().__init__(f"Service overloaded, retry after {retry_after}s.")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds in-flight model work for one event loop.
+
+    At most `max_concurrent` requests execute at once and at most
+    `max_queue` more wait for a slot. Anything beyond that is rejected
+    immediately with `Overloaded`, carrying a Retry-After estimate derived
+    from the measured service time, instead of piling up until clients
+    time out.
+    """
+    # Weight of the newest sample in the moving averages
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, max_concurrent: int, max_queue: int, name: str = "inference"):
+        """
+        Args:
+            max_concurrent (int): Requests allowed to execute at the same time.
+            max_queue (int): Requests allowed to wait for a free slot.
+            name (str): Name used in metrics.
+        """
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.avg_wait = 0.0
+        self.max_wait = 0.0
+        self.avg_service = 0.0
+
+    def _ewma(self, average: float, sample: float) -> float:
+        return sample if average == 0.0 else average + self.EWMA_ALPHA * (sample - average)
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to free up for a new request."""
+        backlog = self.waiting + 1
+        return max(1, math.ceil(self.avg_service * backlog / self.max_concurrent))
+
+    def check(self):
+        """
+        Rejects a request now if it couldn't even queue, without taking a
+        slot. For callers that acquire later (e.g. once a stream starts).
+
+        Raises:
+            Overloaded: If all slots are busy and the queue is full.
+        """
+        if self.active >= self.max_concurrent and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(self.retry_after())
+
+    async def acquire(self):
+        """
+        Waits for an execution slot.
+
+        Raises:
+            Overloaded: If all slots are busy and the queue is full.
+        """
+        self.check()
+
+        self.waiting += 1
+        started = time.monotonic()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - started
+        self.avg_wait = self._ewma(self.avg_wait, waited)
+        self.max_wait = max(self.max_wait, waited)
+        self.active += 1
+        self.admitted += 1
+
+    def release(self, service_time: float):
+        """Frees a slot and records how long the request held it."""
+        self.active -= 1
+        self.avg_service = self._ewma(self.avg_service, service_time)
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def admit(self):
+        """Holds an execution slot for the duration of the block."""
+        await self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self) -> dict:
+        """Returns queue depth, wait-time and rejection metrics."""
+        return {
+            "name": self.name,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.avg_wait * 1000.0, 2),
+            "max_wait_ms": round(self.max_wait * 1000.0, 2),
+            "avg_service_ms": round(self.avg_service * 1000.0, 2),
+            "retry_after_s": self.retry_after(),
+        }
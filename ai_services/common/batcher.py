@@ -0,0 +1,157 @@
+# common/batcher.py
+#
+# Shared by the NER and X-ray services.
+
+import threading
+import time
+from concurrent.futures import Future
+from queue import Queue, Empty
+from typing import Callable, List
+
+
+class BatcherStopped(RuntimeError):
+    """Set on the futures of items still queued when the batcher stops."""
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-item requests into batched calls.
+
+    Callers submit items from any thread and receive a Future. A background
+    thread collects items until either `max_batch_size` items are waiting or
+    `max_wait_ms` has elapsed since the first item of the batch arrived, then
+    runs `batch_fn` once over the whole batch and resolves every Future with
+    its own result, in submission order. With `num_workers` > 1, several
+    threads form and run batches concurrently (e.g. one per inference
+    process), so a new batch can start while others are still running.
+    """
+    def __init__(self, batch_fn: Callable[[list], list], max_batch_size: int = 16, max_wait_ms: float = 10.0, name: str = "batcher", num_workers: int = 1):
+        """
+        Args:
+            batch_fn (callable): Takes a list of items and returns a list of
+                                 results of the same length and order.
+            max_batch_size (int): Maximum number of items per batch.
+            max_wait_ms (float): Maximum time to wait for a batch to fill up.
+            name (str): Name used for the worker threads and in log messages.
+            num_workers (int): Number of batches that may run at the same time.
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+
+        self._queue = Queue()
+        self._stopped = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            for i in range(max(1, num_workers))
+        ]
+        self._counter_lock = threading.Lock()
+
+        # Simple counters, exposed through stats()
+        self.batches_run = 0
+        self.items_processed = 0
+
+    def start(self):
+        """Starts the background batching threads."""
+        for thread in self._threads:
+            if not thread.is_alive():
+                thread.start()
+
+    def stop(self):
+        """
+        Stops the background threads after their current batches finish.
+        Items still queued are failed with `BatcherStopped`, so their
+        callers don't wait forever.
+        """
+        self._stopped.set()
+        for thread in self._threads:
+            if thread.is_alive():
+                thread.join(timeout=5)
+        self._fail_queued()
+
+    def submit(self, item) -> Future:
+        """
+        Queues a single item and returns a Future for its result.
+        After `stop`, the Future fails at once with `BatcherStopped`.
+        """
+        future = Future()
+        if self._stopped.is_set():
+            future.set_exception(BatcherStopped(f"{self.name} is stopped"))
+            return future
+        self._queue.put((item, future))
+        # Closes the race with a concurrent stop() that already drained the queue
+        if self._stopped.is_set():
+            self._fail_queued()
+        return future
+
+    def submit_many(self, items: list) -> List[Future]:
+        """Queues several items at once; they will usually share a batch."""
+        return [self.submit(item) for item in items]
+
+    def stats(self) -> dict:
+        """Returns basic batching statistics."""
+        return {
+            "batches_run": self.batches_run,
+            "items_processed": self.items_processed,
+            "avg_batch_size": round(self.items_processed / self.batches_run, 2) if self.batches_run else 0.0,
+            "queued": self._queue.qsize(),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "workers": len(self._threads),
+        }
+
+    def _fail_queued(self):
+        while True:
+            try:
+                _, future = self._queue.get_nowait()
+            except Empty:
+                return
+            if future.set_running_or_notify_cancel():
+                future.set_exception(BatcherStopped(f"{self.name} stopped before the item ran"))
+
+    def _collect(self) -> list:
+        """Blocks for the first item, then gathers more until the batch is full or the window closes."""
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except Empty:
+            return []
+
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+
+            # Skip items whose callers have already given up
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            items = [item for item, _ in batch]
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: batch function returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                print(f"Error in {self.name} batch of {len(items)}: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            with self._counter_lock:
+                self.batches_run += 1
+                self.items_processed += len(items)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
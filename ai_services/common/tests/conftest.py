@@ -0,0 +1,7 @@
+# common/tests/conftest.py
+
+import os
+import sys
+
+# Make the shared modules importable as `common.*`, as the services do
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
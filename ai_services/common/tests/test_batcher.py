@@ -0,0 +1,52 @@
+# common/tests/test_batcher.py
+
+import threading
+
+import pytest
+
+from common.batcher import BatcherStopped, MicroBatcher
+
+
+def test_batches_concurrent_items_in_order():
+    batcher = MicroBatcher(lambda items: [item * 2 for item in items], max_batch_size=8, max_wait_ms=50)
+    batcher.start()
+    try:
+        futures = batcher.submit_many([1, 2, 3])
+        assert [future.result(timeout=5) for future in futures] == [2, 4, 6]
+        assert batcher.stats()["batches_run"] == 1
+    finally:
+        batcher.stop()
+
+
+def test_stop_fails_queued_items():
+    started, release = threading.Event(), threading.Event()
+
+    def blocking_batch(items):
+        started.set()
+        release.wait(timeout=10)
+        return items
+
+    batcher = MicroBatcher(blocking_batch, max_batch_size=1, max_wait_ms=0)
+    batcher.start()
+    running = batcher.submit("running")
+    assert started.wait(timeout=5)
+    # Queued behind the batch that is blocked in blocking_batch
+    queued = batcher.submit_many(["a", "b"])
+
+    stopper = threading.Thread(target=batcher.stop)
+    stopper.start()
+    release.set()
+    stopper.join(timeout=10)
+
+    assert running.result(timeout=5) == "running"
+    for future in queued:
+        with pytest.raises(BatcherStopped):
+            future.result(timeout=5)
+
+
+def test_submit_after_stop_fails_at_once():
+    batcher = MicroBatcher(lambda items: items)
+    batcher.start()
+    batcher.stop()
+    with pytest.raises(BatcherStopped):
+        batcher.submit("late").result(timeout=1)
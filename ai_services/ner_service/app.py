@@ -1,9 +1,26 @@
 # ner-service/app.py
 
-from fastapi import FastAPI, HTTPException
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Header, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List
-from ner_model import ner_model # Import the instantiated model
+from typing import List, Optional, Literal
+# Modules shared by the AI services live in ai_services/common
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import compact
+import config
+from common.admission import AdmissionController, Overloaded
+from common.batcher import MicroBatcher
+from cache import NERResultCache
+from ner_model import NERModel
+from segments import SegmentMemo
+from workers import InferencePool
 
 # --- Pydantic Models for Request and Response ---
 
@@ -16,11 +33,137 @@ class Entity(BaseModel):
     text: str
     label: str
     confidence: float
+    # Character offsets of the entity in the submitted text
+    start: Optional[int] = None
+    end: Optional[int] = None
 
 class NERResponse(BaseModel):
     """Defines the structure for the API response."""
     entities: List[Entity]
 
+class BatchTextInput(BaseModel):
+    """Defines the structure for a batch extraction request."""
+    texts: List[str] = Field(
+        ...,
+        min_length=1,
+        max_length=config.NER_MAX_TEXTS_PER_REQUEST,
+        description="The texts to be analyzed, processed together in batches."
+    )
+
+class BatchNERResponse(BaseModel):
+    """Defines the structure for a batch extraction response, one result per input text."""
+    results: List[NERResponse]
+
+class CacheInvalidateResponse(BaseModel):
+    """Defines the structure for a cache invalidation response."""
+    scope: str
+    removed: int
+
+
+# --- Model Lifecycle ---
+
+class ServiceState:
+    """
+    Holds the model and its helpers once they are loaded.
+    Loading happens in the background so the server can bind immediately;
+    `status` moves from "starting" to "loading", "warming" and then
+    "ready", or to "failed" with the error recorded.
+    """
+    def __init__(self):
+        self.status = "starting"
+        self.error = None
+        self.model = None
+        self.pool = None
+        self.batcher = None
+        self.cache = None
+        self.segment_memo = None
+        self.admission = None
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+state = ServiceState()
+
+
+def load_model():
+    """Loads and warms up the model, then starts the batcher and cache. Runs in a worker thread."""
+    try:
+        state.status = "loading"
+        if state.pool:
+            # The pool's workers load and warm up the weights; this process
+            # only needs the tokenizer to plan windows.
+            model = NERModel(load_pipeline=False)
+            state.status = "warming"
+            state.pool.wait_ready()
+            # The backend the workers actually run (ONNX may fall back to torch)
+            model.backend = state.pool.backend
+            predict_batch, concurrent_batches = state.pool.predict_batch, state.pool.num_workers
+        else:
+            model = NERModel()
+            state.status = "warming"
+            model.warm_up()
+            predict_batch, concurrent_batches = model.predict_batch, 1
+
+        # Concurrent requests share forward passes through the micro-batcher.
+        # With a worker pool, one batch per worker can be in flight at once.
+        batcher = MicroBatcher(
+            predict_batch,
+            max_batch_size=config.NER_MAX_BATCH_SIZE,
+            max_wait_ms=config.NER_MAX_BATCH_WAIT_MS,
+            name="ner-batcher",
+            num_workers=concurrent_batches
+        )
+        batcher.start()
+
+        # Repeated texts (templates, re-uploaded PDFs) are served from the result cache
+        cache = NERResultCache(
+            model.fingerprint,
+            memory_items=config.NER_CACHE_MEMORY_ITEMS,
+            disk_path=config.NER_CACHE_PATH,
+            disk_max_items=config.NER_CACHE_DISK_MAX_ITEMS
+        ) if config.NER_CACHE_ENABLED else None
+
+        # Boilerplate sentences shared across documents are only inferred once
+        segment_memo = SegmentMemo(config.NER_SEGMENT_MEMO_ITEMS) if config.NER_SEGMENT_MEMO else None
+
+        state.model, state.batcher, state.cache, state.segment_memo = model, batcher, cache, segment_memo
+        state.status = "ready"
+        print("NER service is ready.")
+    except Exception as e:
+        state.status = "failed"
+        state.error = str(e)
+        print(f"Error loading NER model: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Bounded admission in front of model execution (created on the loop it guards)
+    state.admission = AdmissionController(config.NER_MAX_INFLIGHT, config.NER_MAX_QUEUE, name="ner")
+
+    if config.NER_WORKERS > 0 and "fork" in multiprocessing.get_all_start_methods():
+        # Fork the worker supervisor now, while this process has no other
+        # thread (the loader below is the first), so no lock can be
+        # inherited in a held state.
+        threads = config.NER_THREADS_PER_WORKER or max(1, (os.cpu_count() or 1) // config.NER_WORKERS)
+        state.pool = InferencePool(NERModel, config.NER_WORKERS, threads)
+        state.pool.start()
+    elif config.NER_WORKERS > 0:
+        print("Warning: fork() is not available on this platform. Running NER inference in-process.")
+
+    # Load in the background so /healthz and /readyz answer while the
+    # weights are fetched; the service reports ready only after warm-up.
+    loader = asyncio.create_task(asyncio.to_thread(load_model))
+    yield
+    if not loader.done():
+        print("Shutting down while the NER model is still loading.")
+    if state.batcher:
+        state.batcher.stop()
+    if state.pool:
+        state.pool.stop()
+    if state.cache:
+        state.cache.close()
+
 
 # --- FastAPI Application ---
 
@@ -28,33 +171,290 @@ class NERResponse(BaseModel):
 app = FastAPI(
     title="Medical NER Service",
     description="A microservice to extract medical named entities from text.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    """Sheds load with 429 and a Retry-After based on measured service time."""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "NER service is overloaded. Please retry later."},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+def require_ready():
+    """Rejects requests until the model is loaded and warmed up."""
+    if not state.ready:
+        detail = f"NER model failed to load: {state.error}" if state.status == "failed" else "NER model is still loading."
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "5"})
+
+
+async def run_extraction(texts: List[str]) -> List[list]:
+    """
+    Extracts entities for several texts, in order.
+    Cached texts are answered directly; the rest go through the
+    micro-batcher together and their results are added to the cache.
+    Blocking work (cache I/O, inference) never runs on the event loop.
+    """
+    cache = state.cache
+    if cache:
+        results = await asyncio.to_thread(lambda: [cache.get(text) for text in texts])
+    else:
+        results = [None] * len(texts)
+    pending = [i for i, result in enumerate(results) if result is None]
+
+    predicted = await predict_uncached([texts[i] for i in pending])
+    for i, entities in zip(pending, predicted):
+        results[i] = entities
+
+    if cache and pending:
+        await asyncio.to_thread(lambda: [cache.put(texts[i], results[i]) for i in pending])
+    return results
+
+
+async def predict_uncached(texts: List[str]) -> List[list]:
+    """
+    Runs texts through the micro-batcher. With segment memoization enabled,
+    texts are split into sentences and only segments not seen before are
+    inferred (each distinct one once, all in the same batch).
+    """
+    async def infer(items):
+        futures = state.batcher.submit_many(items)
+        return await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+
+    memo = state.segment_memo
+    if memo is None:
+        return list(await infer(texts))
+
+    # Splitting and hashing whole documents is CPU work; keep it off the loop
+    def plan():
+        plans = [memo.plan(text) for text in texts]
+        missing = list(dict.fromkeys(seg.text for segments in plans for seg in segments if seg.entities is None))
+        return plans, missing
+
+    def assemble(fresh: dict) -> List[list]:
+        for segment_text, entities in fresh.items():
+            memo.store(segment_text, entities)
+        return [memo.assemble(segments, fresh) for segments in plans]
+
+    plans, missing = await asyncio.to_thread(plan)
+    fresh = dict(zip(missing, await infer(missing)))
+    return await asyncio.to_thread(assemble, fresh)
+
+
+def require_admin(token: Optional[str]):
+    """Checks the admin token when one is configured."""
+    if config.NER_ADMIN_TOKEN and token != config.NER_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+
+@app.get("/healthz")
+def healthz():
+    """
+    Liveness probe. The process is alive while the model loads; a failed
+    load is reported as unhealthy so the orchestrator restarts the replica.
+    """
+    if state.status == "failed":
+        return JSONResponse(status_code=503, content={"status": "failed", "error": state.error})
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    """Readiness probe: 200 only once the model is loaded and warmed up."""
+    if not state.ready:
+        return JSONResponse(status_code=503, content={"status": state.status, "error": state.error})
+    if state.pool and state.pool.alive_workers == 0:
+        return JSONResponse(status_code=503, content={"status": "no_workers", "error": "All NER worker processes have died."})
+    return {"status": "ready", "model": state.model.fingerprint}
+
 @app.post("/extract_entities", response_model=NERResponse)
-def extract_entities(payload: TextInput):
+async def extract_entities(payload: TextInput, request: Request):
     """
     API endpoint to extract medical entities from text.
     It uses a Pydantic model for automatic validation of the request body.
+    Clients that send `Accept: application/vnd.medner.columnar+json` (or
+    `+msgpack`) receive {"entities_columnar": {...}} with parallel arrays
+    and dictionary-encoded labels instead of one object per entity.
     """
-    try:
-        # Perform prediction using the loaded NER model
-        # The ner_model.predict function already returns a list of dicts
-        # that match the 'Entity' Pydantic model structure.
-        entities = ner_model.predict(payload.text)
-        
-        # Return the results. FastAPI will automatically convert this
-        # into a JSON response that matches the NERResponse model.
-        return {"entities": entities}
+    require_ready()
+    encoding = compact.negotiate(request.headers.get("accept"))
+    async with state.admission.admit():
+        try:
+            # Perform prediction through the cache and the micro-batcher, which
+            # groups this text with any concurrent requests into a single
+            # forward pass. The result is a list of dicts that match the
+            # 'Entity' model.
+            entities = (await run_extraction([payload.text]))[0]
+            if encoding:
+                return compact.render({"entities_columnar": compact.to_columnar(entities)}, encoding)
         
+            # Return the results. FastAPI will automatically convert this
+            # into a JSON response that matches the NERResponse model.
+            return {"entities": entities}
+            
+        except Exception as e:
+            # Handle unexpected errors during prediction
+            print(f"An unexpected error occurred: {e}")
+            # Use HTTPException for proper FastAPI error handling
+            raise HTTPException(
+                status_code=500,
+                detail="An internal error occurred during entity extraction."
+            )
+
+@app.post("/extract_entities_batch", response_model=BatchNERResponse)
+async def extract_entities_batch(payload: BatchTextInput, request: Request):
+    """
+    API endpoint to extract medical entities from many texts in one call.
+    Results are returned in the same order as the input texts, in the
+    columnar format when it is requested through the Accept header.
+    """
+    require_ready()
+    encoding = compact.negotiate(request.headers.get("accept"))
+    async with state.admission.admit():
+        try:
+            results = await run_extraction(payload.texts)
+            if encoding:
+                return compact.render(
+                    {"results": [{"entities_columnar": compact.to_columnar(entities)} for entities in results]},
+                    encoding
+                )
+            return {"results": [{"entities": entities} for entities in results]}
+
+        except Exception as e:
+            print(f"An unexpected error occurred during batch extraction: {e}")
+            raise HTTPException(
+                status_code=500,
+                detail="An internal error occurred during batch entity extraction."
+            )
+
+async def stream_extraction(text: str):
+    """
+    Yields entity events for a text, one per group of windows, in document order.
+
+    All windows are queued on the micro-batcher up front, so they are
+    batched for throughput, and each group is emitted as soon as its own
+    windows are done. A cached text is emitted as a single chunk.
+
+    Streams merge token windows rather than memoized segments, so with
+    NER_SEGMENT_MEMO on they bypass the document cache: its entries are
+    keyed (and produced) for segmented output.
+    """
+    cache = state.cache if state.segment_memo is None else None
+    cached = await asyncio.to_thread(cache.get, text) if cache else None
+    if cached is not None:
+        yield {"chunk": 0, "total_chunks": 1, "chars_processed": len(text), "total_chars": len(text), "entities": cached}
+        yield {"done": True, "entity_count": len(cached), "cached": True}
+        return
+
+    windows = await asyncio.to_thread(state.model.plan_windows, text)
+    size = max(1, config.NER_STREAM_WINDOWS_PER_CHUNK)
+    groups = [windows[i:i + size] for i in range(0, len(windows), size)]
+    futures = state.batcher.submit_many([text[w.start:w.end] for w in windows])
+
+    all_entities = []
+    for index, group in enumerate(groups):
+        group_futures = futures[index * size:index * size + len(group)]
+        window_results = await asyncio.gather(*(asyncio.wrap_future(future) for future in group_futures))
+        entities = NERModel.merge_windows(group, window_results)
+        all_entities.extend(entities)
+        yield {
+            "chunk": index,
+            "total_chunks": len(groups),
+            "chars_processed": group[-1].keep_to,
+            "total_chars": len(text),
+            "entities": entities
+        }
+
+    if cache:
+        await asyncio.to_thread(cache.put, text, all_entities)
+    yield {"done": True, "entity_count": len(all_entities), "cached": False}
+
+
+async def encode_stream(events, sse: bool, admission: AdmissionController):
+    """
+    Serializes events as Server-Sent Events or newline-delimited JSON.
+
+    The admission slot is taken when the stream starts and freed when it
+    ends or the client goes away, so a response whose body is never sent
+    can't hold a slot.
+    """
+    def encode(event: dict) -> str:
+        if sse:
+            name = "done" if event.get("done") else "error" if "error" in event else "entities"
+            return f"event: {name}\ndata: {json.dumps(event)}\n\n"
+        return json.dumps(event) + "\n"
+
+    try:
+        await admission.acquire()
+    except Overloaded as e:
+        # Only when the queue filled up since the handler checked it
+        yield encode({"error": str(e), "retry_after": e.retry_after})
+        return
+    started = time.monotonic()
+    try:
+        async for event in events:
+            yield encode(event)
     except Exception as e:
-        # Handle unexpected errors during prediction
-        print(f"An unexpected error occurred: {e}")
-        # Use HTTPException for proper FastAPI error handling
-        raise HTTPException(
-            status_code=500,
-            detail="An internal error occurred during entity extraction."
-        )
+        # Headers are already sent, so report the failure in-band
+        print(f"An unexpected error occurred during streaming extraction: {e}")
+        yield encode({"error": "An internal error occurred during entity extraction."})
+    finally:
+        admission.release(time.monotonic() - started)
+
+@app.post("/extract_entities_stream")
+async def extract_entities_stream(payload: TextInput, request: Request):
+    """
+    API endpoint that streams entities chunk by chunk while a long text is processed.
+    - Accept: text/event-stream returns Server-Sent Events ("entities", then "done").
+    - Otherwise returns newline-delimited JSON (application/x-ndjson).
+    Each chunk carries document character offsets and progress counters.
+    """
+    require_ready()
+    # Overload is rejected with 429 before streaming starts; the slot
+    # itself is taken by the stream
+    state.admission.check()
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    return StreamingResponse(
+        encode_stream(stream_extraction(payload.text), sse, state.admission),
+        media_type="text/event-stream" if sse else "application/x-ndjson"
+    )
+
+@app.get("/metrics")
+def get_metrics():
+    """Returns model status, admission, batching and cache statistics."""
+    return {
+        "status": state.status,
+        "admission": state.admission.stats() if state.admission else None,
+        "batcher": state.batcher.stats() if state.batcher else None,
+        "workers": state.pool.stats() if state.pool else None,
+        "cache": state.cache.stats() if state.cache else None,
+        "segments": state.segment_memo.stats() if state.segment_memo else None
+    }
+
+@app.post("/admin/cache/invalidate", response_model=CacheInvalidateResponse)
+def invalidate_cache(
+    scope: Literal["all", "stale"] = "all",
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Invalidates the NER result cache, e.g. after the model changes.
+    - scope=all removes every cached result.
+    - scope=stale only removes results produced by a different model fingerprint.
+    """
+    require_admin(x_admin_token)
+    if not config.NER_CACHE_ENABLED:
+        raise HTTPException(status_code=404, detail="The result cache is disabled.")
+    require_ready()
+
+    removed = state.cache.invalidate(scope)
+    if state.segment_memo and scope == "all":
+        state.segment_memo.clear()
+    print(f"NER cache invalidated (scope={scope}, removed={removed} persistent entries).")
+    return {"scope": scope, "removed": removed}
 
 if __name__ == "__main__":
     import uvicorn
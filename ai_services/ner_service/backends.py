@@ -0,0 +1,140 @@
+# ner-service/backends.py
+
+import os
+from transformers import AutoModelForTokenClassification, pipeline
+import config
+
+# All backends share the same HF token-classification pipeline, so the
+# aggregation and output contract stay identical whichever one is used.
+AGGREGATION_STRATEGY = "max"
+
+
+def build_ner_pipeline(backend: str, source: str, load_kwargs: dict, tokenizer, device: int, threads: int = None):
+    """
+    Builds the NER pipeline for the configured inference backend.
+
+    Args:
+        backend (str): "torch" or "onnx".
+        source (str): The HuggingFace model name or a local snapshot directory.
+        load_kwargs (dict): Extra `from_pretrained` arguments, i.e. the
+                            revision or `local_files_only`.
+        tokenizer: The already loaded tokenizer for the model.
+        device (int): Pipeline device index (0 for GPU, -1 for CPU).
+        threads (int): ONNX Runtime intra-op threads. Defaults to NER_ONNX_THREADS.
+
+    Returns:
+        tuple: The pipeline and the name of the backend actually in use.
+    """
+    if backend == "onnx":
+        try:
+            return _build_onnx_pipeline(source, load_kwargs, tokenizer, threads), "onnx"
+        except ImportError as e:
+            print(f"ONNX backend unavailable ({e}). Install 'optimum[onnxruntime]'. Falling back to torch.")
+    elif backend != "torch":
+        print(f"Unknown NER backend '{backend}'. Falling back to torch.")
+
+    return _build_torch_pipeline(source, load_kwargs, tokenizer, device), "torch"
+
+
+def _build_torch_pipeline(source: str, load_kwargs: dict, tokenizer, device: int):
+    """Eager PyTorch pipeline (the original inference path)."""
+    model = AutoModelForTokenClassification.from_pretrained(source, **load_kwargs)
+    return pipeline(
+        "ner",
+        model=model,
+        tokenizer=tokenizer,
+        aggregation_strategy=AGGREGATION_STRATEGY,
+        device=device
+    )
+
+
+def onnx_export_dir(source: str, load_kwargs: dict) -> str:
+    """Directory holding the exported (and quantized) ONNX model for one model revision or snapshot."""
+    if load_kwargs.get("local_files_only"):
+        name, version = os.path.basename(os.path.normpath(source)), "local"
+    else:
+        name, version = source.replace("/", "--"), load_kwargs.get("revision") or "main"
+    return os.path.join(config.NER_ONNX_DIR, name, version)
+
+
+# Instruction sets the quantizer can target (NER_ONNX_QUANT_ARCH)
+QUANT_ARCHS = ("avx2", "avx512", "avx512_vnni", "arm64")
+
+
+def quant_arch() -> str:
+    """The configured quantizer target, or avx2 if it isn't a known one."""
+    return config.NER_ONNX_QUANT_ARCH if config.NER_ONNX_QUANT_ARCH in QUANT_ARCHS else "avx2"
+
+
+def onnx_variant() -> str:
+    """The ONNX model in use: "fp32", or "int8-<arch>" for the quantized one."""
+    return f"int8-{quant_arch()}" if config.NER_ONNX_QUANTIZE else "fp32"
+
+
+def export_onnx_model(source: str, load_kwargs: dict, tokenizer) -> str:
+    """
+    Exports the model to ONNX and applies dynamic int8 quantization.
+    This only runs once; later calls reuse the files on disk. Quantized
+    files are kept per target instruction set, so changing
+    NER_ONNX_QUANT_ARCH quantizes again instead of reusing another target's.
+
+    Returns:
+        str: The file name of the ONNX model to load from `onnx_export_dir`.
+    """
+    from optimum.onnxruntime import ORTModelForTokenClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    export_dir = onnx_export_dir(source, load_kwargs)
+    fp32_file = "model.onnx"
+    arch = quant_arch()
+    int8_file = f"model_quantized_{arch}.onnx"
+
+    if not os.path.exists(os.path.join(export_dir, fp32_file)):
+        print(f"Exporting '{source}' to ONNX in {export_dir}...")
+        ort_model = ORTModelForTokenClassification.from_pretrained(source, export=True, **load_kwargs)
+        ort_model.save_pretrained(export_dir)
+        tokenizer.save_pretrained(export_dir)
+
+    if not config.NER_ONNX_QUANTIZE:
+        return fp32_file
+
+    if not os.path.exists(os.path.join(export_dir, int8_file)):
+        if arch != config.NER_ONNX_QUANT_ARCH:
+            print(f"Unknown quantization target '{config.NER_ONNX_QUANT_ARCH}'. Using {arch}.")
+        print(f"Quantizing ONNX model to int8 ({arch})...")
+        make_config = getattr(AutoQuantizationConfig, arch)
+        quantizer = ORTQuantizer.from_pretrained(export_dir, file_name=fp32_file)
+        quantizer.quantize(
+            save_dir=export_dir,
+            file_suffix=f"quantized_{arch}",
+            quantization_config=make_config(is_static=False, per_channel=False)
+        )
+
+    return int8_file
+
+
+def _build_onnx_pipeline(source: str, load_kwargs: dict, tokenizer, threads: int = None):
+    """ONNX Runtime pipeline over the exported, optionally quantized model."""
+    import onnxruntime
+    from optimum.onnxruntime import ORTModelForTokenClassification
+
+    file_name = export_onnx_model(source, load_kwargs, tokenizer)
+
+    session_options = onnxruntime.SessionOptions()
+    session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    threads = threads or config.NER_ONNX_THREADS
+    if threads > 0:
+        session_options.intra_op_num_threads = threads
+
+    model = ORTModelForTokenClassification.from_pretrained(
+        onnx_export_dir(source, load_kwargs),
+        file_name=file_name,
+        provider="CPUExecutionProvider",
+        session_options=session_options
+    )
+    return pipeline(
+        "ner",
+        model=model,
+        tokenizer=tokenizer,
+        aggregation_strategy=AGGREGATION_STRATEGY
+    )
@@ -0,0 +1,193 @@
+# ner-service/cache.py
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class NERResultCache:
+    """
+    A two-tier, content-addressed cache for NER results.
+
+    Keys are a SHA-256 of the model fingerprint plus the normalized text.
+    A bounded in-memory LRU sits in front of a SQLite table that persists
+    across restarts. Only surrounding whitespace is stripped during
+    normalization; entity offsets are stored relative to the stripped text
+    and shifted back on lookup, so a hit returns exact offsets for the text
+    that was actually submitted.
+    """
+    def __init__(self, fingerprint: str, memory_items: int = 1024, disk_path: str = None, disk_max_items: int = 100000):
+        """
+        Args:
+            fingerprint (str): Identifies the model/settings producing results.
+            memory_items (int): Capacity of the in-memory LRU tier.
+            disk_path (str): SQLite file for the persistent tier. None disables it.
+            disk_max_items (int): Rows kept on disk before the least recently used are pruned.
+        """
+        self.fingerprint = fingerprint
+        self.memory_items = max(0, memory_items)
+        self.disk_max_items = disk_max_items
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._inserts_since_prune = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS ner_cache (
+                    key TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    entities TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_ner_cache_accessed ON ner_cache (accessed_at)")
+            self._db.commit()
+
+    @staticmethod
+    def _normalize(text: str):
+        """Returns the normalized text and the number of leading characters removed."""
+        stripped = text.strip()
+        lead = len(text) - len(text.lstrip()) if stripped else 0
+        return stripped, lead
+
+    def _key(self, normalized: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(self.fingerprint.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(normalized.encode("utf-8"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _shift(entities: list, delta: int) -> list:
+        if not delta:
+            return entities
+        return [
+            dict(entity, start=entity["start"] + delta, end=entity["end"] + delta)
+            if entity.get("start") is not None else entity
+            for entity in entities
+        ]
+
+    def _remember(self, key: str, entities: list):
+        """Inserts into the memory tier, evicting the least recently used entry. Caller holds the lock."""
+        if not self.memory_items:
+            return
+        self._memory[key] = entities
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, text: str) -> Optional[list]:
+        """Returns the cached entities for a text, or None on a miss."""
+        normalized, lead = self._normalize(text)
+        key = self._key(normalized)
+
+        with self._lock:
+            entities = self._memory.get(key)
+            if entities is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._shift(entities, lead)
+
+            if self._db is not None:
+                row = self._db.execute("SELECT entities FROM ner_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE ner_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+                    entities = json.loads(row[0])
+                    self._remember(key, entities)
+                    self.disk_hits += 1
+                    return self._shift(entities, lead)
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, entities: list):
+        """Stores the entities predicted for a text."""
+        normalized, lead = self._normalize(text)
+        key = self._key(normalized)
+        entities = self._shift(entities, -lead)
+
+        with self._lock:
+            self._remember(key, entities)
+            if self._db is None:
+                return
+            now = time.time()
+            self._db.execute(
+                "INSERT OR REPLACE INTO ner_cache (key, fingerprint, entities, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, self.fingerprint, json.dumps(entities), now, now)
+            )
+            self._inserts_since_prune += 1
+            if self._inserts_since_prune >= 100:
+                self._prune()
+            self._db.commit()
+
+    def _prune(self):
+        """Deletes the least recently used rows beyond the disk capacity. Caller holds the lock."""
+        self._inserts_since_prune = 0
+        self._db.execute(
+            """DELETE FROM ner_cache WHERE key IN (
+                SELECT key FROM ner_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.disk_max_items,)
+        )
+
+    def invalidate(self, scope: str = "all") -> int:
+        """
+        Removes cached results.
+
+        Args:
+            scope (str): "all" clears everything; "stale" only removes rows
+                         produced under a different model fingerprint.
+
+        Returns:
+            int: The number of persistent rows removed.
+        """
+        with self._lock:
+            removed = 0
+            if scope == "all":
+                self._memory.clear()
+            if self._db is not None:
+                if scope == "all":
+                    cursor = self._db.execute("DELETE FROM ner_cache")
+                else:
+                    cursor = self._db.execute("DELETE FROM ner_cache WHERE fingerprint != ?", (self.fingerprint,))
+                removed = cursor.rowcount
+                self._db.commit()
+            return removed
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters and tier sizes."""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            disk_items = None
+            if self._db is not None:
+                disk_items = self._db.execute("SELECT COUNT(*) FROM ner_cache").fetchone()[0]
+            return {
+                "fingerprint": self.fingerprint,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "memory_items": len(self._memory),
+                "memory_capacity": self.memory_items,
+                "disk_items": disk_items,
+                "disk_capacity": self.disk_max_items if self._db is not None else None,
+            }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
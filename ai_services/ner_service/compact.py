@@ -0,0 +1,72 @@
+# ner-service/compact.py
+
+import json
+from fastapi.responses import Response
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; JSON columnar works without it
+    msgpack = None
+
+# Media types a client can put in its Accept header to opt in
+COLUMNAR_JSON_MEDIA_TYPE = "application/vnd.medner.columnar+json"
+COLUMNAR_MSGPACK_MEDIA_TYPE = "application/vnd.medner.columnar+msgpack"
+COLUMNAR_FORMAT = "columnar-v1"
+
+
+def to_columnar(entities: list) -> dict:
+    """
+    Converts row-oriented entities into parallel arrays.
+
+    Labels are dictionary-encoded: `labels` lists each distinct label once
+    and `label_ids[i]` indexes into it, so a label string is sent once per
+    response instead of once per entity.
+    """
+    labels, label_index = [], {}
+    columns = {"label_ids": [], "start": [], "end": [], "confidence": [], "text": []}
+    for entity in entities:
+        label = entity["label"]
+        if label not in label_index:
+            label_index[label] = len(labels)
+            labels.append(label)
+        columns["label_ids"].append(label_index[label])
+        columns["start"].append(entity.get("start"))
+        columns["end"].append(entity.get("end"))
+        columns["confidence"].append(entity["confidence"])
+        columns["text"].append(entity["text"])
+
+    return {"format": COLUMNAR_FORMAT, "count": len(entities), "labels": labels, **columns}
+
+
+def to_rows(columnar: dict) -> list:
+    """Converts a columnar payload back to the row-oriented `Entity` form."""
+    labels = columnar["labels"]
+    return [
+        {"text": text, "label": labels[label_id], "confidence": confidence, "start": start, "end": end}
+        for text, label_id, confidence, start, end in zip(
+            columnar["text"], columnar["label_ids"], columnar["confidence"], columnar["start"], columnar["end"]
+        )
+    ]
+
+
+def negotiate(accept: str):
+    """
+    Picks the compact encoding requested in an Accept header.
+
+    Returns:
+        str: "msgpack", "json", or None for the default row-oriented JSON.
+             msgpack falls back to JSON columnar when msgpack is not installed.
+    """
+    accept = accept or ""
+    if COLUMNAR_MSGPACK_MEDIA_TYPE in accept:
+        return "msgpack" if msgpack is not None else "json"
+    if COLUMNAR_JSON_MEDIA_TYPE in accept:
+        return "json"
+    return None
+
+
+def render(payload: dict, encoding: str) -> Response:
+    """Serializes a columnar payload with the negotiated encoding."""
+    if encoding == "msgpack":
+        return Response(content=msgpack.packb(payload, use_bin_type=True), media_type=COLUMNAR_MSGPACK_MEDIA_TYPE)
+    return Response(content=json.dumps(payload, separators=(",", ":")), media_type=COLUMNAR_JSON_MEDIA_TYPE)
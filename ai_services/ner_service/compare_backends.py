@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Latency comparison of the NER inference backends.
+
+Runs the same texts through the torch and ONNX backends and reports
+per-text latency for each. Parity of their output (labels, spans and
+confidences) is checked by tests/test_backend_parity.py.
+
+Usage:
+    python compare_backends.py [--texts-file notes.txt] [--runs 20]
+"""
+
+import argparse
+import statistics
+import sys
+import time
+
+from ner_model import NERModel
+
+SAMPLE_TEXTS = [
+    "Patient name: John Doe. Age: 35. Has type 2 diabetes mellitus and hypertension.",
+    "The patient presented with acute chest pain radiating to the left arm and was given 325 mg aspirin.",
+    "CT scan of the abdomen revealed a 2 cm hypodense lesion in the right lobe of the liver.",
+    "History of asthma, currently on salbutamol inhaler. Denies fever, cough or shortness of breath.",
+    "Discharged on metformin 500 mg twice daily and lisinopril 10 mg once daily; follow up in 2 weeks.",
+]
+
+
+def time_backend(model: NERModel, texts: list, runs: int) -> list:
+    """Returns per-text latencies in milliseconds over `runs` passes."""
+    model.predict_batch(texts)  # warm-up
+    latencies = []
+    for _ in range(runs):
+        for text in texts:
+            start = time.perf_counter()
+            model.predict(text)
+            latencies.append((time.perf_counter() - start) * 1000.0)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts-file", help="File with one text per line (defaults to built-in samples)")
+    parser.add_argument("--runs", type=int, default=20, help="Timing passes over the texts")
+    args = parser.parse_args()
+
+    texts = SAMPLE_TEXTS
+    if args.texts_file:
+        with open(args.texts_file, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+
+    torch_model = NERModel(backend="torch")
+    onnx_model = NERModel(backend="onnx")
+    if torch_model.backend != "torch" or onnx_model.backend != "onnx":
+        print("❌ Could not load both backends; see the messages above.")
+        sys.exit(1)
+
+    print(f"\n⏱️  Timing {args.runs} passes over {len(texts)} texts...")
+    for name, model in (("torch", torch_model), ("onnx", onnx_model)):
+        latencies = sorted(time_backend(model, texts, args.runs))
+        p95 = latencies[int(0.95 * (len(latencies) - 1))]
+        print(f"  {name:>5}: p50 {statistics.median(latencies):7.2f} ms | p95 {p95:7.2f} ms | mean {statistics.mean(latencies):7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# ner-service/config.py
+
+import os
+from dotenv import load_dotenv
+
+# Load environment variables from a .env file next to the service.
+# Every setting below can be overridden from the environment.
+load_dotenv()
+
+# --- Model Settings ---
+NER_MODEL_NAME = os.getenv("NER_MODEL_NAME", "d4data/biomedical-ner-all")
+# Branch, tag or commit of the model. Pin a commit so cached results and
+# exported ONNX files are tied to exact weights.
+NER_MODEL_REVISION = os.getenv("NER_MODEL_REVISION", "main")
+# Optional local snapshot directory (e.g. from `huggingface-cli download`).
+# When set, the tokenizer and weights are loaded from it without any hub lookups.
+NER_MODEL_PATH = os.getenv("NER_MODEL_PATH", "")
+
+# Text run through the model once after loading, before reporting ready.
+NER_WARMUP_TEXT = os.getenv(
+    "NER_WARMUP_TEXT",
+    "The patient was diagnosed with pneumonia and started on amoxicillin 500 mg."
+)
+
+# --- Micro-batching Settings ---
+# Concurrent requests are coalesced into one padded forward pass.
+# A batch is flushed as soon as it holds NER_MAX_BATCH_SIZE texts, or when
+# NER_MAX_BATCH_WAIT_MS has passed since the first text in it arrived.
+NER_MAX_BATCH_SIZE = int(os.getenv("NER_MAX_BATCH_SIZE", "16"))
+NER_MAX_BATCH_WAIT_MS = float(os.getenv("NER_MAX_BATCH_WAIT_MS", "10"))
+
+# --- Admission Control Settings ---
+# At most NER_MAX_INFLIGHT requests run inference at once and at most
+# NER_MAX_QUEUE more wait for a slot; beyond that requests get 429 with a
+# Retry-After estimated from the measured service time. In-flight requests
+# are still coalesced by the micro-batcher.
+NER_MAX_INFLIGHT = int(os.getenv("NER_MAX_INFLIGHT", "32"))
+NER_MAX_QUEUE = int(os.getenv("NER_MAX_QUEUE", "64"))
+
+# Upper bound on the number of texts accepted by /extract_entities_batch.
+NER_MAX_TEXTS_PER_REQUEST = int(os.getenv("NER_MAX_TEXTS_PER_REQUEST", "256"))
+
+# --- Worker Process Settings ---
+# With NER_WORKERS > 0, inference runs in that many worker processes forked
+# from one supervisor process, so they share its weights copy-on-write; a
+# worker that dies is replaced. Each worker uses NER_THREADS_PER_WORKER
+# intra-op threads (0 splits the CPUs evenly).
+# Requires a platform with fork(); otherwise inference stays in-process.
+NER_WORKERS = int(os.getenv("NER_WORKERS", "0"))
+NER_THREADS_PER_WORKER = int(os.getenv("NER_THREADS_PER_WORKER", "0"))
+
+# --- Long-document Settings ---
+# When enabled, texts longer than one window are split into overlapping
+# token windows that are run as one batch and merged by character offset.
+# The window leaves headroom below the model's 512-token limit because a
+# window is re-tokenized on its own by the pipeline.
+NER_CHUNKING = os.getenv("NER_CHUNKING", "true").lower() in ("1", "true", "yes")
+NER_WINDOW_TOKENS = int(os.getenv("NER_WINDOW_TOKENS", "448"))
+NER_WINDOW_OVERLAP_TOKENS = int(os.getenv("NER_WINDOW_OVERLAP_TOKENS", "64"))
+
+# --- Segment Memoization Settings ---
+# When enabled, documents are split into sentences/lines and results for
+# segments seen before (boilerplate headers, disclaimers, standard phrases)
+# are reused; only new segments are run through the model. The model then
+# sees each sentence without its neighbours, so this is opt-in.
+NER_SEGMENT_MEMO = os.getenv("NER_SEGMENT_MEMO", "false").lower() in ("1", "true", "yes")
+NER_SEGMENT_MEMO_ITEMS = int(os.getenv("NER_SEGMENT_MEMO_ITEMS", "50000"))
+
+# Windows per event emitted by /extract_entities_stream.
+NER_STREAM_WINDOWS_PER_CHUNK = int(os.getenv("NER_STREAM_WINDOWS_PER_CHUNK", "1"))
+
+# --- Inference Backend Settings ---
+# "torch" runs the eager PyTorch model. "onnx" exports the model once to
+# ONNX (optionally with dynamic int8 quantization) under NER_ONNX_DIR and
+# runs it through ONNX Runtime with the same pipeline post-processing.
+NER_BACKEND = os.getenv("NER_BACKEND", "torch").lower()
+NER_ONNX_DIR = os.getenv("NER_ONNX_DIR", "./onnx_models")
+NER_ONNX_QUANTIZE = os.getenv("NER_ONNX_QUANTIZE", "true").lower() in ("1", "true", "yes")
+# Instruction set targeted by the quantizer: avx2, avx512, avx512_vnni or arm64
+NER_ONNX_QUANT_ARCH = os.getenv("NER_ONNX_QUANT_ARCH", "avx2").lower()
+NER_ONNX_THREADS = int(os.getenv("NER_ONNX_THREADS", "0"))  # 0 lets ONNX Runtime decide
+
+# --- Result Cache Settings ---
+# Results are cached by a hash of the text plus the model fingerprint, in a
+# bounded in-memory LRU in front of a SQLite file that survives restarts.
+NER_CACHE_ENABLED = os.getenv("NER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+NER_CACHE_MEMORY_ITEMS = int(os.getenv("NER_CACHE_MEMORY_ITEMS", "1024"))
+NER_CACHE_PATH = os.getenv("NER_CACHE_PATH", "./ner_cache.sqlite3")
+NER_CACHE_DISK_MAX_ITEMS = int(os.getenv("NER_CACHE_DISK_MAX_ITEMS", "100000"))
+
+# Token required in the X-Admin-Token header for admin endpoints.
+# Leave empty to allow unauthenticated access (e.g. behind a private network).
+NER_ADMIN_TOKEN = os.getenv("NER_ADMIN_TOKEN", "")
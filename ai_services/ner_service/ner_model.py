@@ -1,40 +1,112 @@
 # ner-service/model/ner.py
 
-from transformers import AutoTokenizer, AutoModelForTokenClassification, pipeline
+import os
+from collections import namedtuple
+from transformers import AutoTokenizer
 import torch
+import config
+from backends import build_ner_pipeline, onnx_variant
+
+# A slice of a document that is run through the model on its own.
+# `start`/`end` are the character bounds of the slice, and entities whose
+# (document) start offset falls in [keep_from, keep_to) are kept from it.
+# Neighbouring windows overlap, and the keep ranges split each overlap at
+# its midpoint so every entity is reported by exactly one window.
+Window = namedtuple("Window", ["start", "end", "keep_from", "keep_to"])
 
 class NERModel:
     """
     A class to encapsulate the NER model loading and prediction logic.
     """
-    def __init__(self, model_name="d4data/biomedical-ner-all"):
+    def __init__(self, model_name=config.NER_MODEL_NAME, backend=config.NER_BACKEND, revision=config.NER_MODEL_REVISION, local_path=config.NER_MODEL_PATH, load_pipeline=True):
         """
         Initializes and loads the NER model and tokenizer.
         
         Args:
             model_name (str): The name of the HuggingFace model to load.
+            backend (str): The inference backend, "torch" or "onnx".
+            revision (str): The model revision (branch, tag or commit) to load.
+            local_path (str): Optional local snapshot directory. When given,
+                              files are loaded from it with no hub lookups.
+            load_pipeline (bool): Whether to load the weights. Without them
+                                  the instance only plans windows, e.g. in
+                                  the parent of an InferencePool.
+
+        Raises:
+            Exception: If the tokenizer or model cannot be loaded.
         """
         print("Loading NER model...")
-        try:
-            # Check for GPU availability
-            self.device = 0 if torch.cuda.is_available() else -1
-            
-            # Load the tokenizer and model from HuggingFace
-            tokenizer = AutoTokenizer.from_pretrained(model_name)
-            model = AutoModelForTokenClassification.from_pretrained(model_name)
-            
-            # Create the NER pipeline with max aggregation strategy
-            self.ner_pipeline = pipeline(
-                "ner",
-                model=model,
-                tokenizer=tokenizer,
-                aggregation_strategy="max",
-                device=self.device
+        self.model_name = model_name
+        # A snapshot directory from the hub cache is named after its commit
+        self.revision = f"local:{os.path.basename(os.path.normpath(local_path))}" if local_path else revision
+        self.warmed_up = False
+
+        # Where to load from: a local snapshot, or the hub at a given revision
+        source = local_path or model_name
+        load_kwargs = {"local_files_only": True} if local_path else {"revision": revision}
+        self._source, self._load_kwargs = source, load_kwargs
+
+        # Check for GPU availability
+        self.device = 0 if torch.cuda.is_available() else -1
+        
+        # Load the tokenizer from HuggingFace
+        self.tokenizer = AutoTokenizer.from_pretrained(source, **load_kwargs)
+        
+        # Create the NER pipeline for the configured backend
+        if load_pipeline:
+            self.ner_pipeline, self.backend = build_ner_pipeline(backend, source, load_kwargs, self.tokenizer, self.device)
+            print(f"NER model '{model_name}' loaded successfully from {'local snapshot ' + local_path if local_path else 'the hub'} "
+                  f"with the {self.backend} backend on {'GPU' if self.device == 0 else 'CPU'}.")
+        else:
+            self.ner_pipeline, self.backend = None, backend
+            print(f"NER tokenizer for '{model_name}' loaded (weights are loaded by the worker processes).")
+
+        # Window size, capped below the tokenizer's limit (minus [CLS]/[SEP])
+        model_max = getattr(self.tokenizer, "model_max_length", 512) or 512
+        self.window_tokens = max(16, min(config.NER_WINDOW_TOKENS, model_max - 2))
+        self.overlap_tokens = max(0, min(config.NER_WINDOW_OVERLAP_TOKENS, self.window_tokens // 2))
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Identifies everything that affects predictions: the model, its
+        revision, the backend (for ONNX, the fp32 model or the int8 one and
+        its target instruction set), the windowing settings and whether documents are split
+        into memoized segments. Cached results are only valid for the
+        fingerprint they were produced under.
+        """
+        backend = self.backend
+        if backend == "onnx":
+            backend += f"-{onnx_variant()}"
+        chunking = f"w{self.window_tokens}-o{self.overlap_tokens}" if config.NER_CHUNKING else "nochunk"
+        segmenting = "/segments" if config.NER_SEGMENT_MEMO else ""
+        return f"{self.model_name}@{self.revision}/{backend}/{chunking}{segmenting}"
+
+    def prepare_worker(self, threads: int):
+        """
+        Prepares a forked copy of this model for use in a worker process.
+
+        Limits intra-op parallelism to the worker's thread budget. ONNX
+        Runtime sessions own threads that do not survive fork, so the
+        session is rebuilt from the exported file; torch weights are used
+        as inherited.
+        """
+        torch.set_num_threads(threads)
+        if self.backend == "onnx":
+            self.ner_pipeline, _ = build_ner_pipeline(
+                "onnx", self._source, self._load_kwargs, self.tokenizer, self.device, threads=threads
             )
-            print(f"NER model '{model_name}' loaded successfully on {'GPU' if self.device == 0 else 'CPU'}.")
-        except Exception as e:
-            print(f"Error loading NER model: {e}")
-            self.ner_pipeline = None
+
+    def warm_up(self, text: str = config.NER_WARMUP_TEXT):
+        """
+        Runs one inference so lazy initialization (kernel selection, thread
+        pools, ONNX Runtime graph optimization) happens before real traffic.
+
+        Raises:
+            Exception: If the warm-up inference fails.
+        """
+        self.predict_batch([text])
+        self.warmed_up = True
 
     def predict(self, text: str) -> list:
         """
@@ -47,28 +119,135 @@ class NERModel:
             list: A list of dictionaries, where each dictionary represents
                   a detected entity. Returns an empty list on failure.
         """
-        if not self.ner_pipeline or not text.strip():
-            return []
-
         try:
-            # Run the NER pipeline on the text
-            entities = self.ner_pipeline(text)
-            
-            # Format the output to match the API contract
-            formatted_entities = [
-                {
-                    "text": entity.get('word'),
-                    "label": entity.get('entity_group'),
-                    "confidence": round(entity.get('score', 0.0), 4)
-                }
-                for entity in entities
-            ]
-            
-            return formatted_entities
+            return self.predict_batch([text])[0]
         except Exception as e:
             print(f"Error during NER prediction: {e}")
             return []
 
-# Instantiate the model when the module is loaded.
-# This makes it a singleton that can be imported by the Flask app.
-ner_model = NERModel()
+    def plan_windows(self, text: str) -> list:
+        """
+        Splits a text into overlapping token windows.
+
+        The text is tokenized once to get character offsets; windows are
+        then cut on token boundaries, so the cost grows linearly with the
+        length of the document. Short texts (or chunking disabled) yield a
+        single window covering the whole text.
+
+        Args:
+            text (str): The input text to split.
+
+        Returns:
+            list: A list of `Window` tuples in document order.
+        """
+        whole = [Window(0, len(text), 0, len(text))]
+        if not config.NER_CHUNKING or self.tokenizer is None:
+            return whole
+
+        offsets = self.tokenizer(
+            text,
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            verbose=False
+        )["offset_mapping"]
+        n_tokens = len(offsets)
+        if n_tokens <= self.window_tokens:
+            return whole
+
+        step = self.window_tokens - self.overlap_tokens
+        starts = list(range(0, n_tokens - self.overlap_tokens, step))
+
+        windows = []
+        for i, tok_start in enumerate(starts):
+            tok_end = min(tok_start + self.window_tokens, n_tokens)
+            # Split each overlap at its middle token
+            keep_from = 0 if i == 0 else offsets[tok_start + self.overlap_tokens // 2][0]
+            if i + 1 < len(starts):
+                keep_to = offsets[starts[i + 1] + self.overlap_tokens // 2][0]
+            else:
+                keep_to = len(text)
+            windows.append(Window(offsets[tok_start][0], offsets[tok_end - 1][1], keep_from, keep_to))
+        return windows
+
+    @staticmethod
+    def merge_windows(windows: list, window_entities: list) -> list:
+        """
+        Merges per-window entities into document-level entities.
+
+        Args:
+            windows (list): The `Window` tuples the entities came from.
+            window_entities (list): One list of formatted entities per window,
+                                    with offsets relative to the window.
+
+        Returns:
+            list: Entities with document character offsets, in order.
+        """
+        merged = []
+        for window, entities in zip(windows, window_entities):
+            for entity in entities:
+                start = entity.get("start")
+                if start is not None:
+                    start += window.start
+                    if not window.keep_from <= start < window.keep_to:
+                        continue
+                    entity = dict(entity, start=start, end=entity["end"] + window.start)
+                merged.append(entity)
+        return merged
+
+    def predict_batch(self, texts: list, batch_size: int = None) -> list:
+        """
+        Performs Named Entity Recognition on several texts at once.
+
+        Every text is split into windows (see `plan_windows`) and all the
+        windows of all the texts are run through the model together, in
+        padded forward passes of `batch_size` windows.
+
+        Args:
+            texts (list): The input texts to analyze.
+            batch_size (int): Windows per forward pass. Defaults to NER_MAX_BATCH_SIZE.
+
+        Returns:
+            list: One list of entity dictionaries per input text, in order.
+                  An empty text yields an empty list.
+
+        Raises:
+            RuntimeError: If the model is not loaded.
+            Exception: Any error raised by the pipeline is propagated, so
+                       callers never mistake a failure for "no entities".
+        """
+        if not self.ner_pipeline:
+            raise RuntimeError("NER model is not loaded.")
+
+        results = [[] for _ in texts]
+
+        # Only send non-empty texts to the model, remembering their positions
+        plans = [(i, self.plan_windows(text)) for i, text in enumerate(texts) if text and text.strip()]
+        segments = [texts[i][w.start:w.end] for i, windows in plans for w in windows]
+        if not segments:
+            return results
+
+        # The pipeline pads each batch to its longest member
+        outputs = self.ner_pipeline(
+            segments,
+            batch_size=batch_size or min(len(segments), config.NER_MAX_BATCH_SIZE)
+        )
+        outputs = iter(outputs)
+        for i, windows in plans:
+            window_entities = [self._format_entities(next(outputs)) for _ in windows]
+            results[i] = self.merge_windows(windows, window_entities)
+
+        return results
+
+    @staticmethod
+    def _format_entities(entities: list) -> list:
+        """Formats raw pipeline output to match the API contract."""
+        return [
+            {
+                "text": entity.get('word'),
+                "label": entity.get('entity_group'),
+                "confidence": round(float(entity.get('score', 0.0)), 4),
+                "start": entity.get('start'),
+                "end": entity.get('end')
+            }
+            for entity in entities
+        ]
@@ -0,0 +1,124 @@
+# ner-service/segments.py
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+# A sentence ends at ., ! or ? followed by whitespace, or at a line break.
+# Decimal numbers ("2.5 mg") don't match because the dot is not followed
+# by whitespace.
+SEGMENT_PATTERN = re.compile(r"[^\n]+?(?:[.!?]+(?=\s)|(?=\n)|$)")
+
+# A segment of a document: its character bounds, its text, and the cached
+# entities for it (offsets relative to the segment), or None on a miss.
+Segment = namedtuple("Segment", ["start", "end", "text", "entities"])
+
+
+class SegmentMemo:
+    """
+    Sentence-level memoization of NER results.
+
+    Hospital documents repeat a lot of boilerplate (headers, disclaimers,
+    standard phrasing). Documents are split into sentences/lines; results
+    for segments seen before are reused with their offsets shifted, and
+    only new segments go through the model. The trade-off is that the
+    model no longer sees context across sentence boundaries.
+    """
+    def __init__(self, capacity: int = 50000):
+        """
+        Args:
+            capacity (int): Maximum number of segments kept (least recently used are evicted).
+        """
+        self.capacity = max(1, capacity)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.segments_seen = 0
+        self.segment_hits = 0
+        self.chars_seen = 0
+        self.chars_skipped = 0
+
+    @staticmethod
+    def split(text: str) -> list:
+        """Returns the (start, end) bounds of the non-blank segments of a text."""
+        spans = []
+        for match in SEGMENT_PATTERN.finditer(text):
+            start, end = match.span()
+            # Trim surrounding whitespace so identical sentences share a key
+            segment = text[start:end]
+            stripped = segment.strip()
+            if not stripped:
+                continue
+            start += len(segment) - len(segment.lstrip())
+            spans.append((start, start + len(stripped)))
+        return spans
+
+    @staticmethod
+    def _key(segment: str) -> str:
+        return hashlib.sha1(segment.encode("utf-8")).hexdigest()
+
+    def plan(self, text: str) -> list:
+        """Splits a text into segments, filling in cached entities where available."""
+        segments = []
+        with self._lock:
+            for start, end in self.split(text):
+                segment_text = text[start:end]
+                key = self._key(segment_text)
+                entities = self._entries.get(key)
+                if entities is not None:
+                    self._entries.move_to_end(key)
+                    self.segment_hits += 1
+                    self.chars_skipped += len(segment_text)
+                self.segments_seen += 1
+                self.chars_seen += len(segment_text)
+                segments.append(Segment(start, end, segment_text, entities))
+        return segments
+
+    def store(self, segment_text: str, entities: list):
+        """Caches the entities predicted for one segment."""
+        with self._lock:
+            key = self._key(segment_text)
+            self._entries[key] = entities
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def assemble(segments: list, fresh: dict) -> list:
+        """
+        Builds document-level entities from per-segment results.
+
+        Args:
+            segments (list): The `Segment` tuples returned by `plan`.
+            fresh (dict): Entities for segments that were not cached, keyed by segment text.
+
+        Returns:
+            list: Entities with document character offsets, in order.
+        """
+        entities = []
+        for segment in segments:
+            segment_entities = segment.entities if segment.entities is not None else fresh[segment.text]
+            for entity in segment_entities:
+                if entity.get("start") is not None:
+                    entity = dict(entity, start=entity["start"] + segment.start, end=entity["end"] + segment.start)
+                entities.append(entity)
+        return entities
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Returns segment and character hit rates."""
+        with self._lock:
+            return {
+                "segments_seen": self.segments_seen,
+                "segment_hits": self.segment_hits,
+                "segment_hit_rate": round(self.segment_hits / self.segments_seen, 4) if self.segments_seen else 0.0,
+                "chars_seen": self.chars_seen,
+                "chars_skipped": self.chars_skipped,
+                "char_hit_rate": round(self.chars_skipped / self.chars_seen, 4) if self.chars_seen else 0.0,
+                "entries": len(self._entries),
+                "capacity": self.capacity,
+            }
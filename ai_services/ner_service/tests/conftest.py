@@ -0,0 +1,11 @@
+# ner-service/tests/conftest.py
+
+import os
+import sys
+
+# The service uses flat imports (it runs from its own directory), so make
+# its modules, and the shared ones in ai_services/common, importable from
+# the tests.
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+sys.path.append(os.path.dirname(SERVICE_DIR))
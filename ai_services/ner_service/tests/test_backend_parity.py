@@ -0,0 +1,76 @@
+# ner-service/tests/test_backend_parity.py
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("optimum.onnxruntime")
+
+from ner_model import NERModel
+
+TEXTS = [
+    "Patient name: John Doe. Age: 35. Has type 2 diabetes mellitus and hypertension.",
+    "The patient presented with acute chest pain radiating to the left arm and was given 325 mg aspirin.",
+    "CT scan of the abdomen revealed a 2 cm hypodense lesion in the right lobe of the liver.",
+    "History of asthma, currently on salbutamol inhaler. Denies fever, cough or shortness of breath.",
+    "Discharged on metformin 500 mg twice daily and lisinopril 10 mg once daily; follow up in 2 weeks.",
+]
+# Allowed start/end difference in characters, and confidence difference
+SPAN_TOLERANCE = 1
+SCORE_TOLERANCE = 0.05
+# Minimum fraction of entities matched across all texts, penalizing both
+# missed and extra entities (int8 quantization may flip a borderline one)
+MIN_AGREEMENT = 0.95
+
+
+def match_entities(reference: list, candidate: list) -> tuple:
+    """
+    Greedily matches candidate entities to reference entities with the same
+    label and a span within SPAN_TOLERANCE.
+
+    Returns:
+        tuple: The number of matches and the confidence differences of the matches.
+    """
+    unmatched = list(candidate)
+    score_diffs = []
+    for ref in reference:
+        for cand in unmatched:
+            if cand["label"] != ref["label"]:
+                continue
+            if abs(cand["start"] - ref["start"]) > SPAN_TOLERANCE or abs(cand["end"] - ref["end"]) > SPAN_TOLERANCE:
+                continue
+            score_diffs.append(abs(cand["confidence"] - ref["confidence"]))
+            unmatched.remove(cand)
+            break
+    return len(score_diffs), score_diffs
+
+
+@pytest.fixture(scope="module")
+def models():
+    torch_model = NERModel(backend="torch")
+    onnx_model = NERModel(backend="onnx")
+    if onnx_model.backend != "onnx":
+        pytest.skip("The ONNX backend could not be built")
+    return torch_model, onnx_model
+
+
+def test_onnx_entities_match_torch(models):
+    torch_model, onnx_model = models
+    total_ref = total_cand = total_matched = 0
+    for text, ref, cand in zip(TEXTS, torch_model.predict_batch(TEXTS), onnx_model.predict_batch(TEXTS)):
+        matched, score_diffs = match_entities(ref, cand)
+        total_ref += len(ref)
+        total_cand += len(cand)
+        total_matched += matched
+        assert all(diff <= SCORE_TOLERANCE for diff in score_diffs), f"Confidence drift over {SCORE_TOLERANCE}: {text}"
+
+    agreement = total_matched / max(total_ref, total_cand, 1)
+    assert agreement >= MIN_AGREEMENT, f"{total_matched} of {max(total_ref, total_cand)} entities matched"
+
+
+def test_entity_offsets_fall_within_the_text(models):
+    torch_model, onnx_model = models
+    for text, ref, cand in zip(TEXTS, torch_model.predict_batch(TEXTS), onnx_model.predict_batch(TEXTS)):
+        for entity in ref + cand:
+            assert 0 <= entity["start"] < entity["end"] <= len(text)
@@ -0,0 +1,114 @@
+# ner-service/tests/test_workers.py
+
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from workers import InferencePool
+
+pytestmark = pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(), reason="the worker pool needs fork()"
+)
+
+
+class EchoModel:
+    """Stands in for NERModel: tags each text with the pid that handled it."""
+    backend = "echo"
+
+    def prepare_worker(self, threads: int):
+        self.threads = threads
+
+    def warm_up(self):
+        pass
+
+    def predict_batch(self, texts: list) -> list:
+        if "fail" in texts:
+            raise ValueError("bad input")
+        if "hang" in texts:
+            time.sleep(60)
+        return [[{"text": text, "pid": os.getpid(), "threads": self.threads}] for text in texts]
+
+
+class BrokenModel:
+    def __init__(self):
+        raise OSError("weights not found")
+
+
+def wait_until(condition, timeout: float = 10) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def pool():
+    pool = InferencePool(EchoModel, num_workers=2, threads_per_worker=3, respawn_delay=0)
+    pool.start()
+    try:
+        pool.wait_ready(timeout=10)
+        yield pool
+    finally:
+        pool.stop()
+
+
+def test_dispatches_batches_to_the_workers(pool):
+    results = pool.predict_batch(["a", "b"])
+
+    assert [result[0]["text"] for result in results] == ["a", "b"]
+    assert results[0][0]["threads"] == 3
+    worker_pids = {replica["pid"] for replica in pool.stats()["replicas"]}
+    assert results[0][0]["pid"] in worker_pids
+    assert os.getpid() not in worker_pids
+    assert pool.backend == "echo"
+
+
+def test_spreads_concurrent_batches_over_the_workers(pool):
+    results = []
+    threads = [threading.Thread(target=lambda i=i: results.append(pool.predict_batch([str(i)]))) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert len(results) == 20
+    assert sum(replica["completed"] for replica in pool.stats()["replicas"]) >= 20
+
+
+def test_model_errors_are_raised_to_the_caller(pool):
+    with pytest.raises(RuntimeError, match="ValueError: bad input"):
+        pool.predict_batch(["fail"])
+    assert pool.predict_batch(["ok"])[0][0]["text"] == "ok"
+
+
+def test_dead_worker_fails_its_batch_and_is_replaced(pool):
+    hanging = pool._submit(["hang"])
+    # Kill the worker that is stuck on the batch
+    busy = next(r for r in pool.stats()["replicas"] if r["inflight"])
+    os.kill(busy["pid"], signal.SIGKILL)
+
+    with pytest.raises(RuntimeError, match="died"):
+        hanging.result(timeout=10)
+
+    assert wait_until(lambda: pool.alive_workers == 2)
+    replicas = {r["slot"]: r for r in pool.stats()["replicas"]}
+    assert replicas[busy["slot"]]["restarts"] == 1
+    assert replicas[busy["slot"]]["pid"] != busy["pid"]
+    # Both the surviving worker and the replacement serve traffic
+    assert len(pool.predict_batch([str(i) for i in range(4)])) == 4
+
+
+def test_model_load_failure_is_reported():
+    pool = InferencePool(BrokenModel, num_workers=1, threads_per_worker=1)
+    pool.start()
+    try:
+        with pytest.raises(RuntimeError, match="weights not found"):
+            pool.wait_ready(timeout=10)
+    finally:
+        pool.stop()
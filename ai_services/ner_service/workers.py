@@ -0,0 +1,356 @@
+# ner-service/workers.py
+
+import gc
+import itertools
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener, wait
+
+
+def _worker_main(slot: int, model, address, authkey: bytes, threads: int):
+    """Entry point of an inference worker process, forked by the supervisor."""
+    conn = Client(address, family="AF_UNIX", authkey=authkey)
+    try:
+        model.prepare_worker(threads)
+        model.warm_up()
+    except Exception as e:
+        conn.send(("failed", slot, f"{type(e).__name__}: {e}"))
+        conn.close()
+        return
+    conn.send(("ready", slot, os.getpid(), model.backend))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+
+        request_id, texts = message
+        try:
+            conn.send((request_id, True, model.predict_batch(texts)))
+        except Exception as e:
+            # Exceptions are not always picklable, so send the message only
+            conn.send((request_id, False, f"{type(e).__name__}: {e}"))
+    conn.close()
+
+
+def _supervise(model_factory, num_workers: int, threads: int, address, authkey: bytes, control, respawn_delay: float):
+    """
+    Main loop of the supervisor process.
+
+    Loads the model, forks the workers from this single-threaded process and
+    forks a replacement whenever one exits. Returns when the parent asks it
+    to stop or goes away.
+    """
+    try:
+        model = model_factory()
+    except Exception as e:
+        control.send(("failed", f"{type(e).__name__}: {e}"))
+        return
+
+    # Forking after the Rust tokenizer has used threads can deadlock
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    # Move existing objects out of the collector's reach so GC passes in
+    # the workers don't write to (and therefore copy) the shared pages
+    gc.freeze()
+
+    context = multiprocessing.get_context("fork")
+
+    def fork_worker(slot: int):
+        process = context.Process(
+            target=_worker_main,
+            args=(slot, model, address, authkey, threads),
+            name=f"ner-worker-{slot}",
+            daemon=True
+        )
+        process.start()
+        return process
+
+    workers = {slot: fork_worker(slot) for slot in range(num_workers)}
+    try:
+        while True:
+            ready = wait([control] + [process.sentinel for process in workers.values()])
+            if control in ready:
+                # A stop request (None) or EOF because the parent is gone
+                break
+            for slot, process in list(workers.items()):
+                if process.sentinel in ready:
+                    process.join()
+                    print(f"NER worker {slot} (pid {process.pid}) exited with code {process.exitcode}; starting a replacement.", flush=True)
+                    time.sleep(respawn_delay)
+                    workers[slot] = fork_worker(slot)
+    finally:
+        for process in workers.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+
+class _Replica:
+    """Parent-side handle of one worker process."""
+    def __init__(self, slot: int, pid: int, conn):
+        self.slot = slot
+        self.pid = pid
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.pending = {}
+        self.inflight = 0
+        self.completed = 0
+        self.alive = True
+
+
+class InferencePool:
+    """
+    Runs NER inference in N forked worker processes.
+
+    `start` forks a supervisor process, which must happen before this
+    process starts any thread: a fork copies only the calling thread, so
+    locks held by other threads at that moment stay locked forever in the
+    child. The supervisor loads the model once and forks the workers from
+    itself, so they share its weights copy-on-write; when a worker dies it
+    forks a replacement, again from a process that never started a thread.
+
+    Each worker limits torch (or ONNX Runtime) to its own intra-op thread
+    budget, warms up, and then connects back to this process over a Unix
+    socket. `predict_batch` sends each batch to the live worker with the
+    fewest batches in flight and blocks until the result comes back.
+    Batches in flight on a worker that dies fail with RuntimeError.
+    """
+    def __init__(self, model_factory, num_workers: int, threads_per_worker: int, respawn_delay: float = 1.0):
+        """
+        Args:
+            model_factory (callable): Builds the model in the supervisor,
+                                      e.g. the NERModel class.
+            num_workers (int): Number of worker processes.
+            threads_per_worker (int): Intra-op threads for each worker.
+            respawn_delay (float): Seconds to wait before replacing a dead
+                                   worker, so a worker that crashes on
+                                   start-up does not fork in a tight loop.
+        """
+        self.model_factory = model_factory
+        self.num_workers = max(1, num_workers)
+        self.threads_per_worker = max(1, threads_per_worker)
+        self.respawn_delay = respawn_delay
+        self.backend = None
+        self._slots = [None] * self.num_workers
+        self._restarts = [0] * self.num_workers
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._request_ids = itertools.count()
+        self._authkey = os.urandom(32)
+        self._listener = None
+        self._control = None
+        self._supervisor_pid = None
+        self._error = None
+        self._stopping = False
+
+    def start(self):
+        """
+        Forks the supervisor, then starts the threads that accept worker
+        connections. Call it before this process starts any other thread.
+        """
+        self._listener = Listener(family="AF_UNIX", authkey=self._authkey)
+        control, child_control = multiprocessing.Pipe()
+
+        # Unflushed output would otherwise be written by both processes
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                control.close()
+                _supervise(
+                    self.model_factory, self.num_workers, self.threads_per_worker,
+                    self._listener.address, self._authkey, child_control, self.respawn_delay
+                )
+            except BaseException as e:
+                print(f"NER worker supervisor failed: {e!r}", flush=True)
+                code = 1
+            finally:
+                os._exit(code)
+
+        child_control.close()
+        self._supervisor_pid, self._control = pid, control
+        threading.Thread(target=self._accept_workers, name="ner-worker-accept", daemon=True).start()
+        threading.Thread(target=self._watch_supervisor, name="ner-worker-supervisor", daemon=True).start()
+        print(f"Starting {self.num_workers} NER worker processes with {self.threads_per_worker} threads each.")
+
+    def wait_ready(self, timeout: float = None):
+        """
+        Blocks until every worker has loaded and warmed up.
+
+        Raises:
+            RuntimeError: If the model or a worker failed to start, or the
+                          workers are not ready within the timeout.
+        """
+        with self._changed:
+            done = self._changed.wait_for(lambda: self._error or self.alive_workers == self.num_workers, timeout)
+            if self._error:
+                raise RuntimeError(self._error)
+            if not done:
+                raise RuntimeError(f"Only {self.alive_workers} of {self.num_workers} NER workers started in time.")
+
+    def stop(self):
+        """Asks the workers and the supervisor to exit and waits for them."""
+        if self._stopping or self._supervisor_pid is None:
+            return
+        self._stopping = True
+        with self._lock:
+            replicas = [replica for replica in self._slots if replica and replica.alive]
+        for replica in replicas:
+            try:
+                with replica.send_lock:
+                    replica.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        try:
+            self._control.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self._listener.close()
+
+        deadline = time.monotonic() + 10
+        while os.waitpid(self._supervisor_pid, os.WNOHANG) == (0, 0):
+            if time.monotonic() > deadline:
+                os.kill(self._supervisor_pid, signal.SIGKILL)
+                os.waitpid(self._supervisor_pid, 0)
+                break
+            time.sleep(0.05)
+        self._control.close()
+
+    @property
+    def alive_workers(self) -> int:
+        return sum(1 for replica in self._slots if replica and replica.alive)
+
+    def _submit(self, texts: list) -> Future:
+        """Sends a batch to the least-loaded live replica."""
+        future = Future()
+        with self._lock:
+            live = [r for r in self._slots if r and r.alive]
+            if not live:
+                raise RuntimeError("No NER worker processes are alive.")
+            replica = min(live, key=lambda r: r.inflight)
+            request_id = next(self._request_ids)
+            replica.pending[request_id] = future
+            replica.inflight += 1
+
+        try:
+            with replica.send_lock:
+                replica.conn.send((request_id, texts))
+        except (BrokenPipeError, OSError) as e:
+            self._fail_replica(replica, e)
+        return future
+
+    def predict_batch(self, texts: list) -> list:
+        """Runs `NERModel.predict_batch` on the least-loaded worker."""
+        return self._submit(texts).result()
+
+    def _accept_workers(self):
+        """Registers each worker (first ones and replacements) once it reports ready."""
+        while True:
+            try:
+                conn = self._listener.accept()
+                message = conn.recv()
+            except (EOFError, OSError, multiprocessing.AuthenticationError):
+                if self._stopping:
+                    return
+                continue
+
+            if message[0] == "failed":
+                _, slot, error = message
+                conn.close()
+                print(f"NER worker {slot} failed to start: {error}")
+                with self._changed:
+                    if self._slots[slot] is None:
+                        # Only a first start is fatal; replacements are retried
+                        self._error = error
+                    self._changed.notify_all()
+                continue
+
+            _, slot, pid, backend = message
+            replica = _Replica(slot, pid, conn)
+            with self._changed:
+                if self._slots[slot] is not None:
+                    self._restarts[slot] += 1
+                self._slots[slot] = replica
+                self.backend = backend
+                self._changed.notify_all()
+            threading.Thread(target=self._read_results, args=(replica,), name=f"ner-worker-{slot}-reader", daemon=True).start()
+
+    def _watch_supervisor(self):
+        """Records a supervisor that failed to load the model, or exited early."""
+        try:
+            _, error = self._control.recv()
+        except (EOFError, OSError):
+            error = None if self._stopping else "The NER worker supervisor exited."
+        if error is None:
+            return
+        print(f"NER worker supervisor: {error}")
+        with self._changed:
+            self._error = error
+            self._changed.notify_all()
+
+    def _read_results(self, replica: _Replica):
+        while True:
+            try:
+                request_id, ok, payload = replica.conn.recv()
+            except (EOFError, OSError) as e:
+                self._fail_replica(replica, e)
+                return
+
+            with self._lock:
+                future = replica.pending.pop(request_id, None)
+                replica.inflight -= 1
+                replica.completed += 1
+            if future is None:
+                continue
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+
+    def _fail_replica(self, replica: _Replica, error: Exception):
+        """Marks a replica as dead and fails everything it still owed."""
+        with self._lock:
+            if not replica.alive:
+                return
+            replica.alive = False
+            pending = list(replica.pending.values())
+            replica.pending.clear()
+            replica.inflight = 0
+        replica.conn.close()
+        if not self._stopping:
+            print(f"NER worker {replica.slot} (pid {replica.pid}) stopped responding: {error!r}")
+        for future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError(f"NER worker {replica.slot} died."))
+
+    def stats(self) -> dict:
+        """Returns per-worker load, liveness and restart counts."""
+        with self._lock:
+            return {
+                "workers": self.num_workers,
+                "alive": self.alive_workers,
+                "threads_per_worker": self.threads_per_worker,
+                "supervisor_pid": self._supervisor_pid,
+                "replicas": [
+                    {
+                        "slot": slot,
+                        "pid": r.pid if r else None,
+                        "alive": bool(r and r.alive),
+                        "inflight": r.inflight if r else 0,
+                        "completed": r.completed if r else 0,
+                        "restarts": self._restarts[slot],
+                    }
+                    for slot, r in enumerate(self._slots)
+                ],
+            }
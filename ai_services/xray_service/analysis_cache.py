@@ -0,0 +1,209 @@
+# xray-analysis-service/analysis_cache.py
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+# The parts of an analysis that can be stored. Entries may be partial: a
+# /compare call only needs the BiomedCLIP embedding, so ChexNet
+# probabilities are filled in later if the image is analyzed.
+FIELDS = ("embedding", "probabilities", "report", "labels_key")
+
+
+class AnalysisCache:
+    """
+    A two-tier, content-addressed store of X-ray analyses.
+
+    Keys are a SHA-256 of the model version plus the hash of the decoded
+    pixels, so a re-upload of the same X-ray (even re-encoded) is a hit,
+    while a model change never serves old results. Each entry holds the
+    BiomedCLIP image embedding, the ChexNet probabilities and the findings
+    report with the key of the label set it was generated for. A bounded
+    in-memory LRU sits in front of a SQLite table that persists across
+    restarts and is pruned to the most recently used entries.
+    """
+    def __init__(self, model_version: str, memory_items: int = 256, disk_path: str = None, disk_max_items: int = 20000):
+        """
+        Args:
+            model_version (str): Identifies the models producing the analyses.
+            memory_items (int): Capacity of the in-memory LRU tier.
+            disk_path (str): SQLite file for the persistent tier. None disables it.
+            disk_max_items (int): Rows kept on disk before the least recently used are pruned.
+        """
+        self.model_version = model_version
+        self.memory_items = max(0, memory_items)
+        self.disk_max_items = disk_max_items
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._inserts_since_prune = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS xray_analysis (
+                    key TEXT PRIMARY KEY,
+                    model_version TEXT NOT NULL,
+                    embedding BLOB,
+                    probabilities TEXT,
+                    report TEXT,
+                    labels_key TEXT,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_xray_analysis_accessed ON xray_analysis (accessed_at)")
+            self._db.commit()
+
+    def _key(self, digest: str) -> str:
+        key = hashlib.sha256()
+        key.update(self.model_version.encode("utf-8"))
+        key.update(b"\0")
+        key.update(digest.encode("ascii"))
+        return key.hexdigest()
+
+    def _remember(self, key: str, entry: dict):
+        """Inserts into the memory tier, evicting the least recently used entry. Caller holds the lock."""
+        if not self.memory_items:
+            return
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    @staticmethod
+    def _from_row(row) -> dict:
+        embedding, probabilities, report, labels_key = row
+        return {
+            "embedding": np.frombuffer(embedding, dtype=np.float32) if embedding is not None else None,
+            "probabilities": np.asarray(json.loads(probabilities), dtype=np.float32) if probabilities is not None else None,
+            "report": report,
+            "labels_key": labels_key,
+        }
+
+    def get(self, digest: str) -> Optional[dict]:
+        """
+        Returns the stored analysis for an image, or None on a miss.
+
+        Returns:
+            dict: "embedding", "probabilities", "report" and "labels_key";
+                  parts that were never computed are None.
+        """
+        key = self._key(digest)
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return dict(entry)
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT embedding, probabilities, report, labels_key FROM xray_analysis WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE xray_analysis SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+                    entry = self._from_row(row)
+                    self._remember(key, entry)
+                    self.disk_hits += 1
+                    return dict(entry)
+
+            self.misses += 1
+            return None
+
+    def put(self, digest: str, **parts):
+        """
+        Stores (parts of) the analysis of an image, merging with what is
+        already stored. Keyword arguments are any of `FIELDS`.
+        """
+        unknown = set(parts) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown analysis fields: {sorted(unknown)}")
+        key = self._key(digest)
+
+        with self._lock:
+            # An entry evicted from memory may still be complete on disk; it
+            # is reloaded from there on the next get instead of being
+            # replaced by this partial update.
+            if key in self._memory or self._db is None:
+                entry = dict(self._memory.get(key) or dict.fromkeys(FIELDS))
+                entry.update({name: value for name, value in parts.items() if value is not None})
+                self._remember(key, entry)
+            if self._db is None:
+                return
+
+            embedding = parts.get("embedding")
+            probabilities = parts.get("probabilities")
+            now = time.time()
+            self._db.execute(
+                """INSERT INTO xray_analysis (key, model_version, embedding, probabilities, report, labels_key, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    embedding = COALESCE(excluded.embedding, embedding),
+                    probabilities = COALESCE(excluded.probabilities, probabilities),
+                    report = COALESCE(excluded.report, report),
+                    labels_key = COALESCE(excluded.labels_key, labels_key),
+                    accessed_at = excluded.accessed_at""",
+                (
+                    key,
+                    self.model_version,
+                    np.asarray(embedding, dtype=np.float32).tobytes() if embedding is not None else None,
+                    json.dumps([float(p) for p in probabilities]) if probabilities is not None else None,
+                    parts.get("report"),
+                    parts.get("labels_key"),
+                    now,
+                    now,
+                )
+            )
+            self._inserts_since_prune += 1
+            if self._inserts_since_prune >= 100:
+                self._prune()
+            self._db.commit()
+
+    def _prune(self):
+        """Deletes the least recently used rows beyond the disk capacity. Caller holds the lock."""
+        self._inserts_since_prune = 0
+        self._db.execute(
+            """DELETE FROM xray_analysis WHERE key IN (
+                SELECT key FROM xray_analysis ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.disk_max_items,)
+        )
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters and tier sizes."""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            disk_items = None
+            if self._db is not None:
+                disk_items = self._db.execute("SELECT COUNT(*) FROM xray_analysis").fetchone()[0]
+            return {
+                "model_version": self.model_version,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "memory_items": len(self._memory),
+                "memory_capacity": self.memory_items,
+                "disk_items": disk_items,
+                "disk_capacity": self.disk_max_items if self._db is not None else None,
+            }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -1,10 +1,24 @@
 # xray-analysis-service/app.py
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, Form, Query, UploadFile, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel, Field
 from typing import List, Optional
-from PIL import Image
-import io
+import asyncio
+import os
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Modules shared by the AI services live in ai_services/common
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from common.admission import AdmissionController, Overloaded
+from analysis_cache import AnalysisCache
+from common.batcher import MicroBatcher
+from decoding import ImageTooLarge
+from segmentation import SegmentationStore, StoredMaps, thumbnail_from_input
 
 # Import the singleton instance of our model handler
 from xray_model import xray_model_instance
@@ -17,10 +31,21 @@ class PathologyResult(BaseModel):
     detected: bool
 
 class AnalyzeResponse(BaseModel):
-    pathologies: List[PathologyResult]
-    generated_report: str
-    # The segmentation map will be a base64 encoded string
+    # Fields of heads left out through `include` are None
+    pathologies: Optional[List[PathologyResult]] = None
+    generated_report: Optional[str] = None
+    # Base64 PNG overlay of the activation maps of the detected pathologies.
+    # Only filled in with include=segmentation; otherwise it can be fetched
+    # later from GET /segmentation/{analysis_id}.
     segmentation_map: Optional[str] = None
+    # Set when ChexNet ran for this request and its maps were kept
+    analysis_id: Optional[str] = None
+
+class AnalyzeBatchItem(AnalyzeResponse):
+    filename: Optional[str] = None
+
+class AnalyzeBatchResponse(BaseModel):
+    results: List[AnalyzeBatchItem]
 
 class CompareRequest(BaseModel):
     # In a real app, you might pass image IDs, but for this service, we'll handle uploads
@@ -29,6 +54,14 @@ class CompareRequest(BaseModel):
 class CompareResponse(BaseModel):
     comparison_report: str
 
+class CompareReportsRequest(BaseModel):
+    previous_report: str = Field(..., min_length=1)
+    current_report: str = Field(..., min_length=1)
+
+class CompareWithBaselineResponse(CompareResponse):
+    # Full analysis of the current image, so the caller can store it
+    current_analysis: AnalyzeResponse
+
 class QNARequest(BaseModel):
     report_context: str = Field(..., min_length=10)
     question: str = Field(..., min_length=1)
@@ -38,21 +71,162 @@ class QNAResponse(BaseModel):
 
 # --- FastAPI Application ---
 
+# Parts of an analysis a caller can ask for, and the model head each one needs
+INCLUDE_HEADS = {
+    "pathologies": "chexnet",
+    "report": "biomed_clip",
+    "segmentation": "chexnet",
+}
+# Heatmaps are opt-in so default latency and response size don't grow
+DEFAULT_INCLUDE = "pathologies,report"
+
+# Bounded queues in front of model execution and Gemini calls.
+# They are created in the lifespan so they bind to the serving event loop.
+admission = {}
+
+# Dedicated executors, so blocking work never runs on the event loop and
+# slow Gemini calls can't starve image preprocessing (or vice versa)
+executors = {}
+
+# One batcher per model head. Concurrent /analyze calls (and the images of
+# an /analyze_batch request) are stacked into one forward pass per model.
+batchers = {
+    "chexnet": MicroBatcher(
+        xray_model_instance.chexnet_analyze_batch,
+        max_batch_size=config.XRAY_MAX_BATCH_SIZE,
+        max_wait_ms=config.XRAY_MAX_BATCH_WAIT_MS,
+        name="chexnet-batcher"
+    ),
+    "biomed_clip": MicroBatcher(
+        xray_model_instance.encode_images_batch,
+        max_batch_size=config.XRAY_MAX_BATCH_SIZE,
+        max_wait_ms=config.XRAY_MAX_BATCH_WAIT_MS,
+        name="biomed-clip-batcher"
+    ),
+}
+
+# Analyses keyed by pixel hash + model version. A follow-up /compare or a
+# re-upload reuses the stored embedding and probabilities instead of
+# running the models again. Opened in the lifespan, once ChexNet has
+# loaded, because the version names the backend actually in use.
+analysis_cache = None
+
+# Unrendered class activation maps of recent analyses, by analysis id
+segmentation_store = SegmentationStore(config.XRAY_SEGMENTATION_STORE_ITEMS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global analysis_cache
+    admission["inference"] = AdmissionController(config.XRAY_MAX_INFLIGHT, config.XRAY_MAX_QUEUE, name="inference")
+    admission["qna"] = AdmissionController(config.XRAY_QNA_MAX_INFLIGHT, config.XRAY_QNA_MAX_QUEUE, name="qna")
+    executors["preprocess"] = ThreadPoolExecutor(config.XRAY_PREPROCESS_WORKERS, thread_name_prefix="xray-preprocess")
+    executors["gemini"] = ThreadPoolExecutor(config.XRAY_GEMINI_WORKERS, thread_name_prefix="xray-gemini")
+    # Heads not listed here load on first use
+    await asyncio.to_thread(xray_model_instance.load_heads, config.XRAY_EAGER_HEADS)
+    if config.XRAY_CACHE_ENABLED:
+        # Reading the version loads ChexNet if it isn't an eager head
+        model_version = await asyncio.to_thread(lambda: xray_model_instance.version)
+        analysis_cache = AnalysisCache(
+            model_version,
+            memory_items=config.XRAY_CACHE_MEMORY_ITEMS,
+            disk_path=config.XRAY_CACHE_PATH or None,
+            disk_max_items=config.XRAY_CACHE_DISK_MAX_ITEMS
+        )
+    for batcher in batchers.values():
+        batcher.start()
+    yield
+    for batcher in batchers.values():
+        batcher.stop()
+    for executor in executors.values():
+        executor.shutdown(wait=False, cancel_futures=True)
+    if analysis_cache:
+        analysis_cache.close()
+
 app = FastAPI(
     title="X-Ray Analysis Service",
     description="A microservice for analyzing X-ray images, including pathology detection, report generation, comparison, and Q&A.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-def read_image_from_upload(file: UploadFile) -> Image.Image:
-    """Helper function to read and validate an uploaded image file."""
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    """Sheds load with 429 and a Retry-After based on measured service time."""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "X-Ray service is overloaded. Please retry later."},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.middleware("http")
+async def limit_request_size(request: Request, call_next):
+    """Rejects oversized requests from their Content-Length, before the body is read."""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > config.XRAY_MAX_REQUEST_MB * 1024 * 1024:
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"Request is larger than {config.XRAY_MAX_REQUEST_MB} MB."}
+        )
+    return await call_next(request)
+
+def check_upload_size(file: UploadFile):
+    """
+    Rejects an upload larger than XRAY_MAX_UPLOAD_MB.
+
+    Raises:
+        HTTPException: 413 if the file is too large.
+    """
+    size = file.size
+    if size is None:
+        # Older Starlette versions don't record the size; measure the spooled file
+        size = file.file.seek(0, 2)
+        file.file.seek(0)
+    if size > config.XRAY_MAX_UPLOAD_MB * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"Image file is larger than {config.XRAY_MAX_UPLOAD_MB} MB.")
+
+
+async def run_in_executor(name: str, func, *args):
+    """Runs a blocking call on one of the dedicated executors."""
+    return await asyncio.get_running_loop().run_in_executor(executors[name], func, *args)
+
+
+def parse_include(include: str) -> set:
+    """
+    Parses the comma-separated `include` parameter of the analysis endpoints.
+
+    Raises:
+        HTTPException: 400 for an unknown or empty selection.
+    """
+    parts = {part.strip() for part in include.split(",") if part.strip()}
+    unknown = parts - set(INCLUDE_HEADS)
+    if unknown or not parts:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid include '{include}'. Choose from: {', '.join(INCLUDE_HEADS)}."
+        )
+    return parts
+
+
+async def prepare_upload(file: UploadFile, heads=None):
+    """
+    Decodes an uploaded X-ray once and builds the inputs of the given model heads.
+
+    Decoding and resizing are CPU work, so they run off the event loop. The
+    decoder reads the spooled upload directly (memory-mapping DICOM pixel
+    data when it was spooled to disk) instead of copying it into memory.
+
+    Returns:
+        PreparedImage: The ChexNet and/or BiomedCLIP input tensors.
+
+    Raises:
+        HTTPException: 413 if the file or image is too large, 400 if it is not an image.
+    """
     try:
-        # Read content from the uploaded file
-        contents = file.file.read()
-        # Open it as a PIL Image
-        image = Image.open(io.BytesIO(contents))
-        return image
-    except Exception as e:
+        check_upload_size(file)
+        return await run_in_executor("preprocess", xray_model_instance.preprocessor.prepare_bytes, file.file, heads)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
         print(f"Error reading image file: {e}")
         raise HTTPException(status_code=400, detail="Invalid image file provided.")
     finally:
@@ -60,29 +234,175 @@ def read_image_from_upload(file: UploadFile) -> Image.Image:
         file.file.close()
 
 
+async def run_heads(images: list, heads, maps: bool = False) -> list:
+    """
+    Gets the analysis of each prepared image, running only what is missing.
+
+    Stored analyses are looked up by pixel hash first. Images without stored
+    probabilities (when "chexnet" is in `heads`) or embedding (when
+    "biomed_clip" is) go through the batchers, which run on their own
+    threads, so the two heads work in parallel and the event loop stays
+    free while they do. Reports are rebuilt from embeddings when the
+    zero-shot label set changed. Everything newly computed is stored.
+
+    Class activation maps come out of every ChexNet pass but are not
+    cached; with `maps` set, ChexNet runs even for cached images so the
+    maps are available.
+
+    Returns:
+        list: One dict per image with "embedding", "probabilities",
+              "report" and "maps" (None for parts that were not requested
+              and not stored), in order.
+    """
+    if analysis_cache:
+        entries = await run_in_executor("preprocess", lambda: [analysis_cache.get(image.digest) for image in images])
+    else:
+        entries = [None] * len(images)
+    entries = [entry or {} for entry in entries]
+    fresh = [{} for _ in images]
+
+    chexnet_pending = [i for i, entry in enumerate(entries) if "chexnet" in heads and (maps or entry.get("probabilities") is None)]
+    clip_pending = [i for i, entry in enumerate(entries) if "biomed_clip" in heads and entry.get("embedding") is None]
+    futures = batchers["chexnet"].submit_many([images[i].chexnet for i in chexnet_pending])
+    futures += batchers["biomed_clip"].submit_many([images[i].clip for i in clip_pending])
+    results = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+
+    for i, (probabilities, cams) in zip(chexnet_pending, results[:len(chexnet_pending)]):
+        entries[i]["probabilities"] = fresh[i]["probabilities"] = probabilities
+        entries[i]["maps"] = cams
+    for i, embedding in zip(clip_pending, results[len(chexnet_pending):]):
+        entries[i]["embedding"] = fresh[i]["embedding"] = embedding
+
+    if "biomed_clip" in heads:
+        # A report is only a matrix multiply away from its embedding
+        labels_key = xray_model_instance.labels_key
+        report_pending = [i for i, entry in enumerate(entries) if entry.get("report") is None or entry.get("labels_key") != labels_key]
+        if report_pending:
+            reports, labels_key = xray_model_instance.reports_from_embeddings([entries[i]["embedding"] for i in report_pending])
+            for i, report in zip(report_pending, reports):
+                entries[i]["report"] = fresh[i]["report"] = report
+                entries[i]["labels_key"] = fresh[i]["labels_key"] = labels_key
+
+    if analysis_cache and any(fresh):
+        await run_in_executor("preprocess", lambda: [
+            analysis_cache.put(image.digest, **parts) for image, parts in zip(images, fresh) if parts
+        ])
+    return entries
+
+
+def keep_maps(image, entry: dict):
+    """Stores the activation maps of an analysis and returns its new analysis id."""
+    analysis_id = uuid.uuid4().hex
+    segmentation_store.put(analysis_id, StoredMaps(
+        thumbnail_from_input(image.chexnet),
+        entry["maps"],
+        xray_model_instance.chexnet_labels,
+        entry["probabilities"]
+    ))
+    return analysis_id
+
+
+async def analyze_images(images: list, include: set) -> list:
+    """
+    Runs the model heads needed for `include` over a list of prepared images.
+
+    Activation maps captured by ChexNet are kept under a new analysis id;
+    they are only rendered to PNG here when "segmentation" is included.
+
+    Returns:
+        list: One `AnalyzeResponse`-shaped dict per image, in order.
+    """
+    entries = await run_heads(images, {INCLUDE_HEADS[part] for part in include}, maps="segmentation" in include)
+    analyses = []
+    for image, entry in zip(images, entries):
+        analysis_id = keep_maps(image, entry) if entry.get("maps") is not None else None
+        segmentation_map = None
+        if analysis_id and "segmentation" in include:
+            segmentation_map = await run_in_executor("preprocess", segmentation_store.render_base64, analysis_id)
+        analyses.append({
+            "pathologies": xray_model_instance.format_pathologies(entry["probabilities"]) if "pathologies" in include else None,
+            "generated_report": entry["report"] if "report" in include else None,
+            "segmentation_map": segmentation_map,
+            "analysis_id": analysis_id
+        })
+    return analyses
+
+
 @app.post("/analyze", response_model=AnalyzeResponse)
-async def analyze_xray(file: UploadFile = File(...)):
+async def analyze_xray(file: UploadFile = File(...), include: str = Query(DEFAULT_INCLUDE)):
     """
     Analyzes a single uploaded X-ray image.
     - Detects pathologies using ChexNet.
     - Generates a descriptive report using BiomedCLIP.
+
+    `include` (comma-separated "pathologies", "report", "segmentation")
+    selects the parts to compute; heads that aren't needed are skipped
+    entirely. Segmentation maps are opt-in: by default only an
+    `analysis_id` is returned, for GET /segmentation/{analysis_id}.
     """
-    image = read_image_from_upload(file)
-    
-    try:
-        pathologies = xray_model_instance.predict_pathologies(image)
-        report = xray_model_instance.generate_biomed_clip_report(image)
-        
-        # For now, segmentation map is a placeholder. A full implementation
-        # would use Grad-CAM and return a base64 string of the map image.
+    include = parse_include(include)
+    heads = {INCLUDE_HEADS[part] for part in include}
+
+    async with admission["inference"].admit():
+        image = await prepare_upload(file, heads)
         
-        return {
-            "pathologies": pathologies,
-            "generated_report": report,
-            "segmentation_map": None # Placeholder
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An error occurred during analysis: {str(e)}")
+        try:
+            [analysis] = await analyze_images([image], include)
+            return analysis
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"An error occurred during analysis: {str(e)}")
+
+
+@app.post("/analyze_batch", response_model=AnalyzeBatchResponse)
+async def analyze_xray_batch(files: List[UploadFile] = File(...), include: str = Query(DEFAULT_INCLUDE)):
+    """
+    Analyzes many X-ray images uploaded in one multipart request.
+
+    The images share batched forward passes with each other and with any
+    concurrent /analyze calls. Results are returned in upload order.
+    `include` works as for /analyze.
+    """
+    include = parse_include(include)
+    heads = {INCLUDE_HEADS[part] for part in include}
+    if len(files) > config.XRAY_MAX_IMAGES_PER_REQUEST:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many images in one request (max {config.XRAY_MAX_IMAGES_PER_REQUEST})."
+        )
+
+    async with admission["inference"].admit():
+        images = await asyncio.gather(*(prepare_upload(file, heads) for file in files))
+
+        try:
+            analyses = await analyze_images(images, include)
+            return {
+                "results": [
+                    {"filename": file.filename, **analysis}
+                    for file, analysis in zip(files, analyses)
+                ]
+            }
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"An error occurred during batch analysis: {str(e)}")
+
+
+@app.get("/segmentation/{analysis_id}")
+async def get_segmentation_map(analysis_id: str, pathology: Optional[str] = None):
+    """
+    Returns the class activation overlay of a recent analysis as a PNG.
+
+    Without `pathology`, the maps of all detected pathologies are combined.
+    Maps are kept for a bounded number of recent analyses only.
+    """
+    maps = segmentation_store.get(analysis_id)
+    if maps is None:
+        raise HTTPException(status_code=404, detail="Segmentation maps not found or expired. Re-run the analysis.")
+    try:
+        png = await run_in_executor("preprocess", segmentation_store.render, analysis_id, pathology)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=str(e.args[0]))
+    if png is None:
+        raise HTTPException(status_code=404, detail="No pathologies were detected in this analysis.")
+    return Response(content=png, media_type="image/png")
 
 
 @app.post("/compare", response_model=CompareResponse)
@@ -91,14 +411,59 @@ async def compare_xrays(previous_xray: UploadFile = File(...), current_xray: Upl
     Compares two uploaded X-ray images by generating reports for each
     and then using a generative model to create a comparison summary.
     """
-    image1 = read_image_from_upload(previous_xray)
-    image2 = read_image_from_upload(current_xray)
+    async with admission["inference"].admit():
+        image1, image2 = await asyncio.gather(
+            prepare_upload(previous_xray, ("biomed_clip",)),
+            prepare_upload(current_xray, ("biomed_clip",))
+        )
+
+        try:
+            previous, current = await run_heads([image1, image2], ("biomed_clip",))
+            report1, report2 = previous["report"], current["report"]
+            comparison_report = await run_in_executor("gemini", xray_model_instance.generate_comparison_from_reports, report1, report2)
+            return {"comparison_report": comparison_report}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"An error occurred during comparison: {str(e)}")
+
+
+@app.post("/compare_reports", response_model=CompareResponse)
+async def compare_reports(payload: CompareReportsRequest):
+    """
+    Compares two previously generated findings reports. No images are
+    uploaded and no model inference runs; only the generative model is called.
+    """
+    async with admission["qna"].admit():
+        try:
+            comparison_report = await run_in_executor(
+                "gemini", xray_model_instance.generate_comparison_from_reports, payload.previous_report, payload.current_report
+            )
+            return {"comparison_report": comparison_report}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"An error occurred during comparison: {str(e)}")
 
-    try:
-        comparison_report = xray_model_instance.generate_comparison_report(image1, image2)
-        return {"comparison_report": comparison_report}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An error occurred during comparison: {str(e)}")
+
+@app.post("/compare_with_baseline", response_model=CompareWithBaselineResponse)
+async def compare_with_baseline(baseline_report: str = Form(..., min_length=1), current_xray: UploadFile = File(...)):
+    """
+    Compares a stored baseline report with a new X-ray.
+
+    Only the new image is uploaded and analyzed; its full analysis is
+    returned alongside the comparison so it can be stored as a report.
+    """
+    async with admission["inference"].admit():
+        image = await prepare_upload(current_xray)
+
+        try:
+            [analysis] = await analyze_images([image], {"pathologies", "report"})
+            comparison_report = await run_in_executor(
+                "gemini", xray_model_instance.generate_comparison_from_reports, baseline_report, analysis["generated_report"]
+            )
+            return {
+                "comparison_report": comparison_report,
+                "current_analysis": analysis
+            }
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"An error occurred during comparison: {str(e)}")
 
 
 @app.post("/qna", response_model=QNAResponse)
@@ -107,11 +472,30 @@ async def answer_question(payload: QNARequest):
 
     Answers a question based on a provided report context using a generative model.
     """
-    try:
-        answer = xray_model_instance.generate_qna_answer(payload.report_context, payload.question)
-        return {"answer": answer}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An error occurred during Q&A: {str(e)}")
+    async with admission["qna"].admit():
+        try:
+            answer = await run_in_executor("gemini", xray_model_instance.generate_qna_answer, payload.report_context, payload.question)
+            return {"answer": answer}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"An error occurred during Q&A: {str(e)}")
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness probe. Answers even while inference is running."""
+    return {"status": "ok"}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Returns loaded heads, admission queue, batching and cache metrics."""
+    return {
+        "loaded_heads": xray_model_instance.loaded_heads,
+        "admission": {name: controller.stats() for name, controller in admission.items()},
+        "batchers": {name: batcher.stats() for name, batcher in batchers.items()},
+        "analysis_cache": analysis_cache.stats() if analysis_cache else None,
+        "segmentation_store": segmentation_store.stats(),
+    }
 
 
 if __name__ == "__main__":
@@ -0,0 +1,254 @@
+# xray-analysis-service/backends.py
+
+import glob
+import os
+import threading
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+import config
+
+# Names of the input and outputs of the exported ChexNet graph. "features"
+# is the final DenseNet feature map, used for class activation maps.
+ONNX_INPUT = "pixel_values"
+ONNX_OUTPUT = "probabilities"
+ONNX_FEATURES = "features"
+QUANTIZE_MODES = ("none", "dynamic", "static")
+CALIBRATION_PATTERNS = ("*.png", "*.jpg", "*.jpeg", "*.tif", "*.tiff", "*.bmp")
+
+
+def chexnet_backend_tag(backend: str = None, quantize: str = None) -> str:
+    """Short description of a ChexNet backend, e.g. "torch" or "onnx-static"."""
+    backend = backend or config.XRAY_CHEXNET_BACKEND
+    quantize = quantize or config.XRAY_CHEXNET_QUANTIZE
+    return "torch" if backend != "onnx" else f"onnx-{quantize}"
+
+
+class TorchChexNetRunner:
+    """
+    Eager PyTorch execution (the original inference path), optionally channels-last.
+
+    A forward hook on the DenseNet feature extractor captures the final
+    feature map during the normal forward pass, so class activation maps
+    need no second inference.
+    """
+    def __init__(self, model: torch.nn.Module, device, channels_last: bool = True):
+        self.model = model
+        self.device = device
+        self.channels_last = channels_last
+        self.name = "torch"
+        if channels_last:
+            # DenseNet's convolutions run faster on NHWC with oneDNN on CPU
+            self.model = self.model.to(memory_format=torch.channels_last)
+        # Per-thread slot for the hooked features, in case several threads run batches
+        self._captured = threading.local()
+        self.model.densenet121.features.register_forward_hook(self._capture_features)
+
+    def _capture_features(self, module, inputs, output):
+        if getattr(self._captured, "enabled", False):
+            # torchvision's DenseNet applies ReLU after `features`; do the same
+            self._captured.features = F.relu(output).float().cpu().numpy()
+
+    def __call__(self, batch: torch.Tensor) -> np.ndarray:
+        return self.run_with_features(batch, features=False)[0]
+
+    def run_with_features(self, batch: torch.Tensor, features: bool = True):
+        """
+        Returns:
+            tuple: (N, 14) probabilities and the (N, 1024, h, w) feature maps,
+                   or None for the features when not requested.
+        """
+        batch = batch.to(self.device)
+        if self.channels_last:
+            batch = batch.contiguous(memory_format=torch.channels_last)
+        self._captured.enabled = features
+        self._captured.features = None
+        try:
+            with torch.inference_mode():
+                probabilities = self.model(batch).float().cpu().numpy()
+            return probabilities, self._captured.features
+        finally:
+            self._captured.enabled = False
+            self._captured.features = None
+
+
+class OnnxChexNetRunner:
+    """ONNX Runtime execution of the exported (optionally int8) ChexNet graph."""
+    def __init__(self, path: str, name: str, threads: int = 0):
+        import onnxruntime
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            session_options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(path, sess_options=session_options, providers=["CPUExecutionProvider"])
+        self.path = path
+        self.name = name
+        # Graphs exported before feature maps were added only have probabilities
+        self.has_features = ONNX_FEATURES in {output.name for output in self.session.get_outputs()}
+
+    def __call__(self, batch: torch.Tensor) -> np.ndarray:
+        return self.run_with_features(batch, features=False)[0]
+
+    def run_with_features(self, batch: torch.Tensor, features: bool = True):
+        """Same contract as `TorchChexNetRunner.run_with_features`."""
+        inputs = {ONNX_INPUT: batch.detach().cpu().numpy().astype(np.float32, copy=False)}
+        if features and self.has_features:
+            probabilities, feature_maps = self.session.run([ONNX_OUTPUT, ONNX_FEATURES], inputs)
+            return probabilities, feature_maps
+        return self.session.run([ONNX_OUTPUT], inputs)[0], None
+
+
+class _ChexNetWithFeatures(nn.Module):
+    """Export wrapper: the torchvision DenseNet forward, also returning the final feature map."""
+    def __init__(self, chexnet: nn.Module):
+        super().__init__()
+        self.densenet121 = chexnet.densenet121
+
+    def forward(self, x):
+        features = F.relu(self.densenet121.features(x))
+        pooled = torch.flatten(F.adaptive_avg_pool2d(features, (1, 1)), 1)
+        return self.densenet121.classifier(pooled), features
+
+
+def build_chexnet_runner(model: torch.nn.Module, device, weights_tag: str, threads: int = 0, preprocessor=None):
+    """
+    Builds the ChexNet runner for the configured backend.
+
+    With XRAY_CHEXNET_BACKEND=onnx the model is exported to ONNX once and
+    optionally quantized to int8 (static calibrated on the images in
+    XRAY_CHEXNET_CALIBRATION_DIR, or dynamic). Any failure falls back to
+    eager PyTorch, so a missing onnxruntime never takes the service down.
+
+    Args:
+        model (torch.nn.Module): The loaded ChexNet model, in eval mode.
+        device: The torch device of the model.
+        weights_tag (str): Identifies the weights; exported files are kept per tag.
+        threads (int): ONNX Runtime intra-op threads (0 lets ONNX Runtime decide).
+        preprocessor (XRayPreprocessor): Builds calibration inputs for static quantization.
+
+    Returns:
+        The runner; call it with a batch tensor to get an (N, 14) probability array.
+    """
+    backend = config.XRAY_CHEXNET_BACKEND
+    if backend == "onnx":
+        quantize = config.XRAY_CHEXNET_QUANTIZE
+        if quantize not in QUANTIZE_MODES:
+            print(f"Unknown ChexNet quantization '{quantize}'. Using static.")
+            quantize = "static"
+        try:
+            path, quantize = export_chexnet_onnx(model, device, weights_tag, quantize, preprocessor)
+            return OnnxChexNetRunner(path, chexnet_backend_tag("onnx", quantize), threads)
+        except ImportError as e:
+            print(f"ONNX backend unavailable ({e}). Install 'onnx' and 'onnxruntime'. Falling back to torch.")
+        except Exception as e:
+            print(f"Failed to build the ONNX ChexNet backend ({e}). Falling back to torch.")
+    elif backend != "torch":
+        print(f"Unknown ChexNet backend '{backend}'. Falling back to torch.")
+
+    return TorchChexNetRunner(model, device, channels_last=config.XRAY_CHEXNET_CHANNELS_LAST)
+
+
+def onnx_export_dir(weights_tag: str) -> str:
+    """Directory holding the exported (and quantized) ChexNet graphs for one set of weights."""
+    return os.path.join(config.XRAY_ONNX_DIR, "chexnet", weights_tag)
+
+
+def export_chexnet_onnx(model: torch.nn.Module, device, weights_tag: str, quantize: str = "static", preprocessor=None):
+    """
+    Exports ChexNet to ONNX and applies the requested int8 quantization.
+    This only runs once per weights and mode; later calls reuse the files on
+    disk, so bump the weights tag (or clear the directory) when weights change.
+
+    Returns:
+        tuple: The path of the graph to load and the quantization actually applied
+               (static falls back to fp32, "none", without calibration
+               images; dynamic would be slower than fp32 on DenseNet).
+    """
+    export_dir = onnx_export_dir(weights_tag)
+    os.makedirs(export_dir, exist_ok=True)
+    fp32_path = os.path.join(export_dir, "chexnet.onnx")
+
+    if not os.path.exists(fp32_path):
+        print(f"Exporting ChexNet to ONNX in {export_dir}...")
+        dummy = torch.zeros(1, 3, 224, 224, device=device)
+        with torch.no_grad():
+            torch.onnx.export(
+                _ChexNetWithFeatures(model),
+                dummy,
+                fp32_path,
+                input_names=[ONNX_INPUT],
+                output_names=[ONNX_OUTPUT, ONNX_FEATURES],
+                dynamic_axes={ONNX_INPUT: {0: "batch"}, ONNX_OUTPUT: {0: "batch"}, ONNX_FEATURES: {0: "batch"}},
+                opset_version=17
+            )
+
+    if quantize == "none":
+        return fp32_path, quantize
+
+    if quantize == "static":
+        static_path = os.path.join(export_dir, "chexnet.int8-static.onnx")
+        if os.path.exists(static_path):
+            return static_path, quantize
+        calibration = load_calibration_inputs(preprocessor)
+        if calibration:
+            _quantize_static(fp32_path, static_path, calibration)
+            return static_path, quantize
+        print("No calibration images found in XRAY_CHEXNET_CALIBRATION_DIR. Using the fp32 ONNX model.")
+        return fp32_path, "none"
+
+    dynamic_path = os.path.join(export_dir, "chexnet.int8-dynamic.onnx")
+    if not os.path.exists(dynamic_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        print("Quantizing ChexNet to int8 (dynamic)...")
+        quantize_dynamic(fp32_path, dynamic_path, weight_type=QuantType.QInt8)
+    return dynamic_path, quantize
+
+
+def load_calibration_inputs(preprocessor=None) -> list:
+    """Preprocesses up to XRAY_CHEXNET_CALIBRATION_IMAGES sample images into ChexNet inputs."""
+    directory = config.XRAY_CHEXNET_CALIBRATION_DIR
+    if not directory or not os.path.isdir(directory):
+        return []
+    if preprocessor is None:
+        from preprocessing import XRayPreprocessor
+        preprocessor = XRayPreprocessor()
+
+    paths = sorted(path for pattern in CALIBRATION_PATTERNS for path in glob.glob(os.path.join(directory, pattern)))
+    inputs = []
+    for path in paths[:config.XRAY_CHEXNET_CALIBRATION_IMAGES]:
+        try:
+            with open(path, "rb") as f:
+                prepared = preprocessor.prepare_bytes(f.read(), ("chexnet",))
+            inputs.append(prepared.chexnet.unsqueeze(0).numpy())
+        except Exception as e:
+            print(f"Skipping calibration image {path}: {e}")
+    return inputs
+
+
+def _quantize_static(fp32_path: str, output_path: str, calibration: list):
+    """Static int8 quantization (QDQ, per-channel weights) calibrated on sample inputs."""
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    class _Reader(CalibrationDataReader):
+        def __init__(self, batches):
+            self._batches = iter(batches)
+
+        def get_next(self):
+            batch = next(self._batches, None)
+            return None if batch is None else {ONNX_INPUT: batch}
+
+    print(f"Quantizing ChexNet to int8 (static, {len(calibration)} calibration images)...")
+    quantize_static(
+        fp32_path,
+        output_path,
+        _Reader(calibration),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8
+    )
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Parity and throughput check for the ChexNet backends.
+
+Runs the same images through eager fp32 PyTorch (the reference) and each
+requested backend, compares the 14 pathology probabilities (max absolute
+difference and agreement of the 0.5 detection threshold), then reports
+throughput at several batch sizes.
+
+Usage:
+    python benchmark_chexnet.py [--images-dir samples/] [--backends torch-cl,onnx-none,onnx-dynamic,onnx-static]
+                                [--batch-sizes 1,8] [--runs 10]
+
+Static quantization is calibrated on XRAY_CHEXNET_CALIBRATION_DIR, which
+defaults to --images-dir here.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import torch
+
+import config
+import backends
+from preprocessing import XRayPreprocessor
+from xray_model import ChexNet, CHEXNET_WEIGHTS
+
+
+def load_inputs(images_dir: str, count: int, preprocessor: XRayPreprocessor) -> torch.Tensor:
+    """Preprocessed ChexNet inputs from a directory, or random ones if none is given."""
+    inputs = []
+    if images_dir:
+        config.XRAY_CHEXNET_CALIBRATION_DIR = config.XRAY_CHEXNET_CALIBRATION_DIR or images_dir
+        config.XRAY_CHEXNET_CALIBRATION_IMAGES = count
+        inputs = [torch.from_numpy(batch[0]) for batch in backends.load_calibration_inputs(preprocessor)]
+    if not inputs:
+        print("No sample images given; using random inputs (parity on real X-rays is more meaningful).")
+        inputs = list(torch.randn(count, 3, 224, 224))
+    return torch.stack(inputs)
+
+
+def build_runner(name: str, model: torch.nn.Module, device, threads: int, preprocessor: XRayPreprocessor):
+    """Builds a runner from a name like "torch", "torch-cl" or "onnx-dynamic"."""
+    if name in ("torch", "torch-cl"):
+        return backends.TorchChexNetRunner(model, device, channels_last=(name == "torch-cl"))
+    quantize = name.split("-", 1)[1]
+    path, quantize = backends.export_chexnet_onnx(model, device, CHEXNET_WEIGHTS, quantize, preprocessor)
+    return backends.OnnxChexNetRunner(path, backends.chexnet_backend_tag("onnx", quantize), threads)
+
+
+def throughput(runner, inputs: torch.Tensor, batch_size: int, runs: int) -> float:
+    """Images per second over `runs` batches of `batch_size`."""
+    batch = inputs[:batch_size]
+    if len(batch) < batch_size:
+        batch = batch.repeat((batch_size + len(batch) - 1) // len(batch), 1, 1, 1)[:batch_size]
+    runner(batch)
+    started = time.perf_counter()
+    for _ in range(runs):
+        runner(batch)
+    return batch_size * runs / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images-dir", help="Directory of sample X-rays (also used for static calibration)")
+    parser.add_argument("--count", type=int, default=32, help="Number of images to compare")
+    parser.add_argument("--backends", default="torch-cl,onnx-none,onnx-dynamic,onnx-static", help="Comma-separated backends to test")
+    parser.add_argument("--batch-sizes", default="1,8", help="Comma-separated batch sizes for the throughput test")
+    parser.add_argument("--runs", type=int, default=10, help="Timed batches per backend and batch size")
+    parser.add_argument("--threads", type=int, default=0, help="Intra-op threads (0 = library default)")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    # Export into a scratch directory: graphs left over from another run
+    # would hold different classifier weights than this run's reference
+    export_root = tempfile.TemporaryDirectory(prefix="chexnet-onnx-")
+    config.XRAY_ONNX_DIR = export_root.name
+    device = torch.device("cpu")
+    preprocessor = XRayPreprocessor()
+    inputs = load_inputs(args.images_dir, args.count, preprocessor)
+
+    # Eager fp32 reference. Each backend gets its own copy because
+    # channels-last conversion changes the module in place.
+    reference_model = ChexNet().eval()
+    reference = backends.TorchChexNetRunner(reference_model, device, channels_last=False)
+    expected = reference(inputs)
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+
+    rows = [("torch (reference)", 0.0, 1.0, {size: throughput(reference, inputs, size, args.runs) for size in batch_sizes})]
+    for name in args.backends.split(","):
+        name = name.strip()
+        model = ChexNet().eval()
+        model.load_state_dict(reference_model.state_dict())
+        try:
+            runner = build_runner(name, model, device, args.threads, preprocessor)
+        except Exception as e:
+            print(f"Skipping {name}: {e}")
+            continue
+        actual = runner(inputs)
+        max_diff = float(abs(actual - expected).max())
+        agreement = float(((actual > 0.5) == (expected > 0.5)).mean())
+        rows.append((runner.name if name != "torch-cl" else "torch (channels-last)", max_diff, agreement,
+                     {size: throughput(runner, inputs, size, args.runs) for size in batch_sizes}))
+
+    header = f"{'backend':<24}{'max |dp|':>10}{'agree':>8}" + "".join(f"{f'bs={size} img/s':>14}" for size in batch_sizes)
+    print(header)
+    print("-" * len(header))
+    for name, max_diff, agreement, speeds in rows:
+        print(f"{name:<24}{max_diff:>10.4f}{agreement:>8.1%}" + "".join(f"{speeds[size]:>14.1f}" for size in batch_sizes))
+    for name in ("chexnet.onnx", "chexnet.int8-dynamic.onnx", "chexnet.int8-static.onnx"):
+        path = os.path.join(backends.onnx_export_dir(CHEXNET_WEIGHTS), name)
+        if os.path.exists(path):
+            print(f"{name}: {os.path.getsize(path) / 1e6:.1f} MB")
+    export_root.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of per-request X-ray preprocessing.
+
+Compares the previous path (decode, build a ChexNet `transforms.Compose`
+per call, convert to RGB, then run the BiomedCLIP preprocess on the same
+image again) with the shared `XRayPreprocessor` (one grayscale-aware decode
+producing both model inputs), decoding at full and at reduced resolution.
+Full decoding must produce the same tensors as the previous path; reduced
+decoding is expected to differ slightly (resampling from fewer pixels), so
+its difference is reported for review. No model weights are loaded.
+
+Usage:
+    python benchmark_preprocess.py [--image chest.png] [--format png|jpeg] [--runs 50]
+"""
+
+import argparse
+import io
+import statistics
+import time
+
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+
+from preprocessing import XRayPreprocessor, CLIP_SIZE, CLIP_MEAN, CLIP_STD
+
+
+def build_clip_preprocess() -> transforms.Compose:
+    """The BiomedCLIP eval transform as built by open_clip."""
+    return transforms.Compose([
+        transforms.Resize(CLIP_SIZE, interpolation=transforms.InterpolationMode.BICUBIC),
+        transforms.CenterCrop(CLIP_SIZE),
+        lambda image: image.convert("RGB"),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=CLIP_MEAN, std=CLIP_STD),
+    ])
+
+
+def legacy_preprocess(data: bytes, clip_preprocess):
+    """The per-request preprocessing as it was done before the shared stage."""
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    transform = transforms.Compose([
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+    ])
+    chexnet = transform(image.convert("RGB"))
+    clip = clip_preprocess(image)
+    return chexnet, clip
+
+
+def synthetic_xray(width: int, height: int, image_format: str = "PNG") -> bytes:
+    """A grayscale image with some structure, sized like a typical chest X-ray, encoded as `image_format` (PNG or JPEG)."""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = 128 + 60 * np.sin(x / 37.0) * np.cos(y / 53.0) + rng.normal(0, 12, (height, width))
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), mode="L")
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def time_runs(fn, runs: int) -> list:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", help="Image file to preprocess (defaults to a synthetic 2048x2500 grayscale X-ray)")
+    parser.add_argument("--format", default="png", choices=("png", "jpeg"), help="Encoding of the synthetic X-ray")
+    parser.add_argument("--runs", type=int, default=50, help="Timed runs per path")
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            data = f.read()
+    else:
+        data = synthetic_xray(2048, 2500, args.format.upper())
+
+    clip_preprocess = build_clip_preprocess()
+    full = XRayPreprocessor(clip_preprocess, fast_decode=False)
+    fast = XRayPreprocessor(clip_preprocess, fast_decode=True)
+
+    # Parity with the previous path
+    legacy_chexnet, legacy_clip = legacy_preprocess(data, clip_preprocess)
+    for name, preprocessor in (("full", full), ("fast", fast)):
+        prepared = preprocessor.prepare_bytes(data)
+        chexnet_diff = (legacy_chexnet - prepared.chexnet).abs().max().item()
+        clip_diff = (legacy_clip - prepared.clip).abs().max().item()
+        chexnet_mean_diff = (legacy_chexnet - prepared.chexnet).abs().mean().item()
+        print(f"{name:>7} decode: max abs difference chexnet={chexnet_diff:.2e} clip={clip_diff:.2e}, mean chexnet={chexnet_mean_diff:.2e}")
+        if preprocessor is full and not (torch.allclose(legacy_chexnet, prepared.chexnet, atol=1e-5) and torch.allclose(legacy_clip, prepared.clip, atol=1e-5)):
+            print("WARNING: preprocessing outputs differ")
+
+    # Warm up all paths, then time them
+    paths = {
+        "legacy": lambda: legacy_preprocess(data, clip_preprocess),
+        "full": lambda: full.prepare_bytes(data),
+        "fast": lambda: fast.prepare_bytes(data),
+    }
+    for fn in paths.values():
+        fn()
+    timings = {name: time_runs(fn, args.runs) for name, fn in paths.items()}
+
+    for name, runs in timings.items():
+        print(f"{name:>7}: median {statistics.median(runs):.2f} ms, p95 {sorted(runs)[int(0.95 * (len(runs) - 1))]:.2f} ms")
+    for name in ("full", "fast"):
+        print(f"Speedup ({name}): {statistics.median(timings['legacy']) / statistics.median(timings[name]):.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# xray-analysis-service/config.py
+
+import os
+from dotenv import load_dotenv
+
+# Load environment variables from a .env file next to the service.
+# For example, create a .env file with: GEMINI_API_KEY="your_key_here"
+load_dotenv()
+
+# --- Admission Control Settings ---
+# Model execution (/analyze, /compare) is bounded to XRAY_MAX_INFLIGHT
+# concurrent requests with XRAY_MAX_QUEUE more waiting; beyond that
+# requests get 429 with a Retry-After estimated from the measured
+# service time. Q&A calls to Gemini have their own, separate bound.
+XRAY_MAX_INFLIGHT = int(os.getenv("XRAY_MAX_INFLIGHT", "4"))
+XRAY_MAX_QUEUE = int(os.getenv("XRAY_MAX_QUEUE", "16"))
+XRAY_QNA_MAX_INFLIGHT = int(os.getenv("XRAY_QNA_MAX_INFLIGHT", "8"))
+XRAY_QNA_MAX_QUEUE = int(os.getenv("XRAY_QNA_MAX_QUEUE", "32"))
+
+# --- Dynamic Batching Settings ---
+# Concurrent images are collected for up to XRAY_MAX_BATCH_WAIT_MS (or until
+# XRAY_MAX_BATCH_SIZE images are waiting) and run through ChexNet and
+# BiomedCLIP as one batched forward pass per model.
+XRAY_MAX_BATCH_SIZE = int(os.getenv("XRAY_MAX_BATCH_SIZE", "8"))
+XRAY_MAX_BATCH_WAIT_MS = float(os.getenv("XRAY_MAX_BATCH_WAIT_MS", "20"))
+# Maximum number of images accepted by one /analyze_batch request
+XRAY_MAX_IMAGES_PER_REQUEST = int(os.getenv("XRAY_MAX_IMAGES_PER_REQUEST", "32"))
+
+# --- BiomedCLIP Zero-Shot Settings ---
+# Comma-separated candidate labels for the findings report, and one or more
+# prompt templates separated by "|". With several templates the label
+# embedding is the normalized mean over templates (prompt ensembling).
+XRAY_CLIP_LABELS = [
+    label.strip()
+    for label in os.getenv("XRAY_CLIP_LABELS", "normal,fracture,pneumonia,cardiomegaly,pleural effusion,nodule,opacity").split(",")
+    if label.strip()
+]
+XRAY_CLIP_TEMPLATES = [
+    template
+    for template in os.getenv("XRAY_CLIP_TEMPLATES", "this is a photo of ").split("|")
+    if template.strip()
+]
+
+# --- Executor and Thread Budget Settings ---
+# The ChexNet and BiomedCLIP batches run concurrently on their own threads.
+# XRAY_TORCH_THREADS caps torch's intra-op pool so the two heads share the
+# cores instead of oversubscribing them (0 = half of the available cores).
+XRAY_TORCH_THREADS = int(os.getenv("XRAY_TORCH_THREADS", "0"))
+# Threads decoding and preprocessing uploads
+XRAY_PREPROCESS_WORKERS = int(os.getenv("XRAY_PREPROCESS_WORKERS", "2"))
+# Threads waiting on Gemini (/compare and /qna); these are network-bound
+XRAY_GEMINI_WORKERS = int(os.getenv("XRAY_GEMINI_WORKERS", "8"))
+
+# --- Analysis Cache Settings ---
+# Analyses (BiomedCLIP image embedding, ChexNet probabilities, report) are
+# stored by decoded-pixel hash plus model version. The in-memory tier holds
+# XRAY_CACHE_MEMORY_ITEMS entries; the SQLite tier persists across restarts
+# and keeps the XRAY_CACHE_DISK_MAX_ITEMS most recently used entries.
+XRAY_CACHE_ENABLED = os.getenv("XRAY_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+XRAY_CACHE_MEMORY_ITEMS = int(os.getenv("XRAY_CACHE_MEMORY_ITEMS", "256"))
+XRAY_CACHE_PATH = os.getenv("XRAY_CACHE_PATH", "./xray_cache.sqlite3")
+XRAY_CACHE_DISK_MAX_ITEMS = int(os.getenv("XRAY_CACHE_DISK_MAX_ITEMS", "20000"))
+
+# --- Model Head Settings ---
+# Heads loaded at startup (comma-separated: chexnet, biomed_clip, gemini);
+# the others load on first use. A pathology-only replica can set
+# XRAY_EAGER_HEADS=chexnet and never load BiomedCLIP or the Gemini client.
+XRAY_EAGER_HEADS = [
+    head.strip()
+    for head in os.getenv("XRAY_EAGER_HEADS", "chexnet,biomed_clip,gemini").split(",")
+    if head.strip()
+]
+
+# --- ChexNet Backend Settings ---
+# "torch" runs eager PyTorch (channels-last by default). "onnx" exports
+# ChexNet to ONNX under XRAY_ONNX_DIR and runs it through ONNX Runtime,
+# quantized to int8 per XRAY_CHEXNET_QUANTIZE: "static" (calibrated on up
+# to XRAY_CHEXNET_CALIBRATION_IMAGES images from XRAY_CHEXNET_CALIBRATION_DIR),
+# "dynamic" or "none". Static is the default because DenseNet is almost all
+# convolutions: dynamic quantization turns them into ConvInteger ops, which
+# ONNX Runtime runs slower than fp32 on CPU. Without calibration images,
+# static falls back to fp32 ("none"). Falls back to torch if anything fails.
+XRAY_CHEXNET_BACKEND = os.getenv("XRAY_CHEXNET_BACKEND", "torch").lower()
+XRAY_CHEXNET_QUANTIZE = os.getenv("XRAY_CHEXNET_QUANTIZE", "static").lower()
+XRAY_CHEXNET_CALIBRATION_DIR = os.getenv("XRAY_CHEXNET_CALIBRATION_DIR", "")
+XRAY_CHEXNET_CALIBRATION_IMAGES = int(os.getenv("XRAY_CHEXNET_CALIBRATION_IMAGES", "64"))
+XRAY_CHEXNET_CHANNELS_LAST = os.getenv("XRAY_CHEXNET_CHANNELS_LAST", "true").lower() in ("1", "true", "yes")
+XRAY_ONNX_DIR = os.getenv("XRAY_ONNX_DIR", "./onnx_models")
+
+# --- Segmentation Map Settings ---
+# Class activation maps are captured for every ChexNet forward pass and
+# kept (unrendered) for the XRAY_SEGMENTATION_STORE_ITEMS most recent
+# analyses, so PNG overlays can be requested with include=segmentation or
+# fetched later from GET /segmentation/{analysis_id}. Each analysis takes
+# about 53 KB (mostly its 224x224 thumbnail).
+XRAY_SEGMENTATION_STORE_ITEMS = int(os.getenv("XRAY_SEGMENTATION_STORE_ITEMS", "512"))
+
+# --- Upload Decoding Settings ---
+# Uploads are decoded at reduced resolution (JPEG draft mode, integer
+# downscaling, windowing of 16-bit and DICOM pixels), since both models
+# only need 224x224. Larger uploads are rejected with 413: by byte size
+# before they are read, and by pixel count from the image header before
+# they are decoded. XRAY_MAX_REQUEST_MB caps a whole multipart request.
+XRAY_FAST_DECODE = os.getenv("XRAY_FAST_DECODE", "true").lower() in ("1", "true", "yes")
+XRAY_MAX_UPLOAD_MB = int(os.getenv("XRAY_MAX_UPLOAD_MB", "64"))
+XRAY_MAX_REQUEST_MB = int(os.getenv("XRAY_MAX_REQUEST_MB", "256"))
+XRAY_MAX_PIXELS = int(os.getenv("XRAY_MAX_PIXELS", "50000000"))
@@ -0,0 +1,229 @@
+# xray-analysis-service/decoding.py
+
+import io
+
+import numpy as np
+from PIL import Image
+
+try:
+    import pydicom
+except ImportError:  # pydicom is optional; without it DICOM uploads are rejected
+    pydicom = None
+
+# PIL modes holding more than 8 bits per pixel (16-bit PNG/TIFF, 32-bit int/float)
+HIGH_BIT_DEPTH_MODES = ("I", "I;16", "I;16B", "I;16L", "I;16N", "F")
+# Percentiles used to window high-bit-depth images without a stored window
+WINDOW_PERCENTILES = (0.5, 99.5)
+# DICOM files carry "DICM" after a 128-byte preamble
+DICOM_MAGIC_OFFSET = 128
+DICOM_MAGIC = b"DICM"
+
+
+class ImageTooLarge(ValueError):
+    """Raised when an image exceeds the configured pixel limit. Mapped to HTTP 413."""
+
+
+def check_pixels(width: int, height: int, max_pixels: int):
+    """Rejects an image from its header dimensions, before any pixel is decoded."""
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(f"Image is {width}x{height} pixels; the limit is {max_pixels} pixels.")
+
+
+def reduction_factor(width: int, height: int, min_side: int) -> int:
+    """
+    Largest integer downscale that keeps the shorter side at least twice
+    `min_side`, so the final high-quality resize still has headroom.
+    """
+    return max(1, min(width, height) // (2 * min_side))
+
+
+def box_reduce(pixels: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Downscales a 2-D array by averaging factor x factor blocks.
+
+    Works on a memory-mapped array without materializing it: each block is
+    read once and only the reduced float32 result is allocated.
+    """
+    if factor <= 1:
+        return pixels.astype(np.float32)
+    height, width = (pixels.shape[0] // factor) * factor, (pixels.shape[1] // factor) * factor
+    blocks = pixels[:height, :width].reshape(height // factor, factor, width // factor, factor)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
+def window_to_uint8(pixels: np.ndarray, center: float = None, width: float = None, invert: bool = False) -> np.ndarray:
+    """
+    Maps high-bit-depth pixels to 8 bits with a linear window, vectorized.
+
+    Args:
+        pixels (np.ndarray): 2-D pixel values (any numeric dtype).
+        center, width (float, optional): The window. Defaults to the 0.5-99.5
+            percentile range, which ignores burned-in labels and dead pixels.
+        invert (bool): Invert the result (DICOM MONOCHROME1).
+
+    Returns:
+        np.ndarray: uint8 pixels.
+    """
+    pixels = np.asarray(pixels, dtype=np.float32)
+    if center is None or width is None:
+        # A strided sample is plenty to estimate the percentiles
+        step = max(1, min(pixels.shape) // 512)
+        low, high = np.percentile(pixels[::step, ::step], WINDOW_PERCENTILES)
+    else:
+        low, high = center - width / 2.0, center + width / 2.0
+    if high <= low:
+        high = low + 1.0
+
+    out = (pixels - low) * (255.0 / (high - low))
+    np.clip(out, 0.0, 255.0, out=out)
+    out = out.astype(np.uint8)
+    return 255 - out if invert else out
+
+
+def is_dicom(fileobj) -> bool:
+    position = fileobj.tell()
+    fileobj.seek(DICOM_MAGIC_OFFSET)
+    magic = fileobj.read(len(DICOM_MAGIC))
+    fileobj.seek(position)
+    return magic == DICOM_MAGIC
+
+
+def decode_image(source, min_side: int = 224, max_pixels: int = None, reduce: bool = True) -> Image.Image:
+    """
+    Decodes an upload into an "L" (grayscale) or "RGB" image, at no more
+    resolution than the models need.
+
+    - JPEG is decoded in draft mode (DCT scaling), so a 3000x3000 radiograph
+      is never fully decoded; JPEG 2000 uses its reduce-on-load option.
+    - Other 8-bit images are decoded and then box-reduced by an integer factor.
+    - 16-bit PNG/TIFF are box-reduced and windowed to 8 bits in NumPy.
+    - DICOM (with the optional pydicom) memory-maps uncompressed pixel data.
+
+    The shorter side is kept at least 2 * `min_side` so the models' own
+    resize still antialiases properly. Dimensions are checked against
+    `max_pixels` from the header, before pixels are decoded.
+
+    Args:
+        source: Image bytes or a binary file object (e.g. the upload's spooled file).
+        min_side (int): The largest input size of any model head.
+        max_pixels (int, optional): Pixel limit; larger images raise `ImageTooLarge`.
+        reduce (bool): Decode at reduced resolution. When False, images are
+            decoded at full size (the previous behavior).
+
+    Raises:
+        ImageTooLarge: If the image has more than `max_pixels` pixels.
+        ValueError: If the data is not a readable image.
+    """
+    fileobj = io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source
+    fileobj.seek(0)
+    if is_dicom(fileobj):
+        return decode_dicom(fileobj, min_side, max_pixels, reduce)
+
+    try:
+        image = Image.open(fileobj)
+    except Exception as e:
+        raise ValueError(f"Invalid image file: {e}") from e
+    width, height = image.size
+    check_pixels(width, height, max_pixels)
+    factor = reduction_factor(width, height, min_side) if reduce else 1
+
+    try:
+        if factor > 1 and image.format == "JPEG":
+            # Lets libjpeg decode at 1/2, 1/4 or 1/8 scale directly
+            image.draft(image.mode if image.mode in ("L", "RGB") else None, (2 * min_side, 2 * min_side))
+            factor = reduction_factor(*image.size, min_side)
+        elif factor > 1 and image.format == "JPEG2000":
+            # Resolution levels are halvings; pick the largest one that fits
+            image.reduce = factor.bit_length() - 1
+            factor = 1
+        image.load()
+    except Exception as e:
+        raise ValueError(f"Invalid image file: {e}") from e
+
+    if image.mode in HIGH_BIT_DEPTH_MODES:
+        pixels = np.asarray(image)
+        factor = reduction_factor(pixels.shape[1], pixels.shape[0], min_side) if reduce else 1
+        return Image.fromarray(window_to_uint8(box_reduce(pixels, factor)))
+
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("L" if image.mode in ("1", "LA", "La") else "RGB")
+    factor = reduction_factor(*image.size, min_side) if reduce else 1
+    return image.reduce(factor) if factor > 1 else image
+
+
+def _pixel_buffer(fileobj, dtype: np.dtype, offset: int, count: int) -> np.ndarray:
+    """
+    Maps `count` pixels at `offset` of a file without copying them.
+
+    Real files are memory-mapped; in-memory buffers are viewed directly.
+    """
+    # Starlette spools small uploads in memory and larger ones to disk;
+    # look through the SpooledTemporaryFile to whichever it is
+    inner = getattr(fileobj, "_file", fileobj)
+    if hasattr(inner, "getbuffer"):
+        return np.frombuffer(inner.getbuffer(), dtype=dtype, count=count, offset=offset)
+    return np.memmap(inner, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+
+def decode_dicom(fileobj, min_side: int = 224, max_pixels: int = None, reduce: bool = True) -> Image.Image:
+    """
+    Decodes the first frame of a DICOM file.
+
+    Uncompressed grayscale pixel data is memory-mapped and box-reduced
+    straight from the file; compressed data goes through pydicom's pixel
+    handlers. Rescale slope/intercept, the stored window (if any) and
+    MONOCHROME1 inversion are applied.
+
+    Raises:
+        ImageTooLarge: If the image has more than `max_pixels` pixels.
+        ValueError: If pydicom is missing or the file has no usable pixel data.
+    """
+    if pydicom is None:
+        raise ValueError("DICOM uploads require the optional 'pydicom' package.")
+    try:
+        # Large values (the pixel data) are not read while parsing the header
+        dataset = pydicom.dcmread(fileobj, defer_size="1 KB")
+        rows, columns = int(dataset.Rows), int(dataset.Columns)
+    except Exception as e:
+        raise ValueError(f"Invalid DICOM file: {e}") from e
+    check_pixels(columns, rows, max_pixels)
+
+    samples = int(getattr(dataset, "SamplesPerPixel", 1))
+    bits = int(getattr(dataset, "BitsAllocated", 16))
+    transfer_syntax = dataset.file_meta.TransferSyntaxUID
+    try:
+        if samples == 1 and bits in (8, 16, 32) and not transfer_syntax.is_compressed and "PixelData" in dataset:
+            element = dataset.get_item("PixelData")
+            dtype = np.dtype(f"{'<' if transfer_syntax.is_little_endian else '>'}{'i' if int(getattr(dataset, 'PixelRepresentation', 0)) else 'u'}{bits // 8}")
+            pixels = _pixel_buffer(fileobj, dtype, element.value_tell, rows * columns).reshape(rows, columns)
+        else:
+            pixels = dataset.pixel_array
+            if int(getattr(dataset, "NumberOfFrames", 1) or 1) > 1:
+                pixels = pixels[0]
+    except Exception as e:
+        raise ValueError(f"Could not read DICOM pixel data: {e}") from e
+
+    if pixels.ndim == 3:
+        # Color DICOM (rare for radiographs)
+        return Image.fromarray(np.ascontiguousarray(pixels[..., :3]).astype(np.uint8)).convert("RGB")
+
+    factor = reduction_factor(columns, rows, min_side) if reduce else 1
+    reduced = box_reduce(pixels, factor)
+    slope = float(getattr(dataset, "RescaleSlope", 1) or 1)
+    intercept = float(getattr(dataset, "RescaleIntercept", 0) or 0)
+    if slope != 1 or intercept != 0:
+        reduced = reduced * slope + intercept
+
+    center, width = _first_value(getattr(dataset, "WindowCenter", None)), _first_value(getattr(dataset, "WindowWidth", None))
+    invert = getattr(dataset, "PhotometricInterpretation", "") == "MONOCHROME1"
+    return Image.fromarray(window_to_uint8(reduced, center, width, invert))
+
+
+def _first_value(value):
+    """DICOM window attributes may hold several values; use the first."""
+    if value is None:
+        return None
+    try:
+        return float(value[0]) if hasattr(value, "__len__") and not isinstance(value, str) else float(value)
+    except (TypeError, ValueError, IndexError):
+        return None
@@ -0,0 +1,142 @@
+# xray-analysis-service/preprocessing.py
+
+import hashlib
+from collections import namedtuple
+
+import torch
+import torchvision.transforms as transforms
+import torchvision.transforms.functional as TF
+from PIL import Image
+
+from decoding import decode_image
+
+# ImageNet statistics used by ChexNet (DenseNet121)
+CHEXNET_SIZE = (224, 224)
+CHEXNET_MEAN = (0.485, 0.456, 0.406)
+CHEXNET_STD = (0.229, 0.224, 0.225)
+
+# Defaults for the BiomedCLIP image tower, used when they can't be read
+# from the open_clip preprocess pipeline
+CLIP_SIZE = 224
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+# The model inputs produced from one decoded image, plus a hash of its
+# decoded pixels (the same X-ray re-encoded or re-uploaded hashes the same)
+PreparedImage = namedtuple("PreparedImage", ["chexnet", "clip", "size", "digest"])
+
+
+class XRayPreprocessor:
+    """
+    Decodes an upload once and produces the input tensor of every model head.
+
+    X-rays are almost always single-channel, so grayscale images stay in
+    "L" mode through resizing and cropping (a third of the work of RGB) and
+    are only expanded to three channels by broadcasting during
+    normalization. Color images take the same path with three channels.
+    The results match `convert("RGB")` followed by each model's own
+    transforms, but no RGB copy of the full-size image is ever made.
+
+    Uploads are decoded at reduced resolution (see `decoding.decode_image`):
+    the shorter side is kept at least twice the largest model input, so
+    the final resize sees the same detail at a fraction of the decode cost.
+    """
+    def __init__(self, clip_preprocess=None, max_pixels: int = None, fast_decode: bool = True):
+        """
+        Args:
+            clip_preprocess (transforms.Compose, optional): The open_clip preprocess
+                pipeline. Its resize, crop and normalization settings are reused
+                so the CLIP input matches what the model was trained on.
+            max_pixels (int, optional): Images with more pixels are rejected
+                from their header with `ImageTooLarge`.
+            fast_decode (bool): Decode at reduced resolution. When False,
+                images are decoded at full size.
+        """
+        self.max_pixels = max_pixels
+        self.fast_decode = fast_decode
+        self.chexnet_mean = torch.tensor(CHEXNET_MEAN).view(3, 1, 1)
+        self.chexnet_std = torch.tensor(CHEXNET_STD).view(3, 1, 1)
+
+        self.clip_resize = CLIP_SIZE
+        self.clip_crop = (CLIP_SIZE, CLIP_SIZE)
+        self.clip_interpolation = transforms.InterpolationMode.BICUBIC
+        clip_mean, clip_std = CLIP_MEAN, CLIP_STD
+        for step in getattr(clip_preprocess, "transforms", []):
+            if isinstance(step, transforms.Resize):
+                self.clip_resize = step.size
+                self.clip_interpolation = step.interpolation
+            elif isinstance(step, transforms.CenterCrop):
+                self.clip_crop = tuple(step.size)
+            elif isinstance(step, transforms.Normalize):
+                clip_mean, clip_std = step.mean, step.std
+        self.clip_mean = torch.tensor(clip_mean).view(3, 1, 1)
+        self.clip_std = torch.tensor(clip_std).view(3, 1, 1)
+
+        # The largest input side of any head bounds how far decoding may reduce
+        clip_resize = self.clip_resize if isinstance(self.clip_resize, (list, tuple)) else [self.clip_resize]
+        self.min_side = max(*CHEXNET_SIZE, *self.clip_crop, *clip_resize)
+
+    def decode(self, source) -> Image.Image:
+        """
+        Decodes image bytes or a file object into an "L" (grayscale) or "RGB" image.
+
+        Raises:
+            ImageTooLarge: If the image has more than `max_pixels` pixels.
+            ValueError: If the data is not a readable image.
+        """
+        image = decode_image(source, self.min_side, self.max_pixels, reduce=self.fast_decode)
+        return self.normalize_mode(image)
+
+    @staticmethod
+    def normalize_mode(image: Image.Image) -> Image.Image:
+        """Converts an image to "L" if it is grayscale and to "RGB" otherwise."""
+        if image.mode in ("L", "RGB"):
+            return image
+        if image.mode in ("1", "I", "I;16", "I;16B", "I;16L", "F", "LA", "La"):
+            return image.convert("L")
+        return image.convert("RGB")
+
+    def _normalize(self, image: Image.Image, mean: torch.Tensor, std: torch.Tensor) -> torch.Tensor:
+        """Scales to [0, 1] and normalizes; a 1-channel input broadcasts to 3 channels."""
+        return (TF.to_tensor(image) - mean) / std
+
+    def chexnet_input(self, image: Image.Image) -> torch.Tensor:
+        """Builds the 3x224x224 ChexNet input (squash resize, ImageNet normalization)."""
+        resized = TF.resize(image, list(CHEXNET_SIZE), interpolation=transforms.InterpolationMode.BILINEAR)
+        return self._normalize(resized, self.chexnet_mean, self.chexnet_std)
+
+    def clip_input(self, image: Image.Image) -> torch.Tensor:
+        """Builds the BiomedCLIP input (shorter-side resize, center crop, CLIP normalization)."""
+        resized = TF.resize(image, self.clip_resize, interpolation=self.clip_interpolation)
+        cropped = TF.center_crop(resized, list(self.clip_crop))
+        return self._normalize(cropped, self.clip_mean, self.clip_std)
+
+    @staticmethod
+    def pixel_digest(image: Image.Image) -> str:
+        """SHA-256 of the image mode, size and decoded pixels."""
+        digest = hashlib.sha256()
+        digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}".encode("ascii"))
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+
+    def prepare(self, image: Image.Image, heads=None) -> PreparedImage:
+        """
+        Produces the model inputs from one decoded image.
+
+        Args:
+            image (Image.Image): The decoded image.
+            heads (iterable, optional): "chexnet" and/or "biomed_clip". Inputs
+                of other heads are left as None. Defaults to both.
+        """
+        heads = ("chexnet", "biomed_clip") if heads is None else heads
+        image = self.normalize_mode(image)
+        return PreparedImage(
+            self.chexnet_input(image) if "chexnet" in heads else None,
+            self.clip_input(image) if "biomed_clip" in heads else None,
+            image.size,
+            self.pixel_digest(image)
+        )
+
+    def prepare_bytes(self, data, heads=None) -> PreparedImage:
+        """Decodes image bytes or a file object and produces the model inputs (see `prepare`)."""
+        return self.prepare(self.decode(data), heads)
@@ -0,0 +1,152 @@
+# xray-analysis-service/segmentation.py
+
+import base64
+import io
+import threading
+from collections import OrderedDict, namedtuple
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from preprocessing import CHEXNET_MEAN, CHEXNET_STD
+
+# Everything needed to render the heatmaps of one analysis later: a small
+# grayscale copy of the image, the class activation maps of all ChexNet
+# labels at feature-map resolution (e.g. 14x7x7), and the probabilities.
+StoredMaps = namedtuple("StoredMaps", ["thumbnail", "cams", "labels", "probabilities"])
+
+# Keypoints of the "jet" colormap (position, R, G, B)
+_JET = np.array([
+    [0.00, 0.0, 0.0, 0.5],
+    [0.11, 0.0, 0.0, 1.0],
+    [0.34, 0.0, 1.0, 1.0],
+    [0.50, 0.5, 1.0, 0.5],
+    [0.66, 1.0, 1.0, 0.0],
+    [0.89, 1.0, 0.0, 0.0],
+    [1.00, 0.5, 0.0, 0.0],
+])
+
+
+def jet_colormap(values: np.ndarray) -> np.ndarray:
+    """Maps values in [0, 1] to RGB uint8 with the jet colormap, vectorized."""
+    values = np.clip(values, 0.0, 1.0)
+    channels = [np.interp(values, _JET[:, 0], _JET[:, c]) for c in (1, 2, 3)]
+    return (np.stack(channels, axis=-1) * 255.0).astype(np.uint8)
+
+
+def thumbnail_from_input(chexnet_input) -> np.ndarray:
+    """Recovers the 224x224 grayscale image from a normalized ChexNet input tensor."""
+    channel = chexnet_input[0].detach().cpu().numpy()
+    return np.clip((channel * CHEXNET_STD[0] + CHEXNET_MEAN[0]) * 255.0, 0, 255).astype(np.uint8)
+
+
+def render_overlay(thumbnail: np.ndarray, cam: np.ndarray, alpha: float = 0.45) -> bytes:
+    """
+    Renders a class activation map over the image as a PNG.
+
+    The map is upsampled to the image size, scaled to [0, 1], colored with
+    jet and alpha-blended over the grayscale image. Weak activations stay
+    transparent so the anatomy remains readable.
+
+    Returns:
+        bytes: The PNG file.
+    """
+    height, width = thumbnail.shape
+    heat = np.asarray(Image.fromarray(cam.astype(np.float32)).resize((width, height), Image.BILINEAR))
+    heat = heat - heat.min()
+    peak = heat.max()
+    heat = heat / peak if peak > 0 else heat
+
+    base = np.repeat(thumbnail[..., None].astype(np.float32), 3, axis=-1)
+    weight = (alpha * heat)[..., None]
+    blended = base * (1.0 - weight) + jet_colormap(heat).astype(np.float32) * weight
+
+    buffer = io.BytesIO()
+    Image.fromarray(blended.astype(np.uint8)).save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+class SegmentationStore:
+    """
+    Bounded in-memory store of class activation maps by analysis id.
+
+    Maps are captured during the regular ChexNet forward pass and kept
+    unrendered, so /analyze stays fast and its response small. Each entry
+    is about 53 KB, almost all of it the 224x224 uint8 thumbnail (the maps
+    themselves are about 3 KB), so the default 512 entries take about
+    27 MB. PNG overlays are only rendered when a caller asks for them.
+    The least recently stored analyses are evicted first.
+    """
+    def __init__(self, capacity: int = 512):
+        """
+        Args:
+            capacity (int): Maximum number of analyses kept.
+        """
+        self.capacity = max(1, capacity)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, analysis_id: str, maps: StoredMaps):
+        with self._lock:
+            self._entries[analysis_id] = maps
+            self._entries.move_to_end(analysis_id)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def get(self, analysis_id: str) -> Optional[StoredMaps]:
+        with self._lock:
+            return self._entries.get(analysis_id)
+
+    @staticmethod
+    def select(maps: StoredMaps, pathology: str = None, threshold: float = 0.5) -> Optional[np.ndarray]:
+        """
+        Picks the map to render.
+
+        Args:
+            maps (StoredMaps): The stored maps of an analysis.
+            pathology (str, optional): A ChexNet label. Defaults to the
+                element-wise maximum over all detected pathologies.
+
+        Returns:
+            np.ndarray: The map, or None if nothing was detected.
+
+        Raises:
+            KeyError: If the pathology is not a ChexNet label.
+        """
+        if pathology is not None:
+            if pathology not in maps.labels:
+                raise KeyError(f"Unknown pathology '{pathology}'.")
+            return maps.cams[maps.labels.index(pathology)]
+        detected = [i for i, probability in enumerate(maps.probabilities) if probability > threshold]
+        if not detected:
+            return None
+        cams = maps.cams[detected]
+        # Scale each map to [0, 1] first so one strong class doesn't hide the others
+        cams = cams - cams.min(axis=(1, 2), keepdims=True)
+        peaks = cams.max(axis=(1, 2), keepdims=True)
+        return (cams / np.where(peaks > 0, peaks, 1.0)).max(axis=0)
+
+    def render(self, analysis_id: str, pathology: str = None) -> Optional[bytes]:
+        """
+        Renders the PNG overlay of an analysis.
+
+        Returns:
+            bytes: The PNG, or None if the analysis is unknown or has no detections.
+
+        Raises:
+            KeyError: If the pathology is not a ChexNet label.
+        """
+        maps = self.get(analysis_id)
+        if maps is None:
+            return None
+        cam = self.select(maps, pathology)
+        return render_overlay(maps.thumbnail, cam) if cam is not None else None
+
+    def render_base64(self, analysis_id: str, pathology: str = None) -> Optional[str]:
+        png = self.render(analysis_id, pathology)
+        return base64.b64encode(png).decode("ascii") if png is not None else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "capacity": self.capacity}
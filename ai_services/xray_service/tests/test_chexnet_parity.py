@@ -0,0 +1,110 @@
+# xray-analysis-service/tests/test_chexnet_parity.py
+
+import io
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+import numpy as np
+import torch
+from PIL import Image
+
+import backends
+import config
+from preprocessing import XRayPreprocessor
+from xray_model import ChexNet, CHEXNET_WEIGHTS
+
+# Allowed difference of the 14 probabilities from eager fp32 PyTorch:
+# the fp32 graph should be numerically identical, int8 only close
+FP32_TOLERANCE = 1e-4
+INT8_MAX_TOLERANCE = 0.1
+INT8_MEAN_TOLERANCE = 0.02
+CALIBRATION_IMAGES = 16
+
+
+def synthetic_xrays(count: int, seed: int) -> list:
+    """Grayscale images with varied structure, encoded as PNG."""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        y, x = np.mgrid[0:512, 0:512]
+        fx, fy = rng.uniform(10, 80, size=2)
+        pixels = 110 + 70 * np.sin(x / fx) * np.cos(y / fy) + rng.normal(0, 15, (512, 512))
+        buffer = io.BytesIO()
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), mode="L").save(buffer, format="PNG")
+        images.append(buffer.getvalue())
+    return images
+
+
+@pytest.fixture(scope="module")
+def setup(tmp_path_factory):
+    """The reference model, evaluation inputs, and config pointing at scratch directories."""
+    torch.manual_seed(0)
+    try:
+        reference_model = ChexNet().eval()
+    except Exception as e:
+        pytest.skip(f"DenseNet121 weights are not available: {e}")
+
+    calibration_dir = tmp_path_factory.mktemp("calibration")
+    for index, data in enumerate(synthetic_xrays(CALIBRATION_IMAGES, seed=1)):
+        (calibration_dir / f"{index}.png").write_bytes(data)
+
+    preprocessor = XRayPreprocessor()
+    inputs = torch.stack([preprocessor.prepare_bytes(data, ("chexnet",)).chexnet for data in synthetic_xrays(8, seed=2)])
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(config, "XRAY_ONNX_DIR", str(tmp_path_factory.mktemp("onnx")))
+        patch.setattr(config, "XRAY_CHEXNET_CALIBRATION_DIR", str(calibration_dir))
+        patch.setattr(config, "XRAY_CHEXNET_CALIBRATION_IMAGES", CALIBRATION_IMAGES)
+        expected = backends.TorchChexNetRunner(reference_model, torch.device("cpu"), channels_last=False)(inputs)
+        yield reference_model, preprocessor, inputs, expected
+
+
+def onnx_runner(reference_model, preprocessor, quantize: str):
+    path, applied = backends.export_chexnet_onnx(reference_model, torch.device("cpu"), CHEXNET_WEIGHTS, quantize, preprocessor)
+    return backends.OnnxChexNetRunner(path, backends.chexnet_backend_tag("onnx", applied), threads=1)
+
+
+def test_fp32_onnx_matches_torch(setup):
+    reference_model, preprocessor, inputs, expected = setup
+    runner = onnx_runner(reference_model, preprocessor, "none")
+
+    assert np.abs(runner(inputs) - expected).max() < FP32_TOLERANCE
+
+
+@pytest.mark.parametrize("quantize", ["static", "dynamic"])
+def test_int8_onnx_stays_close_to_torch(setup, quantize):
+    reference_model, preprocessor, inputs, expected = setup
+    runner = onnx_runner(reference_model, preprocessor, quantize)
+
+    assert runner.name == f"onnx-{quantize}"
+    diff = np.abs(runner(inputs) - expected)
+    assert diff.max() < INT8_MAX_TOLERANCE
+    assert diff.mean() < INT8_MEAN_TOLERANCE
+
+
+def test_feature_maps_match_torch(setup):
+    reference_model, preprocessor, inputs, _ = setup
+    torch_runner = backends.TorchChexNetRunner(reference_model, torch.device("cpu"), channels_last=False)
+    runner = onnx_runner(reference_model, preprocessor, "none")
+
+    _, expected_features = torch_runner.run_with_features(inputs)
+    _, features = runner.run_with_features(inputs)
+
+    assert features.shape == expected_features.shape
+    assert np.abs(features - expected_features).max() < 1e-3
+
+
+def test_static_without_calibration_images_uses_fp32(setup, tmp_path, monkeypatch):
+    reference_model, preprocessor, _, _ = setup
+    monkeypatch.setattr(config, "XRAY_ONNX_DIR", str(tmp_path / "onnx"))
+    monkeypatch.setattr(config, "XRAY_CHEXNET_CALIBRATION_DIR", str(tmp_path / "missing"))
+
+    path, applied = backends.export_chexnet_onnx(reference_model, torch.device("cpu"), CHEXNET_WEIGHTS, "static", preprocessor)
+
+    assert applied == "none"
+    assert path.endswith("chexnet.onnx")
@@ -0,0 +1,67 @@
+# xray-analysis-service/tests/test_preprocessing_parity.py
+
+import io
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+
+import torch
+from PIL import Image
+
+from benchmark_preprocess import build_clip_preprocess, legacy_preprocess, synthetic_xray
+from preprocessing import XRayPreprocessor
+
+# Full decoding must reproduce the previous per-head transforms
+EXACT_TOLERANCE = 1e-5
+# Reduced decoding resamples from fewer pixels; allowed mean absolute
+# difference of the normalized inputs (they span roughly -2 to 2.6)
+FAST_DECODE_MEAN_TOLERANCE = 0.05
+
+
+def rgb_png(width: int, height: int) -> bytes:
+    """A synthetic X-ray saved as RGB, as some exporters do."""
+    image = Image.open(io.BytesIO(synthetic_xray(width, height))).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+UPLOADS = {
+    "grayscale-png": lambda: synthetic_xray(2048, 2500, "PNG"),
+    "grayscale-jpeg": lambda: synthetic_xray(1800, 2200, "JPEG"),
+    "rgb-png": lambda: rgb_png(1024, 1280),
+    "small-grayscale-png": lambda: synthetic_xray(200, 180, "PNG"),
+}
+
+
+@pytest.fixture(scope="module")
+def clip_preprocess():
+    return build_clip_preprocess()
+
+
+@pytest.mark.parametrize("upload", UPLOADS)
+def test_full_decode_matches_the_per_head_path(upload, clip_preprocess):
+    data = UPLOADS[upload]()
+    legacy_chexnet, legacy_clip = legacy_preprocess(data, clip_preprocess)
+
+    prepared = XRayPreprocessor(clip_preprocess, fast_decode=False).prepare_bytes(data)
+
+    assert prepared.chexnet.shape == legacy_chexnet.shape == (3, 224, 224)
+    assert prepared.clip.shape == legacy_clip.shape
+    assert torch.allclose(prepared.chexnet, legacy_chexnet, atol=EXACT_TOLERANCE)
+    assert torch.allclose(prepared.clip, legacy_clip, atol=EXACT_TOLERANCE)
+
+
+@pytest.mark.parametrize("upload", UPLOADS)
+def test_fast_decode_stays_close_to_the_per_head_path(upload, clip_preprocess):
+    data = UPLOADS[upload]()
+    legacy_chexnet, legacy_clip = legacy_preprocess(data, clip_preprocess)
+
+    prepared = XRayPreprocessor(clip_preprocess, fast_decode=True).prepare_bytes(data)
+
+    assert prepared.chexnet.shape == legacy_chexnet.shape
+    assert prepared.clip.shape == legacy_clip.shape
+    assert (prepared.chexnet - legacy_chexnet).abs().mean().item() < FAST_DECODE_MEAN_TOLERANCE
+    assert (prepared.clip - legacy_clip).abs().mean().item() < FAST_DECODE_MEAN_TOLERANCE
@@ -1,26 +1,25 @@
 # xray-analysis-service/models/xray_models.py
 
 import os
-import io
-import base64
+import hashlib
+import threading
+import time
 from PIL import Image
+import numpy as np
 import torch
 import torch.nn as nn
-import torchvision.transforms as transforms
-import torchvision.models as models
-from transformers import pipeline as hf_pipeline
-from open_clip import create_model_from_pretrained, get_tokenizer
-import google.generativeai as genai
-import numpy as np
-import cv2
-import matplotlib.pyplot as plt
 
-# --- Configuration ---
-# It's recommended to load your Gemini API key from environment variables
-# For example, create a .env file with: GEMINI_API_KEY="your_key_here"
-from dotenv import load_dotenv
-load_dotenv()
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+import config
+from backends import build_chexnet_runner
+from preprocessing import XRayPreprocessor
+
+BIOMED_CLIP_MODEL = 'hf-hub:microsoft/BiomedCLIP-PubMedBERT_256-vit_base_patch16_224'
+# Identifies the ChexNet weights. Bump it when real ChexNet weights are loaded
+# so cached analyses produced by the old weights are no longer used.
+CHEXNET_WEIGHTS = 'densenet121-imagenet1k-v1'
+
+# The parts of the service that can be loaded independently
+HEADS = ("chexnet", "biomed_clip", "gemini")
 
 # --- ChexNet Model for Pathology Detection ---
 
@@ -28,6 +27,8 @@ class ChexNet(nn.Module):
     """ChexNet model architecture based on DenseNet121"""
     def __init__(self, num_classes=14):
         super(ChexNet, self).__init__()
+        import torchvision.models as models
+
         self.densenet121 = models.densenet121(weights=models.DenseNet121_Weights.DEFAULT)
         num_ftrs = self.densenet121.classifier.in_features
         self.densenet121.classifier = nn.Sequential(
@@ -40,62 +41,192 @@ class ChexNet(nn.Module):
 class XRayAnalysisModel:
     """
     A class to encapsulate all X-ray analysis models and logic.
+
+    Each head (ChexNet, BiomedCLIP, Gemini) is loaded on first use, or up
+    front through `load_heads`. Their heavy libraries are only imported by
+    the loaders, so a replica that only serves pathology scores never
+    imports open_clip or the Gemini client, nor keeps BiomedCLIP in memory.
     """
-    def __init__(self):
-        print("Loading X-Ray analysis models...")
+    def __init__(self, eager_heads=()):
+        """
+        Args:
+            eager_heads (list): Heads to load immediately; the rest load on first use.
+        """
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        # Both heads run at the same time, so give torch a shared thread budget
+        self.torch_threads = config.XRAY_TORCH_THREADS or max(1, (os.cpu_count() or 2) // 2)
+        torch.set_num_threads(self.torch_threads)
+        print(f"Torch intra-op threads: {self.torch_threads}")
         
-        # --- Load ChexNet ---
         self.chexnet_labels = [
             'Atelectasis', 'Cardiomegaly', 'Effusion', 'Infiltration', 'Mass', 
             'Nodule', 'Pneumonia', 'Pneumothorax', 'Consolidation', 'Edema', 
             'Emphysema', 'Fibrosis', 'Pleural_Thickening', 'Hernia'
         ]
-        self.chexnet_model = ChexNet(num_classes=len(self.chexnet_labels)).to(self.device)
+        self.chexnet_model = None
+        # Runs ChexNet on the configured backend (eager torch or ONNX Runtime)
+        self.chexnet_runner = None
+        # Classifier weights used to turn feature maps into class activation maps
+        self._cam_weights = None
+        self.biomed_clip_model = None
+        self.biomed_clip_preprocess = None
+        self.biomed_clip_tokenizer = None
+        self._gemini_model = None
+
+        # Decodes once and builds both model inputs; transforms are set up here,
+        # not per call. Rebuilt from the open_clip settings once BiomedCLIP loads.
+        self.preprocessor = XRayPreprocessor(max_pixels=config.XRAY_MAX_PIXELS, fast_decode=config.XRAY_FAST_DECODE)
+
+        # Normalized text embeddings of the zero-shot prompts, keyed by
+        # (labels, templates). The prompts rarely change, so the text tower
+        # runs once per label set instead of once per image.
+        self._text_embeddings = {}
+        self._text_embedding_lock = threading.Lock()
+        self.candidate_labels = list(config.XRAY_CLIP_LABELS)
+        self.clip_templates = list(config.XRAY_CLIP_TEMPLATES) or ['this is a photo of ']
+        self._label_set = None
+
+        self._loaded = set()
+        self._head_locks = {head: threading.Lock() for head in HEADS}
+        self.load_heads(eager_heads)
+
+    @property
+    def loaded_heads(self) -> list:
+        return [head for head in HEADS if head in self._loaded]
+
+    def load_heads(self, heads):
+        """Loads the given heads now instead of on first use."""
+        for head in heads:
+            self.ensure_loaded(head)
+
+    def ensure_loaded(self, head: str):
+        """
+        Loads a head if it isn't loaded yet. Concurrent callers wait for the
+        first one to finish instead of loading it twice.
+
+        Raises:
+            ValueError: If the head name is unknown.
+        """
+        if head in self._loaded:
+            return
+        if head not in HEADS:
+            raise ValueError(f"Unknown model head '{head}'. Expected one of {', '.join(HEADS)}.")
+        with self._head_locks[head]:
+            if head in self._loaded:
+                return
+            started = time.monotonic()
+            getattr(self, f"_load_{head}")()
+            self._loaded.add(head)
+            print(f"Loaded {head} in {time.monotonic() - started:.1f}s.")
+
+    def _load_chexnet(self):
+        chexnet_model = ChexNet(num_classes=len(self.chexnet_labels)).to(self.device)
         # Note: In a real scenario, you would load pre-trained weights for ChexNet.
         # For this prototype, it will use the ImageNet pre-trained DenseNet weights.
-        self.chexnet_model.eval()
-        print("ChexNet model loaded.")
+        chexnet_model.eval()
+        self.chexnet_model = chexnet_model
+        self.chexnet_runner = build_chexnet_runner(
+            chexnet_model, self.device, CHEXNET_WEIGHTS, threads=self.torch_threads, preprocessor=self.preprocessor
+        )
+        print(f"ChexNet backend: {self.chexnet_runner.name}")
 
-        # --- Load BiomedCLIP ---
-        model_and_preprocess = create_model_from_pretrained('hf-hub:microsoft/BiomedCLIP-PubMedBERT_256-vit_base_patch16_224')
+    def _load_biomed_clip(self):
+        from open_clip import create_model_from_pretrained, get_tokenizer
+
+        model_and_preprocess = create_model_from_pretrained(BIOMED_CLIP_MODEL)
         if len(model_and_preprocess) == 3:
-            self.biomed_clip_model, _, self.biomed_clip_preprocess = model_and_preprocess
+            biomed_clip_model, _, self.biomed_clip_preprocess = model_and_preprocess
         else:
-            self.biomed_clip_model, self.biomed_clip_preprocess = model_and_preprocess
-        self.biomed_clip_tokenizer = get_tokenizer('hf-hub:microsoft/BiomedCLIP-PubMedBERT_256-vit_base_patch16_224')
-        self.biomed_clip_model.to(self.device)
-        print("BiomedCLIP model loaded.")
+            biomed_clip_model, self.biomed_clip_preprocess = model_and_preprocess
+        self.biomed_clip_tokenizer = get_tokenizer(BIOMED_CLIP_MODEL)
+        biomed_clip_model.to(self.device)
+        biomed_clip_model.eval()
+        self.biomed_clip_model = biomed_clip_model
+        self.preprocessor = XRayPreprocessor(
+            self.biomed_clip_preprocess, max_pixels=config.XRAY_MAX_PIXELS, fast_decode=config.XRAY_FAST_DECODE
+        )
+        self._activate_label_set()
 
-        # --- Configure Gemini ---
+    def _load_gemini(self):
         # This part is simplified. In production, handle the API key securely.
         try:
             # The API key will be provided by the environment when run in the platform
             gemini_api_key = os.environ.get('GEMINI_API_KEY', '') # Fallback to empty string
             if gemini_api_key:
+                import google.generativeai as genai
+
                 genai.configure(api_key=gemini_api_key)
-                self.gemini_model = genai.GenerativeModel('gemma-3n-e4b-it')
+                self._gemini_model = genai.GenerativeModel('gemma-3n-e4b-it')
                 print("Gemini model configured.")
             else:
-                self.gemini_model = None
+                self._gemini_model = None
                 print("Warning: GEMINI_API_KEY not found. Q&A and Compare features will be disabled.")
         except Exception as e:
-            self.gemini_model = None
+            self._gemini_model = None
             print(f"Error configuring Gemini: {e}")
 
+    @property
+    def gemini_model(self):
+        self.ensure_loaded("gemini")
+        return self._gemini_model
+
 
     def predict_pathologies(self, image: Image.Image, threshold=0.5):
         """Uses ChexNet to predict pathologies from an X-ray image."""
-        transform = transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-        ])
-        image_tensor = transform(image.convert("RGB")).unsqueeze(0).to(self.device)
-        
-        with torch.no_grad():
-            predictions = self.chexnet_model(image_tensor).cpu().numpy()[0]
-        
+        return self.predict_pathologies_batch([self.preprocessor.prepare(image, ("chexnet",)).chexnet], threshold)[0]
+
+    def predict_pathologies_batch(self, inputs: list, threshold=0.5):
+        """
+        Uses ChexNet to predict pathologies for several X-ray images in one
+        batched forward pass.
+
+        Args:
+            inputs (list): Preprocessed ChexNet tensors (`PreparedImage.chexnet`).
+
+        Returns:
+            list: One list of pathology results per image, in order.
+        """
+        return [self.format_pathologies(row, threshold) for row in self.chexnet_probabilities_batch(inputs)]
+
+    def chexnet_probabilities_batch(self, inputs: list):
+        """Runs ChexNet over preprocessed tensors and returns one probability array per image."""
+        self.ensure_loaded("chexnet")
+        return list(self.chexnet_runner(torch.stack(inputs)))
+
+    def chexnet_analyze_batch(self, inputs: list):
+        """
+        Runs ChexNet over preprocessed tensors, also capturing class activation maps.
+
+        The maps come from the final feature map of the same forward pass
+        (via a hook, or a second output of the ONNX graph) weighted by the
+        classifier, so no extra inference is needed.
+
+        Returns:
+            list: One (probabilities, maps) tuple per image, where maps is a
+                  (14, h, w) array, or None if the backend can't provide it.
+        """
+        self.ensure_loaded("chexnet")
+        probabilities, features = self.chexnet_runner.run_with_features(torch.stack(inputs))
+        if features is None:
+            return [(row, None) for row in probabilities]
+        return list(zip(probabilities, self.class_activation_maps(features)))
+
+    def class_activation_maps(self, features):
+        """
+        Computes class activation maps for all ChexNet labels.
+
+        Args:
+            features (np.ndarray): (N, C, h, w) final DenseNet feature maps (after ReLU).
+
+        Returns:
+            np.ndarray: (N, 14, h, w) maps, one per label.
+        """
+        if self._cam_weights is None:
+            self._cam_weights = self.chexnet_model.densenet121.classifier[0].weight.detach().float().cpu().numpy()
+        return np.einsum("kc,nchw->nkhw", self._cam_weights, features, optimize=True).astype(np.float32)
+
+    def format_pathologies(self, predictions, threshold=0.5):
+        """Formats one row of ChexNet probabilities to match the API contract."""
         results = []
         for i, label in enumerate(self.chexnet_labels):
             prob = float(predictions[i])
@@ -108,17 +239,119 @@ class XRayAnalysisModel:
 
     def generate_biomed_clip_report(self, image: Image.Image):
         """Generates a descriptive report using BiomedCLIP."""
-        # A set of candidate labels to guide the report generation
-        candidate_labels = ["normal", "fracture", "pneumonia", "cardiomegaly", "pleural effusion", "nodule", "opacity"]
-        template = 'this is a photo of '
-        texts = self.biomed_clip_tokenizer([template + label for label in candidate_labels]).to(self.device)
+        self.ensure_loaded("biomed_clip")
+        return self.generate_biomed_clip_report_batch([self.preprocessor.prepare(image, ("biomed_clip",)).clip])[0]
+
+    def generate_biomed_clip_report_batch(self, inputs: list):
+        """
+        Generates descriptive reports for several images with BiomedCLIP,
+        running the image tower once over the whole batch.
+
+        Args:
+            inputs (list): Preprocessed BiomedCLIP tensors (`PreparedImage.clip`).
+
+        Returns:
+            list: One report string per image, in order.
+        """
+        return self.reports_from_embeddings(self.encode_images_batch(inputs))[0]
+
+    def encode_images_batch(self, inputs: list):
+        """Runs the BiomedCLIP image tower and returns one normalized float32 embedding per image."""
+        self.ensure_loaded("biomed_clip")
+        with torch.no_grad():
+            images_processed = torch.stack(inputs).to(self.device)
+            image_features = self.biomed_clip_model.encode_image(images_processed, normalize=True)
+        return list(image_features.float().cpu().numpy())
+
+    def reports_from_embeddings(self, embeddings: list):
+        """
+        Builds findings reports from BiomedCLIP image embeddings.
+
+        This is only a matrix multiply against the cached text embeddings,
+        so reports can be regenerated from stored embeddings without running
+        the image tower again.
+
+        Returns:
+            tuple: (reports, labels_key), where labels_key identifies the
+                   label set the reports were generated with.
+        """
+        self.ensure_loaded("biomed_clip")
+        # Snapshot the label set so a concurrent update can't mix label sets
+        candidate_labels, text_features, labels_key = self._label_set
 
         with torch.no_grad():
-            image_processed = self.biomed_clip_preprocess(image).unsqueeze(0).to(self.device)
-            image_features, text_features, logit_scale = self.biomed_clip_model(image_processed, texts)
-            logits = (logit_scale * image_features @ text_features.t()).detach().softmax(dim=-1)
+            image_features = torch.from_numpy(np.stack(embeddings)).to(self.device, dtype=text_features.dtype)
+            logit_scale = self.biomed_clip_model.logit_scale.exp()
+            logits = (logit_scale * image_features @ text_features.t()).softmax(dim=-1)
         
-        probs = logits.cpu().numpy()[0]
+        return [self._format_clip_report(candidate_labels, probs) for probs in logits.cpu().numpy()], labels_key
+
+    @property
+    def labels_key(self) -> str:
+        """Identifies the current zero-shot label set and templates."""
+        self.ensure_loaded("biomed_clip")
+        return self._label_set[2]
+
+    @property
+    def version(self) -> str:
+        """
+        Identifies the models and preprocessing producing cached analyses.
+
+        Names the ChexNet runner actually built (loading ChexNet if needed),
+        not the configured backend: an ONNX fallback to torch, or static
+        quantization downgraded to fp32, gets its own cache entries.
+        """
+        self.ensure_loaded("chexnet")
+        return f"chexnet:{CHEXNET_WEIGHTS}+{self.chexnet_runner.name}/clip:{BIOMED_CLIP_MODEL}/preprocess:{'v2' if config.XRAY_FAST_DECODE else 'v1'}"
+
+    def set_candidate_labels(self, labels: list, templates: list = None):
+        """
+        Sets the zero-shot labels (and optionally the prompt templates) used
+        for BiomedCLIP reports.
+
+        Text embeddings are computed once per distinct (labels, templates)
+        pair and reused afterwards, so switching back to a previous label
+        set does not run the text tower again. If BiomedCLIP isn't loaded
+        yet, the labels are encoded when it loads.
+
+        Args:
+            labels (list): Candidate finding labels, e.g. ["normal", "pneumonia"].
+            templates (list, optional): Prompt prefixes. Defaults to the current templates.
+        """
+        labels = list(labels)
+        templates = list(templates or self.clip_templates)
+        if not labels or not templates:
+            raise ValueError("At least one candidate label and one template are required.")
+
+        with self._text_embedding_lock:
+            self.candidate_labels = labels
+            self.clip_templates = templates
+        if self.biomed_clip_model is not None:
+            self._activate_label_set()
+
+    def _activate_label_set(self):
+        """Makes the current labels and templates the ones used for reports, encoding them if needed."""
+        with self._text_embedding_lock:
+            key = (tuple(self.candidate_labels), tuple(self.clip_templates))
+            text_features = self._text_embeddings.get(key)
+            if text_features is None:
+                text_features = self._encode_prompts(*key)
+                self._text_embeddings[key] = text_features
+            labels_key = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+            self._label_set = (list(key[0]), text_features, labels_key)
+
+    def _encode_prompts(self, labels: tuple, templates: tuple) -> torch.Tensor:
+        """Returns one normalized text embedding per label, averaged over templates."""
+        prompts = [template + label for label in labels for template in templates]
+        texts = self.biomed_clip_tokenizer(prompts).to(self.device)
+        with torch.no_grad():
+            text_features = self.biomed_clip_model.encode_text(texts, normalize=True)
+        text_features = text_features.view(len(labels), len(templates), -1).mean(dim=1)
+        return text_features / text_features.norm(dim=-1, keepdim=True)
+
+    @staticmethod
+    def _format_clip_report(candidate_labels, probs):
+        """Formats zero-shot label probabilities as a findings report."""
         report_lines = []
         for label, score in zip(candidate_labels, probs):
             report_lines.append(f"- {label.capitalize()}: Confidence {score:.2%}")
@@ -150,8 +383,17 @@ class XRayAnalysisModel:
         if not self.gemini_model:
             return "Comparison feature is not available. GEMINI_API_KEY is not configured."
             
-        report1 = self.generate_biomed_clip_report(image1)
-        report2 = self.generate_biomed_clip_report(image2)
+        self.ensure_loaded("biomed_clip")
+        (report1, report2), _ = self.reports_from_embeddings(self.encode_images_batch([
+            self.preprocessor.prepare(image1, ("biomed_clip",)).clip,
+            self.preprocessor.prepare(image2, ("biomed_clip",)).clip
+        ]))
+        return self.generate_comparison_from_reports(report1, report2)
+
+    def generate_comparison_from_reports(self, report1: str, report2: str):
+        """Compares a previous and a current findings report using Gemini."""
+        if not self.gemini_model:
+            return "Comparison feature is not available. GEMINI_API_KEY is not configured."
         
         prompt = f"""
         You are an expert radiologist. Analyze and compare the two medical reports from a previous and a current X-ray.
@@ -173,5 +415,6 @@ class XRayAnalysisModel:
         response = self.gemini_model.generate_content(prompt)
         return response.text
 
-# Instantiate the model class as a singleton
+# Instantiate the model class as a singleton. Heads load on first use or
+# when the app starts (see XRAY_EAGER_HEADS), not at import.
 xray_model_instance = XRayAnalysisModel()
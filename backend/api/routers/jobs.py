@@ -0,0 +1,109 @@
+# app/api/routers/jobs.py
+
+import asyncio
+import json
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.orm import Session
+
+from db import schemas, crud, models
+from db.database import get_db, SessionLocal
+from api.deps import get_current_user
+
+router = APIRouter()
+
+# How often the SSE stream checks the job, and sends a keep-alive comment
+EVENTS_POLL_INTERVAL = 0.5
+EVENTS_KEEPALIVE_INTERVAL = 15.0
+TERMINAL_STATUSES = (models.JobStatus.SUCCEEDED, models.JobStatus.FAILED)
+
+def get_user_job(db: Session, job_id: str, current_user: schemas.User) -> models.IngestionJob:
+    """Loads a job of the current user, or raises 404."""
+    db_job = crud.get_ingestion_job(db, job_id)
+    if not db_job or db_job.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return db_job
+
+@router.get("/{job_id}", response_model=schemas.IngestionJob)
+def get_job_status(
+    job_id: str,
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    """
+    Get the status and progress of a background upload.
+    """
+    return get_user_job(db, job_id, current_user)
+
+@router.get("/{job_id}/result")
+def get_job_result(
+    job_id: str,
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    """
+    Get the result of a background upload: the same response the upload
+    endpoint gives without background=true.
+
+    Returns 202 with the job status while it is queued or running, and the
+    upload's error status and detail if it failed.
+    """
+    db_job = get_user_job(db, job_id, current_user)
+    if db_job.status == models.JobStatus.SUCCEEDED:
+        return db_job.result
+    if db_job.status == models.JobStatus.FAILED:
+        failure = db_job.result or {}
+        raise HTTPException(status_code=failure.get("status_code", 500), detail=failure.get("detail", db_job.error))
+    return JSONResponse(
+        status_code=202,
+        content=schemas.IngestionJob.model_validate(db_job).model_dump(mode="json")
+    )
+
+@router.get("/{job_id}/events")
+async def stream_job_events(
+    job_id: str,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    """
+    Server-sent events for a background upload.
+
+    A "progress" event is sent whenever the job's status, stage or progress
+    changes, and a final "done" event carries the job with its result once
+    it succeeded or failed.
+    """
+    get_user_job(db, job_id, current_user)
+
+    async def events():
+        last = None
+        idle = 0.0
+        while not await request.is_disconnected():
+            # A short-lived session per check, so the stream holds no connection
+            session = SessionLocal()
+            try:
+                db_job = crud.get_ingestion_job(session, job_id)
+                snapshot = schemas.IngestionJob.model_validate(db_job).model_dump(mode="json")
+                result = db_job.result if db_job.status in TERMINAL_STATUSES else None
+            finally:
+                session.close()
+
+            if snapshot["status"] in (status.value for status in TERMINAL_STATUSES):
+                yield f"event: done\ndata: {json.dumps({**snapshot, 'result': result})}\n\n"
+                return
+            if snapshot != last:
+                last = snapshot
+                idle = 0.0
+                yield f"event: progress\ndata: {json.dumps(snapshot)}\n\n"
+            elif idle >= EVENTS_KEEPALIVE_INTERVAL:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(EVENTS_POLL_INTERVAL)
+            idle += EVENTS_POLL_INTERVAL
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,9 +1,9 @@
 # app/api/routers/reports.py
 
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
-import pdfplumber
-import io
+from typing import Optional
 import logging
 import traceback
 
@@ -11,7 +11,8 @@ import traceback
 # Changed from relative (...db) to absolute (db)
 from db import schemas, crud, models
 from db.database import get_db
-from services import ner_service
+from core.config import settings
+from services import ingestion, pdf_extraction, uploads
 from api.deps import get_current_user
 
 # Configure logging
@@ -25,10 +26,20 @@ async def test_endpoint():
     """Test endpoint to verify the router is working"""
     return {"message": "Reports router is working!", "status": "ok"}
 
+async def _spool_pdf(file: UploadFile) -> uploads.SpooledUpload:
+    """Streams an uploaded PDF to a temporary file; 413 if too large, 400 if empty."""
+    try:
+        return await uploads.spool_upload(file, suffix=".pdf")
+    except uploads.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.post("/upload-report", status_code=201)
 async def upload_report(
     file: UploadFile = File(...),
     patient_id: int = None,  # Optional: if provided, use this specific patient
+    background: Optional[bool] = None,
     db: Session = Depends(get_db),
     current_user: schemas.User = Depends(get_current_user)
 ):
@@ -39,6 +50,8 @@ async def upload_report(
         file: PDF file containing medical report
         patient_id: Optional - ID of existing patient to attach report to.
                    If not provided, creates new patient with extracted name.
+        background: Optional - queue the upload and return 202 with a job id
+                   instead of waiting; follow it at /api/jobs/{job_id}.
         
     Workflow:
         1. If patient_id provided -> attach report to that patient
@@ -55,104 +68,29 @@ async def upload_report(
         raise HTTPException(status_code=400, detail="Invalid file type. Only PDF is supported.")
 
     try:
-        # Read PDF file
+        # Stream the PDF to a temporary file (bounded memory, size-capped)
         logger.info("Reading PDF file...")
-        pdf_bytes = await file.read()
-        
-        # Extract text from PDF
-        logger.info("Extracting text from PDF...")
-        with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-            extracted_text = "".join(page.extract_text() or "" for page in pdf.pages)
-        
-        if not extracted_text.strip():
-            logger.warning("No text could be extracted from PDF")
-            raise HTTPException(status_code=400, detail="Could not extract text from PDF.")
-
-        logger.info(f"Extracted {len(extracted_text)} characters from PDF")
-        
-        # Call NER service
-        logger.info("Calling NER service...")
-        try:
-            ner_response = await ner_service.call_ner_service(extracted_text)
-            entities = ner_response.get("entities", [])
-            logger.info(f"NER service returned {len(entities)} entities")
-        except Exception as ner_error:
-            logger.error(f"NER service error: {str(ner_error)}")
-            # Continue without NER results if service fails
-            entities = []
-            logger.warning("Continuing without NER results due to service error")
+        upload = await _spool_pdf(file)
 
-        # Handle patient assignment logic
-        if patient_id:
-            # User specified a patient ID - use that patient
-            logger.info(f"Using specified patient ID: {patient_id}")
-            db_patient = crud.get_patient(db, patient_id=patient_id)
-            
-            if not db_patient:
-                raise HTTPException(
-                    status_code=404, 
-                    detail=f"Patient with ID {patient_id} not found"
-                )
-                
-            action_taken = "used_specified_patient"
-            logger.info(f"Found specified patient: {db_patient.name} (ID: {db_patient.id})")
-            
-        else:
-            # No patient ID provided - extract name and create new patient
-            logger.info("No patient ID provided, extracting name and creating new patient")
-            
-            # Extract patient details
-            logger.info("Extracting patient details...")
-            patient_details = crud.extract_patient_details_from_text(extracted_text)
-            logger.info(f"Extracted patient details: {patient_details}")
-            
-            # Handle name extraction failure
-            if not patient_details.get("name"):
-                logger.warning("Could not extract patient name from report")
-                raise HTTPException(
-                    status_code=400,
-                    detail={
-                        "status": "name_extraction_failed",
-                        "message": "Could not extract patient name from document",
-                        "action_required": "manual_name_input_or_patient_id", 
-                        "suggestion": "Use search-patients-by-name to find existing patients, or use upload-report-with-name endpoint",
-                        "extracted_text_preview": extracted_text[:200] + "..." if len(extracted_text) > 200 else extracted_text
-                    }
+        with upload:
+            if settings.INGESTION_BACKGROUND_DEFAULT if background is None else background:
+                if patient_id and not crud.get_patient(db, patient_id=patient_id):
+                    raise HTTPException(status_code=404, detail=f"Patient with ID {patient_id} not found")
+                job = ingestion.job_queue.enqueue(
+                    db, models.JobKind.REPORT_UPLOAD, upload,
+                    params={"patient_id": patient_id}, user_id=current_user.id
                 )
+                logger.info(f"Queued upload as ingestion job {job.id}")
+                return JSONResponse(status_code=202, content=ingestion.accepted(job))
 
-            # Create new patient with extracted details
-            extracted_name = patient_details["name"]
-            logger.info(f"Successfully extracted patient name: {extracted_name}")
-            
-            patient_to_create = schemas.PatientCreate(**patient_details)
-            db_patient = crud.create_patient(db, patient=patient_to_create)
-            action_taken = "created_new_patient"
-            logger.info(f"Created new patient with ID: {db_patient.id}")
-
-        # Create report
-        logger.info("Creating report...")
-        report_to_create = schemas.ReportCreate(
-            filename=file.filename,
-            report_type=models.ReportType.PDF_NER,
-            results={"entities": entities, "text_length": len(extracted_text)}
-        )
-        report = crud.create_report_for_patient(db, report=report_to_create, patient_id=db_patient.id)
-        logger.info(f"Created report with ID: {report.id}")
-        
+            response = await ingestion.ingest_report(
+                db, upload.path, file.filename, patient_id=patient_id, file_sha256=upload.sha256
+            )
         logger.info("Upload completed successfully")
-        
-        # Prepare response with detailed information
-        response = {
-            "status": "success",
-            "action": action_taken,
-            "patient_id": db_patient.id,
-            "patient_name": db_patient.name,
-            "report_id": report.id,
-            "entities_found": len(entities)
-        }
-        
         return response
         
+    except ingestion.IngestionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     except HTTPException:
         # Re-raise HTTP exceptions (they're already handled properly)
         raise
@@ -168,6 +106,7 @@ async def upload_report_with_manual_name(
     patient_age: int = None,
     patient_gender: str = None,
     patient_id: int = None,  # Optional: if provided, ignore name and use this patient
+    background: Optional[bool] = None,
     db: Session = Depends(get_db),
     current_user: schemas.User = Depends(get_current_user)
 ):
@@ -181,6 +120,7 @@ async def upload_report_with_manual_name(
         patient_age: Patient age (optional)
         patient_gender: Patient gender (optional) 
         patient_id: Optional - ID of existing patient to use instead of creating new
+        background: Optional - queue the upload and return 202 with a job id
     """
     logger.info(f"User {current_user.username} uploading file with manual name: {patient_name}")
     logger.info(f"Target patient ID: {patient_id if patient_id else 'Create new with provided name'}")
@@ -188,72 +128,32 @@ async def upload_report_with_manual_name(
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="Invalid file type. Only PDF is supported.")
 
-    try:
-        # Read and process PDF (same as before)
-        pdf_bytes = await file.read()
-        
-        with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-            extracted_text = "".join(page.extract_text() or "" for page in pdf.pages)
-        
-        if not extracted_text.strip():
-            raise HTTPException(status_code=400, detail="Could not extract text from PDF.")
+    manual_details = {
+        "name": patient_name.strip(),
+        "age": patient_age or 0,
+        "gender": patient_gender or "Unknown"
+    }
 
-        # Call NER service
-        try:
-            ner_response = await ner_service.call_ner_service(extracted_text)
-            entities = ner_response.get("entities", [])
-        except Exception:
-            entities = []
-            logger.warning("NER service unavailable, continuing without entities")
+    try:
+        upload = await _spool_pdf(file)
 
-        # Handle patient assignment logic
-        if patient_id:
-            # User specified a patient ID - use that patient
-            logger.info(f"Using specified patient ID: {patient_id}")
-            db_patient = crud.get_patient(db, patient_id=patient_id)
-            
-            if not db_patient:
-                raise HTTPException(
-                    status_code=404, 
-                    detail=f"Patient with ID {patient_id} not found"
+        with upload:
+            if settings.INGESTION_BACKGROUND_DEFAULT if background is None else background:
+                if patient_id and not crud.get_patient(db, patient_id=patient_id):
+                    raise HTTPException(status_code=404, detail=f"Patient with ID {patient_id} not found")
+                job = ingestion.job_queue.enqueue(
+                    db, models.JobKind.REPORT_UPLOAD, upload,
+                    params={"patient_id": patient_id, "manual_details": manual_details}, user_id=current_user.id
                 )
-                
-            action_taken = "used_specified_patient"
-            logger.info(f"Found specified patient: {db_patient.name} (ID: {db_patient.id})")
-            
-        else:
-            # Use manually provided patient details to create new patient
-            patient_details = {
-                "name": patient_name.strip(),
-                "age": patient_age or 0,
-                "gender": patient_gender or "Unknown"
-            }
-            
-            patient_to_create = schemas.PatientCreate(**patient_details)
-            db_patient = crud.create_patient(db, patient=patient_to_create)
-            action_taken = "created_new_patient"
-            logger.info(f"Created new patient with manual details: {db_patient.name} (ID: {db_patient.id})")
+                return JSONResponse(status_code=202, content=ingestion.accepted(job))
 
-        # Create report
-        report_to_create = schemas.ReportCreate(
-            filename=file.filename,
-            report_type=models.ReportType.PDF_NER,
-            results={"entities": entities, "text_length": len(extracted_text), "manual_input": True}
-        )
-        report = crud.create_report_for_patient(db, report=report_to_create, patient_id=db_patient.id)
-        
-        response = {
-            "status": "success",
-            "action": action_taken,
-            "patient_id": db_patient.id,
-            "patient_name": db_patient.name,
-            "report_id": report.id,
-            "entities_found": len(entities),
-            "manual_input_used": True
-        }
-        
-        return response
+            return await ingestion.ingest_report(
+                db, upload.path, file.filename, patient_id=patient_id,
+                manual_details=manual_details, file_sha256=upload.sha256
+            )
         
+    except ingestion.IngestionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     except HTTPException:
         raise
     except Exception as e:
@@ -291,7 +191,7 @@ async def search_patients_by_name(
     }
 
 @router.post("/debug-pdf")
-def debug_pdf_extraction(
+async def debug_pdf_extraction(
     file: UploadFile = File(...),
     current_user: schemas.User = Depends(get_current_user)
 ):
@@ -300,24 +200,27 @@ def debug_pdf_extraction(
     This helps troubleshoot PDF processing issues.
     """
     try:
-        # Read PDF content
-        pdf_bytes = file.file.read()
+        # Stream the PDF to a temporary file
+        upload = await _spool_pdf(file)
         
-        # Extract text from PDF
-        with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-            extracted_text = "".join(page.extract_text() or "" for page in pdf.pages)
+        # Extract text from PDF (in the extraction process pool)
+        with upload:
+            extracted_text = await pdf_extraction.extract_text(upload.path)
         
         # Extract patient details
         patient_details = crud.extract_patient_details_from_text(extracted_text)
         
         return {
             "filename": file.filename,
+            "sha256": upload.sha256,
             "text_length": len(extracted_text),
             "extracted_text": extracted_text[:1000] + "..." if len(extracted_text) > 1000 else extracted_text,  # First 1000 chars
             "patient_details": patient_details,
             "full_text": extracted_text  # Include full text for debugging
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Debug error: {str(e)}")
 
@@ -0,0 +1,42 @@
+# app/api/routers/system.py
+
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+from db import schemas, crud
+from db.database import get_db
+from services import http_clients, pdf_extraction, resilience
+from api.deps import get_current_user
+
+router = APIRouter()
+
+@router.get("/http-pools")
+def get_http_pool_stats(current_user: schemas.User = Depends(get_current_user)):
+    """
+    Connection pool utilization of the clients used to call the AI services.
+    """
+    return http_clients.pool_stats()
+
+@router.get("/ai-services")
+def get_ai_service_health(current_user: schemas.User = Depends(get_current_user)):
+    """
+    Circuit breaker state of each AI service replica, with retry and hedging counters.
+    """
+    return resilience.breaker_stats()
+
+@router.get("/ingestion-queue")
+def get_ingestion_queue_stats(
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    """
+    Number of background upload jobs in each status.
+    """
+    return crud.count_ingestion_jobs_by_status(db)
+
+@router.get("/pdf-extraction")
+def get_pdf_extraction_stats(current_user: schemas.User = Depends(get_current_user)):
+    """
+    PDF text extraction pool settings and counters.
+    """
+    return pdf_extraction.pool_stats()
@@ -1,12 +1,15 @@
 # app/api/routers/xray.py
 
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
+from fastapi.responses import JSONResponse, Response
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+import os
 
 from db import schemas, crud, models
 from db.database import get_db
-from services import xray_service
+from core.config import settings
+from services import ingestion, uploads, xray_service
 from api.deps import get_current_user
 
 router = APIRouter()
@@ -15,32 +18,71 @@ router = APIRouter()
 async def analyze_xray(
     patient_id: int,
     file: UploadFile = File(...),
+    background: Optional[bool] = None,
     db: Session = Depends(get_db),
     current_user: schemas.User = Depends(get_current_user)
 ):
     """
     Analyze an X-ray for a specific patient and save the analysis as a new report.
+
+    With background=true the analysis is queued and 202 is returned with a
+    job id; follow it at /api/jobs/{job_id}.
     """
     # Verify patient exists
     db_patient = crud.get_patient(db, patient_id=patient_id)
     if not db_patient:
         raise HTTPException(status_code=404, detail="Patient not found")
 
-    # Call the AI service
+    # Stream the image to a temporary file (bounded memory, size-capped)
+    try:
+        upload = await uploads.spool_upload(file, suffix=os.path.splitext(file.filename or "")[1])
+    except uploads.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    with upload:
+        if settings.INGESTION_BACKGROUND_DEFAULT if background is None else background:
+            job = ingestion.job_queue.enqueue(
+                db, models.JobKind.XRAY_ANALYSIS, upload,
+                params={"patient_id": patient_id}, user_id=current_user.id
+            )
+            return JSONResponse(status_code=202, content=ingestion.accepted(job))
+
+        # Call the AI service and store the analysis
+        try:
+            return await ingestion.ingest_xray(db, upload.path, file.filename, file.content_type, patient_id)
+        except ingestion.IngestionError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+@router.get("/xray-segmentation/{report_id}")
+async def get_xray_segmentation(
+    report_id: int,
+    pathology: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    """
+    Get the heatmap overlay of a stored X-ray analysis as a PNG.
+
+    Heatmaps are not stored with the report; they are fetched on demand from
+    the X-Ray service, which keeps them for a limited number of recent analyses.
+    """
+    db_report = crud.get_report(db, report_id=report_id)
+    if not db_report or db_report.report_type != models.ReportType.XRAY_ANALYSIS:
+        raise HTTPException(status_code=404, detail="X-ray analysis report not found")
+    results = db_report.results or {}
+    analysis_id = results.get("analysis_id")
+    if not analysis_id:
+        raise HTTPException(status_code=404, detail="No heatmap is available for this report")
+
     try:
-        analysis_result = await xray_service.call_xray_analyze(file)
+        png = await xray_service.fetch_xray_segmentation(analysis_id, pathology, replica_url=results.get("xray_replica"))
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"X-Ray Analysis Service unavailable: {e}")
-
-    # Create a new report in the database with the results
-    report_to_create = schemas.ReportCreate(
-        filename=file.filename,
-        report_type=models.ReportType.XRAY_ANALYSIS,
-        results=analysis_result
-    )
-    db_report = crud.create_report_for_patient(db, report=report_to_create, patient_id=patient_id)
-    
-    return db_report
+    if png is None:
+        raise HTTPException(status_code=404, detail="The heatmap has expired. Re-run the analysis to regenerate it.")
+    return Response(content=png, media_type="image/png")
 
 @router.post("/compare-xrays/{patient_id}", response_model=schemas.Report)
 async def compare_xrays(
@@ -71,6 +113,86 @@ async def compare_xrays(
     
     return db_report
 
+def get_xray_analysis_report(db: Session, report_id: int, patient_id: int) -> models.Report:
+    """
+    Loads a stored X-ray analysis report of a patient, for use in a comparison.
+
+    Raises:
+        HTTPException: 404 if the report doesn't exist or belongs to another
+                       patient, 400 if it is not an X-ray analysis.
+    """
+    db_report = crud.get_report(db, report_id=report_id)
+    if not db_report or db_report.patient_id != patient_id:
+        raise HTTPException(status_code=404, detail=f"Report {report_id} not found for this patient")
+    if db_report.report_type != models.ReportType.XRAY_ANALYSIS:
+        raise HTTPException(status_code=400, detail=f"Report {report_id} is not an X-ray analysis")
+    if not (db_report.results or {}).get("generated_report"):
+        raise HTTPException(status_code=400, detail=f"Report {report_id} has no generated findings to compare")
+    return db_report
+
+@router.post("/compare-reports/{patient_id}", response_model=schemas.Report)
+async def compare_xray_reports(
+    patient_id: int,
+    baseline_report_id: int = Form(...),
+    current_report_id: Optional[int] = Form(None),
+    current_xray: Optional[UploadFile] = File(None),
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    """
+    Compare a stored X-ray analysis (the baseline) with either another stored
+    analysis or a newly uploaded X-ray, and save the result as a new report.
+
+    The baseline's stored findings are reused, so only a new image (if any)
+    is uploaded and analyzed. A new image's analysis is also saved as its own
+    XRAY_ANALYSIS report, so it can serve as the baseline of the next study.
+    """
+    if (current_report_id is None) == (current_xray is None):
+        raise HTTPException(status_code=400, detail="Provide exactly one of current_report_id or current_xray")
+
+    db_patient = crud.get_patient(db, patient_id=patient_id)
+    if not db_patient:
+        raise HTTPException(status_code=404, detail="Patient not found")
+
+    baseline = get_xray_analysis_report(db, baseline_report_id, patient_id)
+    baseline_text = baseline.results["generated_report"]
+
+    if current_report_id is not None:
+        current = get_xray_analysis_report(db, current_report_id, patient_id)
+        try:
+            comparison_result = await xray_service.call_xray_compare_reports(baseline_text, current.results["generated_report"])
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"X-Ray Comparison Service unavailable: {e}")
+    else:
+        try:
+            service_result = await xray_service.call_xray_compare_with_baseline(baseline_text, current_xray)
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"X-Ray Comparison Service unavailable: {e}")
+
+        current = crud.create_report_for_patient(
+            db,
+            report=schemas.ReportCreate(
+                filename=current_xray.filename,
+                report_type=models.ReportType.XRAY_ANALYSIS,
+                results=service_result["current_analysis"]
+            ),
+            patient_id=patient_id
+        )
+        comparison_result = {"comparison_report": service_result["comparison_report"]}
+
+    report_to_create = schemas.ReportCreate(
+        filename=f"comparison_{baseline.filename}_vs_{current.filename}",
+        report_type=models.ReportType.XRAY_COMPARISON,
+        results={
+            **comparison_result,
+            "baseline_report_id": baseline.id,
+            "current_report_id": current.id
+        }
+    )
+    db_report = crud.create_report_for_patient(db, report=report_to_create, patient_id=patient_id)
+    
+    return db_report
+
 @router.post("/ask-question", response_model=schemas.QNAResponse)
 async def ask_question(
     payload: schemas.QNARequest,
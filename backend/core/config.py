@@ -29,6 +29,95 @@ class Settings(BaseSettings):
     # These should point to the running instances of your AI microservices.
     NER_SERVICE_URL: str = os.getenv("NER_SERVICE_URL", "http://localhost:5001")
     XRAY_SERVICE_URL: str = os.getenv("XRAY_SERVICE_URL", "http://localhost:5002")
+    # Optional comma-separated replica URLs. When set they replace the
+    # single URL above, and slow calls can be hedged across replicas.
+    NER_SERVICE_URLS: str = os.getenv("NER_SERVICE_URLS", "")
+    XRAY_SERVICE_URLS: str = os.getenv("XRAY_SERVICE_URLS", "")
+
+    # --- AI Service HTTP Client Settings ---
+    # One pooled client per AI service is kept open for the lifetime of the
+    # app, so uploads reuse warm keep-alive connections.
+    AI_HTTP_MAX_CONNECTIONS: int = int(os.getenv("AI_HTTP_MAX_CONNECTIONS", "64"))
+    AI_HTTP_MAX_KEEPALIVE: int = int(os.getenv("AI_HTTP_MAX_KEEPALIVE", "16"))
+    AI_HTTP_KEEPALIVE_EXPIRY: float = float(os.getenv("AI_HTTP_KEEPALIVE_EXPIRY", "30"))
+    AI_HTTP_CONNECT_TIMEOUT: float = float(os.getenv("AI_HTTP_CONNECT_TIMEOUT", "5"))
+    # How long a call may wait for a free pooled connection
+    AI_HTTP_POOL_TIMEOUT: float = float(os.getenv("AI_HTTP_POOL_TIMEOUT", "10"))
+    # HTTP/2 multiplexes calls over one connection; needs the h2 package
+    # and an HTTP/2-capable server (e.g. behind a proxy)
+    AI_HTTP2: bool = os.getenv("AI_HTTP2", "false").lower() in ("1", "true", "yes")
+    # Unix domain sockets for co-located services; the URL host is then
+    # only used for the Host header
+    NER_SERVICE_UDS: str = os.getenv("NER_SERVICE_UDS", "")
+    XRAY_SERVICE_UDS: str = os.getenv("XRAY_SERVICE_UDS", "")
+
+    # --- AI Service Resilience Settings ---
+    # Transient failures (connection errors, 429/502/503/504) are retried
+    # with exponential backoff and full jitter.
+    AI_RETRY_ATTEMPTS: int = int(os.getenv("AI_RETRY_ATTEMPTS", "2"))
+    AI_RETRY_BACKOFF_BASE: float = float(os.getenv("AI_RETRY_BACKOFF_BASE", "0.2"))
+    AI_RETRY_BACKOFF_MAX: float = float(os.getenv("AI_RETRY_BACKOFF_MAX", "2.0"))
+    # After this many consecutive failures a replica's breaker opens and
+    # calls fail fast; after the reset timeout one probe call is let through.
+    AI_BREAKER_FAILURE_THRESHOLD: int = int(os.getenv("AI_BREAKER_FAILURE_THRESHOLD", "5"))
+    AI_BREAKER_RESET_TIMEOUT: float = float(os.getenv("AI_BREAKER_RESET_TIMEOUT", "30"))
+    # With several replicas, a call still running after the endpoint's
+    # recent p95 latency (at least AI_HEDGE_MIN_DELAY_MS) is also sent to
+    # another replica; the first answer wins.
+    AI_HEDGE_ENABLED: bool = os.getenv("AI_HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+    AI_HEDGE_MIN_DELAY_MS: int = int(os.getenv("AI_HEDGE_MIN_DELAY_MS", "50"))
+    # Hedging budget per service: each hedgeable call earns
+    # AI_HEDGE_BUDGET_RATIO tokens (up to AI_HEDGE_BUDGET_BURST) and each
+    # hedge spends one, so hedges stay at most that fraction of the calls
+    # even when every replica is slow.
+    AI_HEDGE_BUDGET_RATIO: float = float(os.getenv("AI_HEDGE_BUDGET_RATIO", "0.05"))
+    AI_HEDGE_BUDGET_BURST: float = float(os.getenv("AI_HEDGE_BUDGET_BURST", "5"))
+
+    # --- Ingestion Job Settings ---
+    # Uploads can be processed in the background (?background=true), with
+    # the job queue stored in the database and each job's file under
+    # INGESTION_PAYLOAD_DIR (shared storage when several backend hosts run
+    # workers). INGESTION_BACKGROUND_DEFAULT makes background processing
+    # the default for clients that don't say. It is off by default because
+    # the frontend reads the report from the synchronous 201 response and
+    # doesn't follow jobs yet.
+    INGESTION_WORKERS: int = int(os.getenv("INGESTION_WORKERS", "2"))
+    INGESTION_MAX_ATTEMPTS: int = int(os.getenv("INGESTION_MAX_ATTEMPTS", "3"))
+    # Delay before retry n is INGESTION_RETRY_BACKOFF * 2^(n-1) seconds
+    INGESTION_RETRY_BACKOFF: float = float(os.getenv("INGESTION_RETRY_BACKOFF", "5"))
+    # How often idle workers look for due jobs (new jobs wake them at once)
+    INGESTION_POLL_INTERVAL: float = float(os.getenv("INGESTION_POLL_INTERVAL", "2"))
+    # A running job whose heartbeat is older than this is requeued
+    INGESTION_LEASE_TIMEOUT: float = float(os.getenv("INGESTION_LEASE_TIMEOUT", "120"))
+    INGESTION_PAYLOAD_DIR: str = os.getenv("INGESTION_PAYLOAD_DIR", "./ingestion_payloads")
+    INGESTION_BACKGROUND_DEFAULT: bool = os.getenv("INGESTION_BACKGROUND_DEFAULT", "false").lower() in ("1", "true", "yes")
+
+    # --- Upload Settings ---
+    # Uploads are streamed to temporary files in UPLOAD_CHUNK_KB chunks
+    # (UPLOAD_SPOOL_DIR, or the system temp dir) and rejected with 413
+    # beyond MAX_UPLOAD_MB, by Content-Length before the body is read.
+    MAX_UPLOAD_MB: int = int(os.getenv("MAX_UPLOAD_MB", "50"))
+    UPLOAD_CHUNK_KB: int = int(os.getenv("UPLOAD_CHUNK_KB", "1024"))
+    UPLOAD_SPOOL_DIR: str = os.getenv("UPLOAD_SPOOL_DIR", "")
+
+    # --- PDF Extraction Settings ---
+    # Text is extracted in a pool of worker processes so parsing never
+    # blocks the event loop. Documents longer than PDF_PAGES_PER_TASK pages
+    # are split into page ranges extracted in parallel.
+    PDF_EXTRACT_WORKERS: int = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+    PDF_PAGES_PER_TASK: int = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+    # Time budget per document, in seconds
+    PDF_EXTRACT_TIMEOUT: float = float(os.getenv("PDF_EXTRACT_TIMEOUT", "60"))
+
+    # --- Entity Format Settings ---
+    # Wire format requested from the NER service: "json" (one object per
+    # entity), "columnar" (parallel arrays, labels sent once) or "msgpack"
+    # (columnar, msgpack-encoded; needs the msgpack package). The compact
+    # formats are opt-in.
+    NER_WIRE_FORMAT: str = os.getenv("NER_WIRE_FORMAT", "json")
+    # How entities are stored in Report.results: "rows" (the original
+    # shape) or "columnar" (opt-in). API responses always expand them back to rows.
+    REPORT_ENTITY_STORAGE: str = os.getenv("REPORT_ENTITY_STORAGE", "rows")
     
     # --- JWT Security Settings ---
     # This key MUST be kept secret and should be a long, random string.
@@ -1,5 +1,6 @@
 # app/db/crud.py
 
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from db import models, schemas
@@ -95,6 +96,102 @@ def get_reports_for_patient(db: Session, patient_id: int) -> List[models.Report]
     """Retrieves all reports for a specific patient."""
     return db.query(models.Report).filter(models.Report.patient_id == patient_id).all()
 
+# --- Ingestion Job CRUD Functions ---
+
+def create_ingestion_job(
+    db: Session,
+    job_id: str,
+    kind: models.JobKind,
+    filename: str,
+    content_type: str,
+    payload_path: str,
+    params: dict,
+    user_id: int,
+    max_attempts: int
+) -> models.IngestionJob:
+    """Queues a new ingestion job."""
+    db_job = models.IngestionJob(
+        id=job_id,
+        kind=kind,
+        status=models.JobStatus.QUEUED,
+        filename=filename,
+        content_type=content_type,
+        payload_path=payload_path,
+        params=params,
+        checkpoint={},
+        max_attempts=max_attempts,
+        run_after=models.get_ist_now(),
+        user_id=user_id
+    )
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def get_ingestion_job(db: Session, job_id: str) -> Optional[models.IngestionJob]:
+    """Retrieves a single ingestion job by its ID."""
+    return db.query(models.IngestionJob).filter(models.IngestionJob.id == job_id).first()
+
+def claim_next_ingestion_job(db: Session, worker_id: str) -> Optional[models.IngestionJob]:
+    """
+    Atomically claims the oldest queued job that is due, if any.
+
+    The status check in the UPDATE makes the claim safe when several
+    workers (or backend processes) poll the same table.
+    """
+    now = models.get_ist_now()
+    candidates = db.query(models.IngestionJob.id).filter(
+        models.IngestionJob.status == models.JobStatus.QUEUED,
+        models.IngestionJob.run_after <= now
+    ).order_by(models.IngestionJob.created_at).limit(5).all()
+
+    for (job_id,) in candidates:
+        claimed = db.query(models.IngestionJob).filter(
+            models.IngestionJob.id == job_id,
+            models.IngestionJob.status == models.JobStatus.QUEUED
+        ).update({
+            models.IngestionJob.status: models.JobStatus.RUNNING,
+            models.IngestionJob.worker_id: worker_id,
+            models.IngestionJob.attempts: models.IngestionJob.attempts + 1,
+            models.IngestionJob.started_at: now,
+            models.IngestionJob.heartbeat_at: now,
+            models.IngestionJob.error: None
+        }, synchronize_session=False)
+        db.commit()
+        if claimed:
+            return get_ingestion_job(db, job_id)
+    return None
+
+def requeue_stale_ingestion_jobs(db: Session, stale_before) -> int:
+    """
+    Puts running jobs whose worker stopped heartbeating (e.g. the backend
+    was restarted mid-job) back in the queue. Returns how many were requeued.
+    """
+    requeued = db.query(models.IngestionJob).filter(
+        models.IngestionJob.status == models.JobStatus.RUNNING,
+        models.IngestionJob.heartbeat_at < stale_before
+    ).update({
+        models.IngestionJob.status: models.JobStatus.QUEUED,
+        models.IngestionJob.worker_id: None,
+        models.IngestionJob.stage: "requeued",
+        models.IngestionJob.run_after: models.get_ist_now()
+    }, synchronize_session=False)
+    db.commit()
+    return requeued
+
+def update_ingestion_job(db: Session, job_id: str, **fields) -> None:
+    """Updates fields of a job without loading it (progress, heartbeat, outcome)."""
+    db.query(models.IngestionJob).filter(models.IngestionJob.id == job_id).update(
+        {getattr(models.IngestionJob, name): value for name, value in fields.items()},
+        synchronize_session=False
+    )
+    db.commit()
+
+def count_ingestion_jobs_by_status(db: Session) -> dict:
+    """Number of jobs in each status."""
+    rows = db.query(models.IngestionJob.status, func.count(models.IngestionJob.id)).group_by(models.IngestionJob.status).all()
+    return {status.value: count for status, count in rows}
+
 # --- Utility Functions ---
 
 def extract_patient_details_from_text(text: str) -> dict:
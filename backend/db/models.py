@@ -1,6 +1,6 @@
 # app/db/models.py
 
-from sqlalchemy import Column, Integer, String, Enum, ForeignKey, JSON, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, Enum, ForeignKey, JSON, Boolean, DateTime, Float, Text
 from sqlalchemy.orm import relationship
 from db.database import Base
 import enum
@@ -60,3 +60,62 @@ class Report(Base):
     
     # This creates the many-to-one relationship back to the Patient.
     patient = relationship("Patient", back_populates="reports")
+
+
+class JobKind(str, enum.Enum):
+    """Enum for the kinds of uploads that can be processed in the background."""
+    REPORT_UPLOAD = "REPORT_UPLOAD"
+    XRAY_ANALYSIS = "XRAY_ANALYSIS"
+
+
+class JobStatus(str, enum.Enum):
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    SUCCEEDED = "SUCCEEDED"
+    FAILED = "FAILED"
+
+
+class IngestionJob(Base):
+    """
+    An upload processed in the background. The row is the queue entry and
+    points at the uploaded file, which the job owns (under
+    INGESTION_PAYLOAD_DIR) until it finishes, so queued and interrupted
+    jobs survive a backend restart.
+    """
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(String(32), primary_key=True, index=True)
+    kind = Column(Enum(JobKind))
+    status = Column(Enum(JobStatus), default=JobStatus.QUEUED, index=True)
+
+    # Upload and request parameters (patient id, manual patient details, ...)
+    filename = Column(String)
+    content_type = Column(String)
+    params = Column(JSON, default=dict)
+    # The uploaded file, kept on disk rather than in the database; cleared
+    # (and the file deleted) once the job succeeds or fails for good
+    payload_path = Column(String)
+
+    # Progress for polling and SSE
+    stage = Column(String, default="queued")
+    progress = Column(Float, default=0.0)
+
+    # Retries: attempts made so far, and when the job may run next
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    run_after = Column(DateTime, default=get_ist_now, index=True)
+    # Steps already done by an earlier attempt (e.g. the patient it created)
+    checkpoint = Column(JSON, default=dict)
+
+    # Claim of a running job; a stale heartbeat means its worker died
+    worker_id = Column(String)
+    heartbeat_at = Column(DateTime)
+
+    result = Column(JSON)
+    error = Column(Text)
+
+    created_at = Column(DateTime, default=get_ist_now)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
@@ -1,9 +1,10 @@
 # app/db/schemas.py
 
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 from typing import List, Optional
 from datetime import datetime
-from db.models import ReportType
+from db.models import ReportType, JobKind, JobStatus
+from services.entity_format import expand_results
 
 # --- Base Schemas ---
 
@@ -36,6 +37,12 @@ class Report(ReportBase):
     id: int
     patient_id: int
     created_at: datetime
+
+    @field_validator("results")
+    @classmethod
+    def expand_columnar_entities(cls, results: dict) -> dict:
+        # Entities may be stored columnar; API consumers always get rows
+        return expand_results(results)
     
     class Config:
         from_attributes = True
@@ -56,6 +63,32 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
+# --- Ingestion Job Schemas ---
+
+class IngestionJob(BaseModel):
+    id: str
+    kind: JobKind
+    status: JobStatus
+    filename: Optional[str] = None
+    stage: Optional[str] = None
+    progress: float = 0.0
+    attempts: int = 0
+    max_attempts: int = 0
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class IngestionJobAccepted(BaseModel):
+    job_id: str
+    status: JobStatus
+    status_url: str
+    result_url: str
+    events_url: str
+
 # Update forward references
 Patient.model_rebuild()
 
@@ -1,21 +1,52 @@
 # main.py
 
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 # --- CORRECTED IMPORTS ---
-from api.routers import reports, patients, auth, xray
+from api.routers import reports, patients, auth, xray, system, jobs
 from db.database import engine
 from db import models
+from core.config import settings
+from services import http_clients, ingestion, pdf_extraction, uploads
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Long-lived, pooled clients for the AI services
+    await http_clients.start_clients()
+    # Worker processes for PDF text extraction
+    pdf_extraction.start_pool()
+    # Background upload workers; queued and interrupted jobs are picked up again
+    await ingestion.job_queue.start()
+    yield
+    await ingestion.job_queue.stop()
+    pdf_extraction.shutdown_pool()
+    await http_clients.close_clients()
+
 app = FastAPI(
     title="Hospital Medical Analyzer API",
     description="The main backend server for the medical analysis platform.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Room for multipart boundaries and form fields around the file itself
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024
+
+# Registered before CORS so that CORS wraps it and the early 413 carries
+# the CORS headers the frontend needs to read it
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Rejects oversized uploads from their Content-Length, before the body is read."""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > uploads.max_upload_bytes() + MULTIPART_OVERHEAD_BYTES:
+        return JSONResponse(status_code=413, content={"detail": f"Upload is larger than {settings.MAX_UPLOAD_MB} MB."})
+    return await call_next(request)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -30,6 +61,8 @@ app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(patients.router, prefix="/api/patients", tags=["Patients"])
 app.include_router(reports.router, prefix="/api/patients", tags=["Medical Reports"])
 app.include_router(xray.router, prefix="/api/patients", tags=["X-Ray Analysis"])
+app.include_router(jobs.router, prefix="/api/jobs", tags=["Background Jobs"])
+app.include_router(system.router, prefix="/api/system", tags=["System"])
 
 @app.get("/")
 def read_root():
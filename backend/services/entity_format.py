@@ -0,0 +1,81 @@
+# app/services/entity_format.py
+
+from core.config import settings
+
+# Must match the NER service's compact format (ner_service/compact.py)
+COLUMNAR_JSON_MEDIA_TYPE = "application/vnd.medner.columnar+json"
+COLUMNAR_MSGPACK_MEDIA_TYPE = "application/vnd.medner.columnar+msgpack"
+COLUMNAR_FORMAT = "columnar-v1"
+
+
+def to_columnar(entities: list) -> dict:
+    """
+    Converts row-oriented entities into the columnar form: parallel arrays
+    of text, offsets, scores and label ids, with each label stored once.
+    """
+    labels, label_index = [], {}
+    columns = {"label_ids": [], "start": [], "end": [], "confidence": [], "text": []}
+    for entity in entities:
+        label = entity.get("label")
+        if label not in label_index:
+            label_index[label] = len(labels)
+            labels.append(label)
+        columns["label_ids"].append(label_index[label])
+        columns["start"].append(entity.get("start"))
+        columns["end"].append(entity.get("end"))
+        columns["confidence"].append(entity.get("confidence"))
+        columns["text"].append(entity.get("text"))
+
+    return {"format": COLUMNAR_FORMAT, "count": len(entities), "labels": labels, **columns}
+
+
+def to_rows(columnar: dict) -> list:
+    """Converts columnar entities back to the row-oriented form (one dict per entity)."""
+    labels = columnar.get("labels", [])
+    return [
+        {"text": text, "label": labels[label_id], "confidence": confidence, "start": start, "end": end}
+        for text, label_id, confidence, start, end in zip(
+            columnar.get("text", []), columnar.get("label_ids", []), columnar.get("confidence", []),
+            columnar.get("start", []), columnar.get("end", [])
+        )
+    ]
+
+
+def entities_for_storage(ner_response: dict) -> dict:
+    """
+    Prepares NER output for `Report.results` in the configured storage format.
+    Accepts either a row-oriented ({"entities": [...]}) or a columnar
+    ({"entities_columnar": {...}}) NER response.
+
+    Returns:
+        dict: {"entities_columnar": {...}} or {"entities": [...]}.
+    """
+    if "entities_columnar" in ner_response:
+        columnar = ner_response["entities_columnar"]
+        if settings.REPORT_ENTITY_STORAGE == "columnar":
+            return {"entities_columnar": columnar}
+        return {"entities": to_rows(columnar)}
+
+    entities = ner_response.get("entities", [])
+    if settings.REPORT_ENTITY_STORAGE == "columnar":
+        return {"entities_columnar": to_columnar(entities)}
+    return {"entities": entities}
+
+
+def count_entities(results: dict) -> int:
+    """Number of entities in report results, whichever format they are stored in."""
+    if "entities_columnar" in results:
+        return results["entities_columnar"].get("count", len(results["entities_columnar"].get("label_ids", [])))
+    return len(results.get("entities", []))
+
+
+def expand_results(results: dict) -> dict:
+    """
+    Returns report results with columnar entities expanded to the row form,
+    so API consumers always see `results["entities"]` as a list.
+    """
+    if not isinstance(results, dict) or "entities_columnar" not in results:
+        return results
+    expanded = {key: value for key, value in results.items() if key != "entities_columnar"}
+    expanded["entities"] = to_rows(results["entities_columnar"])
+    return expanded
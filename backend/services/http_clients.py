@@ -0,0 +1,165 @@
+# app/services/http_clients.py
+
+import httpx
+from typing import Dict, List
+from core.config import settings
+
+# Read timeout of each AI service endpoint, in seconds. Connect and pool
+# timeouts come from the settings; None means no read timeout (streams).
+ENDPOINT_TIMEOUTS: Dict[str, Dict[str, float]] = {
+    "ner": {
+        "extract_entities": 30.0,
+        "extract_entities_stream": None,
+    },
+    "xray": {
+        "analyze": 60.0,
+        "compare": 90.0,
+        "compare_reports": 60.0,
+        "compare_with_baseline": 90.0,
+        "qna": 30.0,
+        "segmentation": 30.0,
+    },
+}
+
+# Long-lived clients by service name and replica, opened in the app lifespan
+_clients: Dict[str, Dict[int, httpx.AsyncClient]] = {}
+# Requests sent per service and replica, counted by a client event hook
+_request_counts: Dict[str, Dict[int, int]] = {}
+
+
+def _service_settings(service: str):
+    """Base URL(s) and Unix socket path of an AI service."""
+    if service == "ner":
+        return settings.NER_SERVICE_URL, settings.NER_SERVICE_URLS, settings.NER_SERVICE_UDS
+    if service == "xray":
+        return settings.XRAY_SERVICE_URL, settings.XRAY_SERVICE_URLS, settings.XRAY_SERVICE_UDS
+    raise ValueError(f"Unknown AI service '{service}'")
+
+
+def replica_urls(service: str) -> List[str]:
+    """The base URL of every replica of an AI service, in configured order."""
+    url, urls, _ = _service_settings(service)
+    replicas = [replica.strip().rstrip("/") for replica in urls.split(",") if replica.strip()]
+    return replicas or [url]
+
+
+def _build_client(service: str, replica: int) -> httpx.AsyncClient:
+    base_url = replica_urls(service)[replica]
+    # A Unix socket only makes sense for a single, co-located instance
+    uds = _service_settings(service)[2] if replica == 0 else ""
+    limits = httpx.Limits(
+        max_connections=settings.AI_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.AI_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=settings.AI_HTTP_KEEPALIVE_EXPIRY
+    )
+    http2 = settings.AI_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("AI_HTTP2 is set but the 'h2' package is not installed. Using HTTP/1.1.")
+            http2 = False
+    transport = httpx.AsyncHTTPTransport(limits=limits, http2=http2, uds=uds or None, retries=0)
+
+    async def count_request(request: httpx.Request):
+        counts = _request_counts.setdefault(service, {})
+        counts[replica] = counts.get(replica, 0) + 1
+
+    return httpx.AsyncClient(
+        base_url=base_url,
+        transport=transport,
+        timeout=timeout_for(service, None),
+        event_hooks={"request": [count_request]}
+    )
+
+
+async def start_clients():
+    """Opens the pooled client of every AI service replica. Called from the app lifespan."""
+    for service in ENDPOINT_TIMEOUTS:
+        for replica in range(len(replica_urls(service))):
+            get_client(service, replica)
+
+
+async def close_clients():
+    """Closes all pooled clients and their connections. Called from the app lifespan."""
+    while _clients:
+        _, replicas = _clients.popitem()
+        for client in replicas.values():
+            await client.aclose()
+
+
+def get_client(service: str, replica: int = 0) -> httpx.AsyncClient:
+    """
+    Returns the pooled client of an AI service replica.
+
+    The client is created on first use if the lifespan has not opened it
+    (e.g. in scripts such as debug_upload.py); such clients are closed by
+    `close_clients` like the others.
+
+    Args:
+        service (str): "ner" or "xray".
+        replica (int): Index into `replica_urls(service)`.
+    """
+    replicas = _clients.setdefault(service, {})
+    client = replicas.get(replica)
+    if client is None or client.is_closed:
+        client = replicas[replica] = _build_client(service, replica)
+    return client
+
+
+def timeout_for(service: str, endpoint: str) -> httpx.Timeout:
+    """
+    The timeout of one endpoint: its read timeout from `ENDPOINT_TIMEOUTS`,
+    with the configured connect and pool timeouts.
+    """
+    read = ENDPOINT_TIMEOUTS[service].get(endpoint, 30.0) if endpoint else 30.0
+    return httpx.Timeout(
+        connect=settings.AI_HTTP_CONNECT_TIMEOUT,
+        read=read,
+        write=read,
+        pool=settings.AI_HTTP_POOL_TIMEOUT
+    )
+
+
+def _pool_of(client: httpx.AsyncClient):
+    """The httpcore connection pool behind a client, if it can be reached."""
+    transport = getattr(client, "_transport", None)
+    return getattr(transport, "_pool", None)
+
+
+def pool_stats() -> dict:
+    """
+    Connection pool utilization of each open client.
+
+    Returns:
+        dict: Per service, a list with one entry per replica: connections
+              open, active and idle, requests queued for a connection, the
+              pool limits and requests sent.
+    """
+    stats = {}
+    for service, replicas in list(_clients.items()):
+        stats[service] = [_client_stats(service, replica, client) for replica, client in sorted(replicas.items())]
+    return stats
+
+
+def _client_stats(service: str, replica: int, client: httpx.AsyncClient) -> dict:
+    pool = _pool_of(client)
+    connections = list(getattr(pool, "connections", []) or [])
+    idle = sum(1 for connection in connections if connection.is_idle())
+    # httpcore tracks every request waiting for or holding a connection
+    pending = len(getattr(pool, "_requests", []) or [])
+    active = len(connections) - idle
+    return {
+        "replica": replica,
+        "base_url": str(client.base_url),
+        "closed": client.is_closed,
+        "connections": len(connections),
+        "active": active,
+        "idle": idle,
+        "waiting": max(0, pending - active),
+        "max_connections": settings.AI_HTTP_MAX_CONNECTIONS,
+        "max_keepalive": settings.AI_HTTP_MAX_KEEPALIVE,
+        "utilization": round(active / settings.AI_HTTP_MAX_CONNECTIONS, 4) if settings.AI_HTTP_MAX_CONNECTIONS else 0.0,
+        "http2": any(getattr(connection, "_connection", None).__class__.__name__.startswith("AsyncHTTP2") for connection in connections),
+        "requests_sent": _request_counts.get(service, {}).get(replica, 0),
+    }
@@ -0,0 +1,455 @@
+# app/services/ingestion.py
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import timedelta
+from typing import Callable, Optional, Union
+
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from db import crud, models, schemas
+from db.database import SessionLocal
+from services import entity_format, ner_service, pdf_extraction, uploads, xray_service
+
+logger = logging.getLogger(__name__)
+
+# Called with (stage, progress in [0, 1]) as an upload is processed
+ProgressCallback = Optional[Callable[[str, float], None]]
+
+
+class IngestionError(Exception):
+    """
+    An upload that can't be processed, with the HTTP status and detail the
+    synchronous endpoints answer with. Only retryable errors (the AI
+    service being unavailable) are retried by the job queue.
+    """
+    def __init__(self, status_code: int, detail, retryable: bool = False):
+        super().__init__(detail if isinstance(detail, str) else json.dumps(detail))
+        self.status_code = status_code
+        self.detail = detail
+        self.retryable = retryable
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _report_progress(on_progress: ProgressCallback, stage: str, progress: float):
+    if on_progress:
+        on_progress(stage, progress)
+
+
+async def ingest_report(
+    db: Session,
+    pdf_source: Union[bytes, str],
+    filename: str,
+    patient_id: int = None,
+    manual_details: dict = None,
+    checkpoint: dict = None,
+    on_checkpoint: Callable[[dict], None] = None,
+    on_progress: ProgressCallback = None,
+    ner_fallback: bool = True,
+    file_sha256: str = None
+) -> dict:
+    """
+    Processes a PDF report: text extraction, NER, patient assignment and storage.
+
+    Args:
+        pdf_source: The PDF as bytes, or the path of a spooled upload.
+        patient_id: Existing patient to attach the report to.
+        manual_details: Patient details given by the user ("name", "age",
+            "gender"); when set, the report is marked as manual input and a
+            new patient is created from them instead of from the text.
+        checkpoint: Steps done by an earlier attempt ("patient_id", "action",
+            "report_id"), so a retried job doesn't create duplicates.
+        on_checkpoint: Called with the checkpoint after each database write.
+        ner_fallback: Store the report without entities when the NER service
+            fails. When False, the failure is raised so the job can be retried.
+        file_sha256: SHA-256 of the uploaded file, stored with the results.
+
+    Returns:
+        dict: The upload response (status, action, patient and report ids, entity count).
+
+    Raises:
+        IngestionError: For PDFs without text or over the extraction time
+                        budget, an unknown patient or a name that can't be
+                        extracted (and NER failures without fallback).
+    """
+    checkpoint = dict(checkpoint or {})
+
+    def save_checkpoint(**steps):
+        checkpoint.update(steps)
+        if on_checkpoint:
+            on_checkpoint(dict(checkpoint))
+
+    # PDF parsing is CPU work; it runs in the extraction process pool
+    _report_progress(on_progress, "extracting_text", 0.1)
+    logger.info("Extracting text from PDF...")
+    try:
+        extracted_text = await pdf_extraction.extract_text(pdf_source)
+    except pdf_extraction.PdfExtractionTimeout as e:
+        raise IngestionError(422, str(e))
+    if not extracted_text.strip():
+        logger.warning("No text could be extracted from PDF")
+        raise IngestionError(400, "Could not extract text from PDF.")
+    logger.info(f"Extracted {len(extracted_text)} characters from PDF")
+
+    _report_progress(on_progress, "extracting_entities", 0.3)
+    logger.info("Calling NER service...")
+    try:
+        ner_response = await ner_service.call_ner_service(extracted_text)
+        entity_results = entity_format.entities_for_storage(ner_response)
+        entities_found = entity_format.count_entities(entity_results)
+        logger.info(f"NER service returned {entities_found} entities")
+    except Exception as ner_error:
+        logger.error(f"NER service error: {str(ner_error)}")
+        if not ner_fallback:
+            raise IngestionError(503, f"NER service unavailable: {ner_error}", retryable=True)
+        # Continue without NER results if service fails
+        entity_results = entity_format.entities_for_storage({"entities": []})
+        entities_found = 0
+        logger.warning("Continuing without NER results due to service error")
+
+    _report_progress(on_progress, "saving", 0.8)
+    if checkpoint.get("patient_id"):
+        # An earlier attempt already assigned the patient
+        db_patient = crud.get_patient(db, patient_id=checkpoint["patient_id"])
+        action_taken = checkpoint["action"]
+    elif patient_id:
+        # User specified a patient ID - use that patient
+        logger.info(f"Using specified patient ID: {patient_id}")
+        db_patient = crud.get_patient(db, patient_id=patient_id)
+        action_taken = "used_specified_patient"
+    elif manual_details:
+        # Use manually provided patient details to create new patient
+        db_patient = crud.create_patient(db, patient=schemas.PatientCreate(**manual_details))
+        action_taken = "created_new_patient"
+        logger.info(f"Created new patient with manual details: {db_patient.name} (ID: {db_patient.id})")
+    else:
+        # No patient ID provided - extract name and create new patient
+        logger.info("No patient ID provided, extracting name and creating new patient")
+        patient_details = crud.extract_patient_details_from_text(extracted_text)
+        logger.info(f"Extracted patient details: {patient_details}")
+
+        # Handle name extraction failure
+        if not patient_details.get("name"):
+            logger.warning("Could not extract patient name from report")
+            raise IngestionError(400, {
+                "status": "name_extraction_failed",
+                "message": "Could not extract patient name from document",
+                "action_required": "manual_name_input_or_patient_id",
+                "suggestion": "Use search-patients-by-name to find existing patients, or use upload-report-with-name endpoint",
+                "extracted_text_preview": extracted_text[:200] + "..." if len(extracted_text) > 200 else extracted_text
+            })
+
+        db_patient = crud.create_patient(db, patient=schemas.PatientCreate(**patient_details))
+        action_taken = "created_new_patient"
+        logger.info(f"Created new patient with ID: {db_patient.id}")
+
+    if not db_patient:
+        raise IngestionError(404, f"Patient with ID {checkpoint.get('patient_id') or patient_id} not found")
+    if not checkpoint.get("patient_id"):
+        save_checkpoint(patient_id=db_patient.id, action=action_taken)
+
+    report = crud.get_report(db, report_id=checkpoint["report_id"]) if checkpoint.get("report_id") else None
+    if report is None:
+        results = {**entity_results, "text_length": len(extracted_text)}
+        if manual_details:
+            results["manual_input"] = True
+        if file_sha256:
+            results["file_sha256"] = file_sha256
+        report_to_create = schemas.ReportCreate(
+            filename=filename,
+            report_type=models.ReportType.PDF_NER,
+            results=results
+        )
+        report = crud.create_report_for_patient(db, report=report_to_create, patient_id=db_patient.id)
+        logger.info(f"Created report with ID: {report.id}")
+        save_checkpoint(report_id=report.id)
+
+    response = {
+        "status": "success",
+        "action": action_taken,
+        "patient_id": db_patient.id,
+        "patient_name": db_patient.name,
+        "report_id": report.id,
+        "entities_found": entities_found
+    }
+    if manual_details:
+        response["manual_input_used"] = True
+    if file_sha256:
+        response["file_sha256"] = file_sha256
+    return response
+
+
+async def ingest_xray(
+    db: Session,
+    image_source: Union[bytes, str],
+    filename: str,
+    content_type: str,
+    patient_id: int,
+    on_progress: ProgressCallback = None
+) -> models.Report:
+    """
+    Analyzes an X-ray with the X-Ray service and stores the analysis as a report.
+
+    Args:
+        image_source: The image as bytes, or the path of a spooled upload,
+            read only for the duration of the call.
+
+    Raises:
+        IngestionError: 404 for an unknown patient, 503 (retryable) if the
+                        X-Ray service is unavailable.
+    """
+    if not crud.get_patient(db, patient_id=patient_id):
+        raise IngestionError(404, "Patient not found")
+
+    _report_progress(on_progress, "analyzing", 0.2)
+    image_bytes = image_source if isinstance(image_source, bytes) else await asyncio.to_thread(_read_file, image_source)
+    try:
+        analysis_result = await xray_service.call_xray_analyze_bytes(filename, image_bytes, content_type)
+    except Exception as e:
+        raise IngestionError(503, f"X-Ray Analysis Service unavailable: {e}", retryable=True)
+
+    _report_progress(on_progress, "saving", 0.8)
+    report_to_create = schemas.ReportCreate(
+        filename=filename,
+        report_type=models.ReportType.XRAY_ANALYSIS,
+        results=analysis_result
+    )
+    return crud.create_report_for_patient(db, report=report_to_create, patient_id=patient_id)
+
+
+class JobQueue:
+    """
+    Database-backed queue of uploads processed by a bounded pool of workers.
+
+    Jobs are rows of `ingestion_jobs`, so they survive restarts: a queued
+    job is picked up by whichever backend process polls first, and a job
+    whose worker stops heartbeating (crash, restart) is requeued after
+    INGESTION_LEASE_TIMEOUT. Failed attempts are retried with exponential
+    backoff up to the job's max attempts.
+    """
+    def __init__(self, workers: int, poll_interval: float, lease_timeout: float):
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self.lease_timeout = lease_timeout
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._wakeup = None
+        self._tasks = []
+
+    async def start(self):
+        """Starts the workers and the stale-job sweeper. Called from the app lifespan."""
+        self._wakeup = asyncio.Event()
+        self._requeue_stale()
+        self._tasks = [asyncio.create_task(self._work(f"{self.worker_prefix}:{index}")) for index in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweep()))
+
+    async def stop(self):
+        """
+        Stops the workers. Jobs they were running stay RUNNING with a stale
+        heartbeat and are requeued after the lease timeout.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(self, db: Session, kind: models.JobKind, upload: uploads.SpooledUpload,
+                params: dict, user_id: int) -> models.IngestionJob:
+        """
+        Stores a new job and wakes an idle worker.
+
+        The spooled upload is moved to INGESTION_PAYLOAD_DIR and owned by the
+        job from then on; only its path is stored in the database.
+        """
+        job_id = uuid.uuid4().hex
+        suffix = os.path.splitext(upload.filename or "")[1]
+        payload_path = upload.move_to(os.path.join(settings.INGESTION_PAYLOAD_DIR, job_id + suffix))
+        try:
+            job = crud.create_ingestion_job(
+                db,
+                job_id=job_id,
+                kind=kind,
+                filename=upload.filename,
+                content_type=upload.content_type,
+                payload_path=payload_path,
+                params=params,
+                user_id=user_id,
+                max_attempts=settings.INGESTION_MAX_ATTEMPTS
+            )
+        except BaseException:
+            _discard_payload(payload_path)
+            raise
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    def _requeue_stale(self):
+        db = SessionLocal()
+        try:
+            stale_before = models.get_ist_now() - timedelta(seconds=self.lease_timeout)
+            requeued = crud.requeue_stale_ingestion_jobs(db, stale_before)
+            if requeued:
+                logger.warning(f"Requeued {requeued} interrupted ingestion job(s)")
+        finally:
+            db.close()
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.lease_timeout / 2)
+            try:
+                self._requeue_stale()
+            except Exception as e:
+                logger.error(f"Failed to requeue stale ingestion jobs: {e}")
+
+    async def _work(self, worker_id: str):
+        while True:
+            try:
+                db = SessionLocal()
+                try:
+                    job = crud.claim_next_ingestion_job(db, worker_id)
+                finally:
+                    db.close()
+            except Exception as e:
+                logger.error(f"Failed to claim an ingestion job: {e}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            await self._run(job.id)
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.lease_timeout / 4)
+            db = SessionLocal()
+            try:
+                crud.update_ingestion_job(db, job_id, heartbeat_at=models.get_ist_now())
+            finally:
+                db.close()
+
+    async def _run(self, job_id: str):
+        """Runs one claimed job and records its outcome."""
+        db = SessionLocal()
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            job = crud.get_ingestion_job(db, job_id)
+
+            def on_progress(stage: str, progress: float):
+                crud.update_ingestion_job(db, job_id, stage=stage, progress=progress, heartbeat_at=models.get_ist_now())
+
+            logger.info(f"Running ingestion job {job_id} ({job.kind.value}), attempt {job.attempts}/{job.max_attempts}")
+            try:
+                result = await self._execute(db, job, on_progress)
+            except Exception as e:
+                db.rollback()
+                self._record_failure(db, job, e)
+                return
+
+            payload_path = job.payload_path
+            crud.update_ingestion_job(
+                db, job_id,
+                status=models.JobStatus.SUCCEEDED,
+                stage="done",
+                progress=1.0,
+                result=result,
+                payload_path=None,
+                finished_at=models.get_ist_now()
+            )
+            _discard_payload(payload_path)
+            logger.info(f"Ingestion job {job_id} succeeded")
+        finally:
+            heartbeat.cancel()
+            db.close()
+
+    async def _execute(self, db: Session, job: models.IngestionJob, on_progress) -> dict:
+        params = job.params or {}
+        if job.kind == models.JobKind.REPORT_UPLOAD:
+            return await ingest_report(
+                db,
+                job.payload_path,
+                job.filename,
+                patient_id=params.get("patient_id"),
+                manual_details=params.get("manual_details"),
+                checkpoint=job.checkpoint,
+                on_checkpoint=lambda checkpoint: crud.update_ingestion_job(db, job.id, checkpoint=checkpoint),
+                on_progress=on_progress,
+                # Retry NER outages; only the last attempt stores the report without entities
+                ner_fallback=job.attempts >= job.max_attempts
+            )
+        if job.kind == models.JobKind.XRAY_ANALYSIS:
+            report = await ingest_xray(db, job.payload_path, job.filename, job.content_type, params["patient_id"], on_progress)
+            return schemas.Report.model_validate(report).model_dump(mode="json")
+        raise IngestionError(400, f"Unknown job kind {job.kind}")
+
+    def _record_failure(self, db: Session, job: models.IngestionJob, error: Exception):
+        retryable = not isinstance(error, IngestionError) or error.retryable
+        if retryable and job.attempts < job.max_attempts:
+            delay = settings.INGESTION_RETRY_BACKOFF * (2 ** (job.attempts - 1))
+            logger.warning(f"Ingestion job {job.id} attempt {job.attempts} failed ({error}); retrying in {delay:.0f}s")
+            crud.update_ingestion_job(
+                db, job.id,
+                status=models.JobStatus.QUEUED,
+                stage="retry_scheduled",
+                worker_id=None,
+                error=str(error),
+                run_after=models.get_ist_now() + timedelta(seconds=delay)
+            )
+            return
+
+        logger.error(f"Ingestion job {job.id} failed: {error}")
+        payload_path = job.payload_path
+        crud.update_ingestion_job(
+            db, job.id,
+            status=models.JobStatus.FAILED,
+            stage="failed",
+            error=str(error),
+            result={
+                "status_code": error.status_code if isinstance(error, IngestionError) else 500,
+                "detail": error.detail if isinstance(error, IngestionError) else f"Internal server error: {error}"
+            },
+            payload_path=None,
+            finished_at=models.get_ist_now()
+        )
+        _discard_payload(payload_path)
+
+
+def _discard_payload(path: Optional[str]):
+    """Deletes a job's file once the job no longer needs it."""
+    if not path:
+        return
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not delete ingestion payload {path}: {e}")
+
+
+def accepted(job: models.IngestionJob) -> dict:
+    """The 202 response for a queued upload, with where to follow it."""
+    return schemas.IngestionJobAccepted(
+        job_id=job.id,
+        status=job.status,
+        status_url=f"{settings.API_V1_STR}/jobs/{job.id}",
+        result_url=f"{settings.API_V1_STR}/jobs/{job.id}/result",
+        events_url=f"{settings.API_V1_STR}/jobs/{job.id}/events"
+    ).model_dump(mode="json")
+
+
+job_queue = JobQueue(
+    workers=settings.INGESTION_WORKERS,
+    poll_interval=settings.INGESTION_POLL_INTERVAL,
+    lease_timeout=settings.INGESTION_LEASE_TIMEOUT
+)
@@ -1,7 +1,32 @@
 # app/services/ner_service.py
 
+import json
+from contextlib import aclosing
 import httpx
+from typing import AsyncIterator, Awaitable, Callable, Optional
 from core.config import settings
+from services import entity_format
+from services import resilience
+from services.http_clients import timeout_for
+
+try:
+    import msgpack
+except ImportError:  # Optional: only needed for NER_WIRE_FORMAT=msgpack
+    msgpack = None
+
+def _accept_header() -> str:
+    """Accept header for the configured NER wire format."""
+    if settings.NER_WIRE_FORMAT == "msgpack" and msgpack is not None:
+        return f"{entity_format.COLUMNAR_MSGPACK_MEDIA_TYPE}, application/json;q=0.5"
+    if settings.NER_WIRE_FORMAT in ("columnar", "msgpack"):
+        return f"{entity_format.COLUMNAR_JSON_MEDIA_TYPE}, application/json;q=0.5"
+    return "application/json"
+
+def _decode_response(response: httpx.Response) -> dict:
+    """Decodes a NER response in whichever format the service chose."""
+    if response.headers.get("content-type", "").startswith(entity_format.COLUMNAR_MSGPACK_MEDIA_TYPE):
+        return msgpack.unpackb(response.content, raw=False)
+    return response.json()
 
 async def call_ner_service(text: str) -> dict:
     """
@@ -11,32 +36,121 @@ async def call_ner_service(text: str) -> dict:
         text (str): The text content to be analyzed.
 
     Returns:
-        dict: The JSON response from the NER service, typically containing a list of entities.
+        dict: The response from the NER service: {"entities": [...]} or, when
+              a compact NER_WIRE_FORMAT is configured and supported by the
+              service, {"entities_columnar": {...}}. Use
+              `entity_format.entities_for_storage` to handle either.
     
     Raises:
         Exception: If the service call fails or returns a non-200 status code.
     """
-    # Use an async HTTP client to make the request
-    async with httpx.AsyncClient() as client:
-        try:
-            # Make a POST request to the URL defined in your settings
-            response = await client.post(
-                f"{settings.NER_SERVICE_URL}/extract_entities",
+    try:
+        # POST over the shared, pooled client, with retries, a circuit
+        # breaker and hedging across replicas. Hedging is kept here: NER is
+        # one encoder pass per window, far cheaper than an X-ray analysis,
+        # and a stuck replica would otherwise hold the upload for the whole
+        # read timeout. The hedging budget bounds the duplicated work.
+        response = await resilience.request(
+            "ner",
+            "extract_entities",
+            lambda client: client.post(
+                "/extract_entities",
                 json={"text": text},
-                timeout=30.0  # Set a reasonable timeout
-            )
-            
-            # Raise an exception for bad status codes (4xx or 5xx)
+                headers={"Accept": _accept_header()},
+                timeout=timeout_for("ner", "extract_entities")
+            ),
+            retry=True,
+            hedge=True
+        )
+        
+        # Raise an exception for bad status codes (4xx or 5xx)
+        response.raise_for_status()
+        
+        return _decode_response(response)
+        
+    except httpx.RequestError as e:
+        # Handle network-related errors
+        print(f"An error occurred while requesting {e.request.url!r}.")
+        raise Exception(f"Could not connect to NER service: {e}")
+    except httpx.HTTPStatusError as e:
+        # Handle non-200 responses
+        print(f"Error response {e.response.status_code} while requesting {e.request.url!r}.")
+        raise Exception(f"NER service returned an error: {e.response.text}")
+
+
+async def stream_ner_entities(text: str) -> AsyncIterator[dict]:
+    """
+    Streams entity chunks from the NER service as they are produced.
+
+    The service answers with newline-delimited JSON. Each chunk looks like
+    {"chunk", "total_chunks", "chars_processed", "total_chars", "entities"},
+    with entity offsets into `text`, and the stream ends with a
+    {"done": True, "entity_count": ...} event.
+
+    Args:
+        text (str): The text content to be analyzed.
+
+    Yields:
+        dict: Each chunk event, followed by the final "done" event.
+
+    Raises:
+        Exception: If the service call fails, returns a non-200 status code,
+                   or reports an error in the middle of the stream.
+    """
+    # No read timeout between chunks of a long document; connecting and
+    # waiting for a pooled connection are still bounded. A stream can't be
+    # retried once events were yielded, but it still fails fast while the
+    # service's circuit breaker is open.
+    try:
+        async with resilience.guarded("ner") as client, client.stream(
+            "POST",
+            "/extract_entities_stream",
+            json={"text": text},
+            headers={"Accept": "application/x-ndjson"},
+            timeout=timeout_for("ner", "extract_entities_stream")
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
             response.raise_for_status()
-            
-            return response.json()
-            
-        except httpx.RequestError as e:
-            # Handle network-related errors
-            print(f"An error occurred while requesting {e.request.url!r}.")
-            raise Exception(f"Could not connect to NER service: {e}")
-        except httpx.HTTPStatusError as e:
-            # Handle non-200 responses
-            print(f"Error response {e.response.status_code} while requesting {e.request.url!r}.")
-            raise Exception(f"NER service returned an error: {e.response.text}")
 
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if "error" in event:
+                    raise Exception(f"NER service failed mid-stream: {event['error']}")
+                yield event
+
+    except httpx.RequestError as e:
+        print(f"An error occurred while requesting {e.request.url!r}.")
+        raise Exception(f"Could not connect to NER service: {e}")
+    except httpx.HTTPStatusError as e:
+        print(f"Error response {e.response.status_code} while requesting {e.request.url!r}.")
+        raise Exception(f"NER service returned an error: {e.response.text}")
+
+async def call_ner_service_streaming(
+    text: str,
+    on_chunk: Optional[Callable[[dict], Awaitable[None]]] = None
+) -> dict:
+    """
+    Consumes the NER stream and returns the same shape as `call_ner_service`.
+
+    Args:
+        text (str): The text content to be analyzed.
+        on_chunk: Optional async callback invoked with every chunk as soon as
+                  it arrives, e.g. to persist or forward partial results.
+
+    Returns:
+        dict: {"entities": [...]} with all entities in document order.
+    """
+    entities = []
+    # aclosing ends the stream (and returns its pooled connection) as soon
+    # as we stop reading, not whenever the generator is garbage-collected
+    async with aclosing(stream_ner_entities(text)) as events:
+        async for event in events:
+            if event.get("done"):
+                break
+            entities.extend(event.get("entities", []))
+            if on_chunk:
+                await on_chunk(event)
+    return {"entities": entities}
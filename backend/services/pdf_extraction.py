@@ -0,0 +1,196 @@
+# app/services/pdf_extraction.py
+
+import asyncio
+import io
+import mmap
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import List, Optional, Union
+
+import pdfplumber
+from core.config import settings
+
+# Worker processes for PDF parsing, started in the app lifespan
+_pool: Optional[ProcessPoolExecutor] = None
+# Incremented whenever the pool is killed and replaced
+_generation = 0
+_stats = {"documents": 0, "pages": 0, "timeouts": 0, "pool_restarts": 0, "seconds": 0.0}
+
+
+class PdfExtractionTimeout(Exception):
+    """Raised when a document's text extraction exceeds PDF_EXTRACT_TIMEOUT."""
+
+
+# --- Worker-side functions (run in the pool's processes) ---
+
+@contextmanager
+def _open_pdf(source: Union[bytes, str]):
+    """
+    Opens a PDF given as bytes or as a file path. Files are parsed through
+    a read-only memory map, so pages are read from the page cache on demand
+    and every worker shares the same physical memory.
+    """
+    if isinstance(source, bytes):
+        with pdfplumber.open(io.BytesIO(source)) as pdf:
+            yield pdf
+        return
+    with open(source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        with pdfplumber.open(buffer) as pdf:
+            yield pdf
+
+
+def _count_pages(source: Union[bytes, str]) -> int:
+    with _open_pdf(source) as pdf:
+        return len(pdf.pages)
+
+
+def _extract_page_range(source: Union[bytes, str], start: int, end: int) -> List[str]:
+    """Text of pages [start, end) of a PDF, one string per page."""
+    with _open_pdf(source) as pdf:
+        texts = []
+        for page in pdf.pages[start:end]:
+            texts.append(page.extract_text() or "")
+            # Parsed page objects hold a lot of memory; release them as we go
+            page.close()
+        return texts
+
+
+# --- Pool management ---
+
+def start_pool():
+    """Starts the extraction processes. Called from the app lifespan."""
+    global _pool
+    if _pool is None:
+        # "spawn" rather than fork: the server process runs threads (the
+        # event loop's executors, HTTP clients) that must not be forked
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.PDF_EXTRACT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+
+def shutdown_pool():
+    """Stops the extraction processes. Called from the app lifespan."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _kill_pool():
+    """
+    Terminates the extraction processes and starts new ones. Tasks still
+    running can't be cancelled any other way; documents sharing the old
+    pool fail with BrokenProcessPool and are retried on the new one.
+    """
+    global _pool, _generation
+    pool, _pool = _pool, None
+    _generation += 1
+    _stats["pool_restarts"] += 1
+    if pool is not None:
+        # ProcessPoolExecutor has no public way to stop a running task
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+    start_pool()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    # Started on first use when there is no lifespan (e.g. scripts)
+    if _pool is None:
+        start_pool()
+    return _pool
+
+
+def page_ranges(page_count: int, pages_per_task: int) -> List[tuple]:
+    """Splits [0, page_count) into consecutive ranges of at most `pages_per_task` pages."""
+    pages_per_task = max(1, pages_per_task)
+    return [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+
+
+async def extract_text(source: Union[bytes, str], timeout: float = None) -> str:
+    """
+    Extracts the text of a PDF in worker processes, never on the event loop.
+
+    Pass a file path (e.g. a spooled upload) rather than bytes where
+    possible: only the path is sent to each worker, instead of a copy of
+    the document per page range.
+
+    Large documents are split into ranges of PDF_PAGES_PER_TASK pages that
+    are extracted in parallel and reassembled in page order. The result is
+    the same as joining `page.extract_text()` over all pages.
+
+    The budget bounds CPU use as well as waiting: on timeout the worker
+    processes are killed and replaced, so a pathological PDF can't keep
+    them busy and starve later uploads.
+
+    Args:
+        source (bytes or str): The PDF file, or its path.
+        timeout (float, optional): Time budget for the whole document, in
+            seconds. Defaults to PDF_EXTRACT_TIMEOUT.
+
+    Returns:
+        str: The text of all pages, in order.
+
+    Raises:
+        PdfExtractionTimeout: If the document takes longer than the budget.
+        Exception: Whatever pdfplumber raises for an unreadable PDF.
+    """
+    timeout = settings.PDF_EXTRACT_TIMEOUT if timeout is None else timeout
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+
+    async def run(pool: ProcessPoolExecutor):
+        page_count = await loop.run_in_executor(pool, _count_pages, source)
+        futures = [
+            loop.run_in_executor(pool, _extract_page_range, source, start, end)
+            for start, end in page_ranges(page_count, settings.PDF_PAGES_PER_TASK)
+        ]
+        # gather keeps the submission (page) order
+        chunks = await asyncio.gather(*futures)
+        return page_count, "".join(text for chunk in chunks for text in chunk)
+
+    while True:
+        generation, pool = _generation, _get_pool()
+        remaining = timeout - (time.monotonic() - started)
+        try:
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            page_count, text = await asyncio.wait_for(run(pool), timeout=remaining)
+            break
+        except asyncio.TimeoutError:
+            _stats["timeouts"] += 1
+            # Queued ranges were cancelled by wait_for; running ones only stop
+            # with their process. Skip if the pool was already replaced.
+            if generation == _generation and remaining > 0:
+                _kill_pool()
+            raise PdfExtractionTimeout(f"PDF text extraction took longer than {timeout:.0f} seconds.")
+        except BrokenProcessPool:
+            if generation == _generation:
+                # A worker crashed on this document; replace the broken pool
+                _kill_pool()
+                raise
+            # Killed because of another document; run again on the new pool
+
+    _stats["documents"] += 1
+    _stats["pages"] += page_count
+    _stats["seconds"] += time.monotonic() - started
+    return text
+
+
+def pool_stats() -> dict:
+    """Extraction counters: documents, pages, timeouts and average seconds per document."""
+    documents = _stats["documents"]
+    return {
+        "workers": settings.PDF_EXTRACT_WORKERS,
+        "pages_per_task": settings.PDF_PAGES_PER_TASK,
+        "running": _pool is not None,
+        "documents": documents,
+        "pages": _stats["pages"],
+        "timeouts": _stats["timeouts"],
+        "pool_restarts": _stats["pool_restarts"],
+        "avg_seconds_per_document": round(_stats["seconds"] / documents, 3) if documents else 0.0,
+    }
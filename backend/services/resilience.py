@@ -0,0 +1,389 @@
+# app/services/resilience.py
+
+import asyncio
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List
+
+import httpx
+from core.config import settings
+from services.http_clients import get_client, replica_urls
+
+# Statuses worth another attempt: the service shed load or a proxy in
+# front of it failed. Other 4xx/5xx answers are returned as they are.
+RETRY_STATUSES = {429, 502, 503, 504}
+# Statuses that count against a replica's circuit breaker. 429 does not:
+# an overloaded service is up and says when to come back.
+FAILURE_STATUSES = {500, 502, 503, 504}
+# Latencies kept per endpoint to estimate the hedging delay
+LATENCY_WINDOW = 200
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a service whose replicas are all failing."""
+    def __init__(self, service: str, retry_after: float):
+        super().__init__(f"{service} service is unavailable (circuit open, retry in {retry_after:.0f}s)")
+        self.service = service
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one service replica.
+
+    Closed: calls go through. After `failure_threshold` consecutive failures
+    it opens and calls fail fast. After `reset_timeout` seconds it is
+    half-open: a single probe call is let through, and its outcome closes or
+    re-opens the breaker. Only used from the event loop, so it needs no lock.
+    """
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.total_failures = 0
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def available(self) -> bool:
+        """Whether a call could go through now (without claiming the half-open probe)."""
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self.probing)
+
+    def allow(self) -> bool:
+        """Claims permission for one call; in half-open state only the first caller gets it."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.total_failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self.probing:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def release(self):
+        """Gives back a probe that ended without an outcome (e.g. a cancelled hedge)."""
+        self.probing = False
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "total_failures": self.total_failures,
+            "times_opened": self.times_opened,
+            "retry_after": round(self.retry_after(), 1),
+        }
+
+
+# Breakers by service, one per replica URL
+_breakers: Dict[str, List[CircuitBreaker]] = {}
+# Recent successful latencies by (service, endpoint), for the hedging delay
+_latencies: Dict[tuple, deque] = {}
+# Round-robin position per service
+_next_replica: Dict[str, int] = {}
+_hedges_sent: Dict[str, int] = {}
+_hedges_won: Dict[str, int] = {}
+_hedges_denied: Dict[str, int] = {}
+# Hedging budget tokens per service, see AI_HEDGE_BUDGET_RATIO
+_hedge_tokens: Dict[str, float] = {}
+_retries: Dict[str, int] = {}
+
+
+def breakers(service: str) -> List[CircuitBreaker]:
+    if service not in _breakers:
+        _breakers[service] = [
+            CircuitBreaker(url, settings.AI_BREAKER_FAILURE_THRESHOLD, settings.AI_BREAKER_RESET_TIMEOUT)
+            for url in replica_urls(service)
+        ]
+    return _breakers[service]
+
+
+def _pick_replicas(service: str) -> List[int]:
+    """Replicas whose breaker lets a call through, starting at the round-robin position."""
+    service_breakers = breakers(service)
+    start = _next_replica.get(service, 0)
+    _next_replica[service] = (start + 1) % len(service_breakers)
+    order = [(start + offset) % len(service_breakers) for offset in range(len(service_breakers))]
+    candidates = [replica for replica in order if service_breakers[replica].available()]
+    if not candidates:
+        raise CircuitOpen(service, min(breaker.retry_after() for breaker in service_breakers))
+    return candidates
+
+
+def _hedge_delay(service: str, endpoint: str) -> float:
+    """Seconds to wait before hedging: the endpoint's recent p95 latency, with a floor."""
+    floor = settings.AI_HEDGE_MIN_DELAY_MS / 1000.0
+    window = _latencies.get((service, endpoint))
+    if not window or len(window) < 20:
+        # Too few samples; don't hedge before a call is clearly slow
+        return max(floor, 1.0)
+    ordered = sorted(window)
+    return max(floor, ordered[int(0.95 * (len(ordered) - 1))])
+
+
+def _earn_hedge_token(service: str):
+    tokens = _hedge_tokens.get(service, 0.0) + settings.AI_HEDGE_BUDGET_RATIO
+    _hedge_tokens[service] = min(tokens, settings.AI_HEDGE_BUDGET_BURST)
+
+
+def _take_hedge_token(service: str) -> bool:
+    """Spends one hedging token if the service's budget has one."""
+    if _hedge_tokens.get(service, 0.0) < 1.0:
+        return False
+    _hedge_tokens[service] -= 1.0
+    return True
+
+
+def _backoff(attempt: int, retry_after: float = None) -> float:
+    """Exponential backoff with full jitter, or the service's Retry-After when it gave one."""
+    if retry_after is not None:
+        return min(retry_after, settings.AI_RETRY_BACKOFF_MAX)
+    return random.uniform(0, min(settings.AI_RETRY_BACKOFF_MAX, settings.AI_RETRY_BACKOFF_BASE * (2 ** attempt)))
+
+
+def _retry_after(response: httpx.Response):
+    value = response.headers.get("retry-after", "")
+    return float(value) if value.replace(".", "", 1).isdigit() else None
+
+
+async def _send_to(service: str, replica: int, endpoint: str, send) -> httpx.Response:
+    """One call to one replica, recorded by its breaker."""
+    breaker = breakers(service)[replica]
+    if not breaker.allow():
+        raise CircuitOpen(service, breaker.retry_after())
+    started = time.monotonic()
+    try:
+        response = await send(get_client(service, replica))
+    except httpx.RequestError:
+        breaker.record_failure()
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+    if response.status_code in FAILURE_STATUSES:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+        if response.status_code < 400:
+            _latencies.setdefault((service, endpoint), deque(maxlen=LATENCY_WINDOW)).append(time.monotonic() - started)
+    return response
+
+
+async def _send_hedged(service: str, replicas: List[int], endpoint: str, send) -> httpx.Response:
+    """
+    Sends to the first replica and, if it hasn't answered within the hedge
+    delay, to the second as well. The first usable answer wins and the
+    other call is cancelled. Without a hedging token left, the first call
+    is simply awaited, so hedging can't pile load onto an overloaded service.
+    """
+    first = asyncio.create_task(_send_to(service, replicas[0], endpoint, send))
+    pending = {first}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=_hedge_delay(service, endpoint))
+        if done:
+            return first.result()
+        if not _take_hedge_token(service):
+            _hedges_denied[service] = _hedges_denied.get(service, 0) + 1
+            return await first
+
+        _hedges_sent[service] = _hedges_sent.get(service, 0) + 1
+        second = asyncio.create_task(_send_to(service, replicas[1], endpoint, send))
+        pending = {first, second}
+        outcome = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and task.result().status_code not in RETRY_STATUSES:
+                    if task is second:
+                        _hedges_won[service] = _hedges_won.get(service, 0) + 1
+                    return task.result()
+                outcome = task
+        # Both failed; surface the last failure to the retry loop
+        return outcome.result()
+    finally:
+        # Also covers the caller being cancelled while a call is in flight
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def request(
+    service: str,
+    endpoint: str,
+    send: Callable[[httpx.AsyncClient], Awaitable[httpx.Response]],
+    retry: bool = False,
+    hedge: bool = False
+) -> httpx.Response:
+    """
+    Calls an AI service through its circuit breakers, with retries and hedging.
+
+    With `retry`, connection errors and 429/502/503/504 answers are retried up to
+    AI_RETRY_ATTEMPTS times with jittered backoff, moving to the next
+    replica each time. Read timeouts are not retried: a stalled service
+    would only be waited on again. Other answers (including 4xx) are
+    returned for the caller to handle as before.
+
+    Args:
+        service (str): "ner" or "xray".
+        endpoint (str): Endpoint name, used for latency tracking.
+        send: Makes the call with the given client, e.g.
+              `lambda client: client.post("/qna", json=payload)`.
+              It may run several times, so its body must be re-sendable.
+        retry (bool): Retry transient failures. Opt-in, for idempotent
+              calls only: a 502/504 or a reset connection may come after
+              the service did the work, e.g. a billed Gemini call.
+        hedge (bool): Hedge slow calls across replicas. Only for idempotent
+              calls whose duplicate is affordable, since a hedged call may
+              run twice; AI_HEDGE_BUDGET_RATIO bounds how often that happens.
+
+    Raises:
+        CircuitOpen: If every replica's breaker is open.
+        httpx.RequestError: If the last attempt failed to connect or timed out.
+    """
+    attempts = 1 + (max(0, settings.AI_RETRY_ATTEMPTS) if retry else 0)
+    if hedge:
+        _earn_hedge_token(service)
+    retry_after = None
+    for attempt in range(attempts):
+        if attempt:
+            _retries[service] = _retries.get(service, 0) + 1
+            await asyncio.sleep(_backoff(attempt, retry_after))
+        replicas = _pick_replicas(service)
+        last_attempt = attempt == attempts - 1
+        try:
+            if hedge and settings.AI_HEDGE_ENABLED and len(replicas) > 1:
+                response = await _send_hedged(service, replicas, endpoint, send)
+            else:
+                response = await _send_to(service, replicas[0], endpoint, send)
+        except (httpx.ReadTimeout, httpx.WriteTimeout):
+            raise
+        except httpx.RequestError as e:
+            if last_attempt:
+                raise
+            print(f"{service} {endpoint} attempt {attempt + 1} failed ({e!r}); retrying.")
+            retry_after = None
+            continue
+
+        if response.status_code in RETRY_STATUSES and not last_attempt:
+            print(f"{service} {endpoint} attempt {attempt + 1} returned {response.status_code}; retrying.")
+            retry_after = _retry_after(response)
+            continue
+        return response
+
+
+async def request_to(
+    service: str,
+    replica_url: str,
+    endpoint: str,
+    send: Callable[[httpx.AsyncClient], Awaitable[httpx.Response]]
+) -> httpx.Response:
+    """
+    Calls one specific replica, through its breaker but without retries or
+    failover: for state that only that replica holds (e.g. the activation
+    maps of an analysis it ran). Another replica could only answer 404.
+
+    Raises:
+        ValueError: If `replica_url` is not a configured replica of the service.
+        CircuitOpen: If the replica's breaker is open.
+        httpx.RequestError: If the call failed to connect or timed out.
+    """
+    urls = replica_urls(service)
+    if replica_url not in urls:
+        raise ValueError(f"{replica_url} is not a configured {service} replica")
+    return await _send_to(service, urls.index(replica_url), endpoint, send)
+
+
+def replica_of(service: str, response: httpx.Response) -> str:
+    """The base URL of the replica that sent a response, or None if it isn't a configured one."""
+    url = str(response.request.url)
+    return next((base for base in replica_urls(service) if url.startswith(base + "/")), None)
+
+
+@asynccontextmanager
+async def guarded(service: str) -> AsyncIterator[httpx.AsyncClient]:
+    """
+    Yields a client for a call that can't be retried or hedged (a stream),
+    still failing fast while the service's breakers are open and recording
+    the outcome. A consumer closing the stream early (GeneratorExit) counts
+    as a success, and any other error raised in the block, such as a
+    failure the service reports mid-stream, as a failure.
+
+    Raises:
+        CircuitOpen: If every replica's breaker is open.
+    """
+    replica = _pick_replicas(service)[0]
+    breaker = breakers(service)[replica]
+    if not breaker.allow():
+        raise CircuitOpen(service, breaker.retry_after())
+    try:
+        yield get_client(service, replica)
+    except httpx.RequestError:
+        breaker.record_failure()
+        raise
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code in FAILURE_STATUSES:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    except GeneratorExit:
+        # The consumer stopped reading a stream the service was answering
+        breaker.record_success()
+        raise
+    except Exception:
+        breaker.record_failure()
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+    breaker.record_success()
+
+
+def breaker_stats() -> dict:
+    """Breaker state of every replica, with retry and hedging counters, by service."""
+    stats = {}
+    for service in ("ner", "xray"):
+        service_breakers = breakers(service)
+        states = {b.state for b in service_breakers}
+        # The service is as healthy as its healthiest replica
+        state = next(state for state in ("closed", "half_open", "open") if state in states)
+        stats[service] = {
+            "state": state,
+            "replicas": [{"url": b.name, **b.snapshot()} for b in service_breakers],
+            "retries": _retries.get(service, 0),
+            "hedges_sent": _hedges_sent.get(service, 0),
+            "hedges_won": _hedges_won.get(service, 0),
+            "hedges_denied": _hedges_denied.get(service, 0),
+            "hedge_tokens": round(_hedge_tokens.get(service, 0.0), 2),
+        }
+    return stats
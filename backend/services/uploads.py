@@ -0,0 +1,110 @@
+# app/services/uploads.py
+
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+from fastapi import UploadFile
+from core.config import settings
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds MAX_UPLOAD_MB. Mapped to HTTP 413."""
+
+
+class SpooledUpload:
+    """
+    An upload copied to a named temporary file, with its size and SHA-256.
+
+    The file has a path, so worker processes can open (and memory-map) it
+    without the document being pickled to them. Use as a context manager,
+    or call `close`, to delete it.
+    """
+    def __init__(self, path: str, size: int, sha256: str, filename: str, content_type: str):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.filename = filename
+        self.content_type = content_type
+
+    def move_to(self, path: str) -> str:
+        """
+        Hands the file over to a new owner (e.g. a background job) at `path`.
+        It is no longer deleted by `close`.
+
+        Returns:
+            str: The new path.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # A rename when both are on the same file system, a copy otherwise
+        shutil.move(self.path, path)
+        self.path = None
+        return path
+
+    def close(self):
+        if self.path is None:
+            return
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def max_upload_bytes() -> int:
+    return settings.MAX_UPLOAD_MB * 1024 * 1024
+
+
+async def spool_upload(file: UploadFile, max_bytes: Optional[int] = None, suffix: str = "") -> SpooledUpload:
+    """
+    Streams an upload into a size-capped temporary file, hashing it on the fly.
+
+    The upload is copied in UPLOAD_CHUNK_KB chunks, so memory use is one
+    chunk regardless of the file size, and the copy stops as soon as the
+    limit is passed. (Requests whose Content-Length is over the limit are
+    already rejected by middleware before the body is read.)
+
+    Args:
+        file (UploadFile): The uploaded file.
+        max_bytes (int, optional): Size limit. Defaults to MAX_UPLOAD_MB.
+        suffix (str): Suffix of the temporary file name, e.g. ".pdf".
+
+    Raises:
+        UploadTooLarge: If the file is larger than the limit.
+        ValueError: If the file is empty.
+    """
+    max_bytes = max_upload_bytes() if max_bytes is None else max_bytes
+    chunk_size = max(1, settings.UPLOAD_CHUNK_KB) * 1024
+    digest = hashlib.sha256()
+    size = 0
+
+    spool = tempfile.NamedTemporaryFile(prefix="upload-", suffix=suffix, dir=settings.UPLOAD_SPOOL_DIR or None, delete=False)
+    try:
+        with spool:
+            while True:
+                chunk = await file.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"File is larger than {settings.MAX_UPLOAD_MB} MB.")
+                digest.update(chunk)
+                # Disk writes go to a thread so a slow disk can't stall the event loop
+                await asyncio.to_thread(spool.write, chunk)
+        if size == 0:
+            raise ValueError("The uploaded file is empty.")
+    except BaseException:
+        os.unlink(spool.name)
+        raise
+    finally:
+        await file.close()
+
+    return SpooledUpload(spool.name, size, digest.hexdigest(), file.filename, file.content_type)
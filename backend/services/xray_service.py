@@ -2,24 +2,42 @@
 
 import httpx
 from fastapi import UploadFile
-from core.config import settings
+from services import resilience
+from services.http_clients import timeout_for
 
 async def call_xray_analyze(file: UploadFile) -> dict:
     """Calls the external X-Ray AI service to analyze a single image."""
-    files = {'file': (file.filename, await file.read(), file.content_type)}
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{settings.XRAY_SERVICE_URL}/analyze",
+    return await call_xray_analyze_bytes(file.filename, await file.read(), file.content_type)
+
+async def call_xray_analyze_bytes(filename: str, content: bytes, content_type: str) -> dict:
+    """
+    Calls the external X-Ray AI service to analyze a single image given as bytes.
+
+    The result also records, as "xray_replica", the base URL of the replica
+    that ran the analysis: its activation maps are only held there.
+    """
+    files = {'file': (filename, content, content_type)}
+    try:
+        # Not hedged: a duplicate would run DenseNet and BiomedCLIP again,
+        # just when a replica is already slow
+        response = await resilience.request(
+            "xray",
+            "analyze",
+            lambda client: client.post(
+                "/analyze",
                 files=files,
-                timeout=60.0 # Analysis may take longer
-            )
-            response.raise_for_status()
-            return response.json()
-        except httpx.RequestError as e:
-            raise Exception(f"Could not connect to X-Ray service: {e}")
-        except httpx.HTTPStatusError as e:
-            raise Exception(f"X-Ray service returned an error: {e.response.text}")
+                timeout=timeout_for("xray", "analyze")
+            ),
+            retry=True
+        )
+        response.raise_for_status()
+        result = response.json()
+        result["xray_replica"] = resilience.replica_of("xray", response)
+        return result
+    except httpx.RequestError as e:
+        raise Exception(f"Could not connect to X-Ray service: {e}")
+    except httpx.HTTPStatusError as e:
+        raise Exception(f"X-Ray service returned an error: {e.response.text}")
 
 async def call_xray_compare(previous_xray: UploadFile, current_xray: UploadFile) -> dict:
     """Calls the external X-Ray AI service to compare two images."""
@@ -27,33 +45,128 @@ async def call_xray_compare(previous_xray: UploadFile, current_xray: UploadFile)
         'previous_xray': (previous_xray.filename, await previous_xray.read(), previous_xray.content_type),
         'current_xray': (current_xray.filename, await current_xray.read(), current_xray.content_type)
     }
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{settings.XRAY_SERVICE_URL}/compare",
+    try:
+        # Not retried (the default): it runs a billed Gemini call
+        response = await resilience.request(
+            "xray",
+            "compare",
+            lambda client: client.post(
+                "/compare",
                 files=files,
-                timeout=90.0
+                timeout=timeout_for("xray", "compare")
             )
-            response.raise_for_status()
-            return response.json()
-        except httpx.RequestError as e:
-            raise Exception(f"Could not connect to X-Ray service for comparison: {e}")
-        except httpx.HTTPStatusError as e:
-            raise Exception(f"X-Ray comparison service returned an error: {e.response.text}")
+        )
+        response.raise_for_status()
+        return response.json()
+    except httpx.RequestError as e:
+        raise Exception(f"Could not connect to X-Ray service for comparison: {e}")
+    except httpx.HTTPStatusError as e:
+        raise Exception(f"X-Ray comparison service returned an error: {e.response.text}")
 
 async def call_xray_qna(context: str, question: str) -> dict:
     """Calls the external X-Ray AI service for Q&A."""
     payload = {"report_context": context, "question": question}
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{settings.XRAY_SERVICE_URL}/qna",
+    try:
+        # Not retried (the default): it runs a billed Gemini call
+        response = await resilience.request(
+            "xray",
+            "qna",
+            lambda client: client.post(
+                "/qna",
                 json=payload,
-                timeout=30.0
+                timeout=timeout_for("xray", "qna")
+            )
+        )
+        response.raise_for_status()
+        return response.json()
+    except httpx.RequestError as e:
+        raise Exception(f"Could not connect to X-Ray Q&A service: {e}")
+    except httpx.HTTPStatusError as e:
+        raise Exception(f"X-Ray Q&A service returned an error: {e.response.text}")
+
+async def call_xray_compare_reports(previous_report: str, current_report: str) -> dict:
+    """Calls the external X-Ray AI service to compare two stored findings reports (no images)."""
+    payload = {"previous_report": previous_report, "current_report": current_report}
+    try:
+        # Not retried (the default): it runs a billed Gemini call
+        response = await resilience.request(
+            "xray",
+            "compare_reports",
+            lambda client: client.post(
+                "/compare_reports",
+                json=payload,
+                timeout=timeout_for("xray", "compare_reports")
+            )
+        )
+        response.raise_for_status()
+        return response.json()
+    except httpx.RequestError as e:
+        raise Exception(f"Could not connect to X-Ray service for comparison: {e}")
+    except httpx.HTTPStatusError as e:
+        raise Exception(f"X-Ray comparison service returned an error: {e.response.text}")
+
+async def call_xray_compare_with_baseline(baseline_report: str, current_xray: UploadFile) -> dict:
+    """
+    Calls the external X-Ray AI service to compare a stored baseline report
+    with a new image. Only the new image is uploaded and analyzed.
+    """
+    files = {'current_xray': (current_xray.filename, await current_xray.read(), current_xray.content_type)}
+    try:
+        # Not retried (the default): it runs a billed Gemini call
+        response = await resilience.request(
+            "xray",
+            "compare_with_baseline",
+            lambda client: client.post(
+                "/compare_with_baseline",
+                data={"baseline_report": baseline_report},
+                files=files,
+                timeout=timeout_for("xray", "compare_with_baseline")
             )
-            response.raise_for_status()
-            return response.json()
-        except httpx.RequestError as e:
-            raise Exception(f"Could not connect to X-Ray Q&A service: {e}")
-        except httpx.HTTPStatusError as e:
-            raise Exception(f"X-Ray Q&A service returned an error: {e.response.text}")
+        )
+        response.raise_for_status()
+        return response.json()
+    except httpx.RequestError as e:
+        raise Exception(f"Could not connect to X-Ray service for comparison: {e}")
+    except httpx.HTTPStatusError as e:
+        raise Exception(f"X-Ray comparison service returned an error: {e.response.text}")
+
+async def fetch_xray_segmentation(analysis_id: str, pathology: str = None, replica_url: str = None) -> bytes:
+    """
+    Fetches the PNG activation overlay of a recent analysis from the X-Ray AI service.
+
+    Args:
+        analysis_id (str): The analysis id returned by /analyze.
+        pathology (str, optional): Only this class' map; all of them by default.
+        replica_url (str, optional): The replica that ran the analysis (its
+            "xray_replica"). The call is pinned to it, without failover.
+            Older reports don't record it and go to any replica.
+
+    Returns:
+        bytes: The PNG, or None if the service no longer holds the maps.
+    """
+    params = {"pathology": pathology} if pathology else None
+
+    def send(client):
+        return client.get(
+            f"/segmentation/{analysis_id}",
+            params=params,
+            timeout=timeout_for("xray", "segmentation")
+        )
+
+    try:
+        if replica_url:
+            try:
+                response = await resilience.request_to("xray", replica_url, "segmentation", send)
+            except ValueError:
+                # The replica is no longer configured, and its maps went with it
+                return None
+        else:
+            response = await resilience.request("xray", "segmentation", send, retry=True)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.content
+    except httpx.RequestError as e:
+        raise Exception(f"Could not connect to X-Ray service: {e}")
+    except httpx.HTTPStatusError as e:
+        raise Exception(f"X-Ray service returned an error: {e.response.text}")
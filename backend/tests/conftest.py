@@ -0,0 +1,8 @@
+# app/tests/conftest.py
+
+import os
+import sys
+
+# Modules import each other from the backend root (e.g. `from core.config
+# import settings`), as when the app runs from there.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
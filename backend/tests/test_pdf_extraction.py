@@ -0,0 +1,64 @@
+# app/tests/test_pdf_extraction.py
+
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("pdfplumber")
+pytest.importorskip("pydantic_settings")
+
+from core.config import settings
+from services import pdf_extraction
+
+# A range that takes far longer than any budget in these tests
+SLOW_SECONDS = 120
+
+
+# Stand-ins for the worker functions. They live at module level so the
+# spawned worker processes can import them.
+def two_pages(source) -> int:
+    return 2
+
+
+def slow_range(source, start: int, end: int) -> list:
+    time.sleep(SLOW_SECONDS)
+    return ["" for _ in range(start, end)]
+
+
+def fast_range(source, start: int, end: int) -> list:
+    return [f"page {page}\n" for page in range(start, end)]
+
+
+@pytest.fixture
+def single_worker(monkeypatch):
+    """One worker process, one page per task, and a fake two-page document."""
+    monkeypatch.setattr(settings, "PDF_EXTRACT_WORKERS", 1)
+    monkeypatch.setattr(settings, "PDF_PAGES_PER_TASK", 1)
+    monkeypatch.setattr(pdf_extraction, "_count_pages", two_pages)
+    pdf_extraction.shutdown_pool()
+    pdf_extraction.start_pool()
+    yield
+    pdf_extraction.shutdown_pool()
+
+
+def test_extracts_pages_in_order(single_worker, monkeypatch):
+    monkeypatch.setattr(pdf_extraction, "_extract_page_range", fast_range)
+    assert asyncio.run(pdf_extraction.extract_text(b"%PDF", timeout=60)) == "page 0\npage 1\n"
+
+
+def test_timeout_frees_the_workers(single_worker, monkeypatch):
+    monkeypatch.setattr(pdf_extraction, "_extract_page_range", slow_range)
+    restarts = pdf_extraction.pool_stats()["pool_restarts"]
+    started = time.monotonic()
+    with pytest.raises(pdf_extraction.PdfExtractionTimeout):
+        asyncio.run(pdf_extraction.extract_text(b"%PDF", timeout=2))
+    assert time.monotonic() - started < 10
+    assert pdf_extraction.pool_stats()["pool_restarts"] == restarts + 1
+
+    # The only worker was busy with the slow range; had it been left
+    # running, this document would wait for it to finish
+    monkeypatch.setattr(pdf_extraction, "_extract_page_range", fast_range)
+    started = time.monotonic()
+    assert asyncio.run(pdf_extraction.extract_text(b"%PDF", timeout=60)) == "page 0\npage 1\n"
+    assert time.monotonic() - started < SLOW_SECONDS / 2